@@ -0,0 +1,253 @@
+"""Offline benchmark of the real essay graph with fake model and search backends.
+
+Every configuration runs `Agent.graph` end to end in a fresh process, with
+`essay.fakes` standing in for the OpenAI API and Tavily, so it costs no API
+credit and the peak RSS belongs to that configuration alone. Results are
+appended to a JSONL file and compared with the last stored run of the same
+configuration.
+
+    python benchmarks/bench.py --topics 8 32 --revisions 1 2 --concurrency 1 8
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from essay.agent import Agent
+from essay.batch import initial_state, run_item
+from essay.checkpoint import CheckpointStore
+from essay.fakes import AsyncFakeSearch, FakeOpenAI, FakeSearch
+from essay.metrics import Metrics
+from essay.ratelimit import Scheduler
+
+RESULTS = os.path.join(os.path.dirname(__file__), "results.jsonl")
+# critics of the multi critic configurations
+CRITICS = ["structure", "evidence", "style"]
+
+
+async def arun_item(graph, item: dict) -> None:
+    """Async `run_item`, without the resume and timings."""
+    thread = {"configurable": {"thread_id": f"batch-{item['id']}"}}
+    config = initial_state(item["topic"], item["max_revisions"])
+    while True:
+        await graph.ainvoke(config, thread)
+        config = None
+        if not (await graph.aget_state(thread)).next:
+            return
+
+
+async def arun_items(graph, items: list, concurrency: int) -> None:
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(item: dict) -> None:
+        async with limit:
+            await arun_item(graph, item)
+
+    await asyncio.gather(*(run(item) for item in items))
+
+
+def run_config(config: dict) -> dict:
+    """Write the essays of one configuration and measure the run."""
+    with tempfile.TemporaryDirectory(prefix="essay-bench-") as workdir:
+        return measure(config, os.path.join(workdir, "checkpoints.sqlite"))
+
+
+def measure(config: dict, path: str) -> dict:
+    store = CheckpointStore(path, compact_interval=None)
+    metrics = Metrics()
+    agent = Agent(
+        search_cache=None,
+        checkpointer=store,
+        scheduler=Scheduler(),
+        metrics=metrics,
+        model_options=FakeOpenAI(
+            config["llm_latency"], config["token_latency"], config["words"]
+        ).options(),
+        search_client=FakeSearch(config["search_latency"]),
+        asearch_client=AsyncFakeSearch(config["search_latency"]),
+        section_revision=config["revision"] == "sections",
+        critics=CRITICS if config["critics"] == "multi" else None,
+        compress_research=config.get("research") == "notes",
+        notes_cache=None,
+    )
+    items = [
+        {
+            "id": str(i),
+            "topic": f"topic {i}: how policy shapes the economy",
+            "max_revisions": config["revisions"],
+        }
+        for i in range(config["topics"])
+    ]
+    started = time.perf_counter()
+    if config["mode"] == "async":
+        asyncio.run(arun_items(agent.graph, items, config["concurrency"]))
+    else:
+        with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+            list(pool.map(lambda item: run_item(agent.graph, item), items))
+    elapsed = time.perf_counter() - started
+    steps = sum(h.count for h in metrics.node_seconds.values())
+    store.conn.commit()
+    checkpoint_bytes = sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+    store.close()
+    return {
+        "seconds": round(elapsed, 3),
+        "essays_per_second": round(len(items) / elapsed, 3),
+        "steps_per_second": round(steps / elapsed, 2),
+        "checkpoint_bytes": checkpoint_bytes,
+        # kilobytes on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "nodes": {
+            node: {
+                "p50": round(hist.percentile(50), 4),
+                "p95": round(hist.percentile(95), 4),
+                "p99": round(hist.percentile(99), 4),
+                "runs": hist.count,
+                "prompt_tokens": metrics.nodes[node]["prompt_tokens"],
+                "completion_tokens": metrics.nodes[node]["completion_tokens"],
+            }
+            for node, hist in sorted(metrics.node_seconds.items())
+        },
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def previous_runs(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--topics", type=int, nargs="+", default=[8])
+    parser.add_argument("--revisions", type=int, nargs="+", default=[2])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument(
+        "--mode", nargs="+", choices=["sync", "async"], default=["sync"]
+    )
+    parser.add_argument(
+        "--revision", nargs="+", choices=["sections", "full"], default=["sections"]
+    )
+    parser.add_argument(
+        "--critics", nargs="+", choices=["single", "multi"], default=["single"]
+    )
+    parser.add_argument(
+        "--research", nargs="+", choices=["raw", "notes"], default=["raw"]
+    )
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--words", type=int, default=300, help="words per reply")
+    parser.add_argument("--results", default=RESULTS, help="JSONL file of the runs")
+    parser.add_argument("--label", default="", help="note stored with the results")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:  # child process of one configuration
+        print(json.dumps(run_config(json.loads(args.run))))
+        return
+
+    history = previous_runs(args.results)
+    print(
+        "topics  rev  conc  mode   revision  critics  research  seconds  essays/s"
+        "  steps/s  ckpt KB  peak MB  p95 generate  gen tok/essay  gen prompt/essay"
+        "  vs last"
+    )
+    for (
+        topics,
+        revisions,
+        concurrency,
+        mode,
+        revision,
+        critics,
+        research,
+    ) in itertools.product(
+        args.topics,
+        args.revisions,
+        args.concurrency,
+        args.mode,
+        args.revision,
+        args.critics,
+        args.research,
+    ):
+        config = {
+            "topics": topics,
+            "revisions": revisions,
+            "concurrency": concurrency,
+            "mode": mode,
+            "revision": revision,
+            "critics": critics,
+            "research": research,
+            "llm_latency": args.llm_latency,
+            "token_latency": args.token_latency,
+            "search_latency": args.search_latency,
+            "words": args.words,
+        }
+        child = subprocess.run(
+            [sys.executable, __file__, "--run", json.dumps(config)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(child.stdout.splitlines()[-1])
+        last = next((r for r in reversed(history) if r["config"] == config), None)
+        change = ""
+        if last:
+            before = last["result"]["essays_per_second"]
+            change = f"{(result['essays_per_second'] / before - 1) * 100:+.1f}%"
+        generate = result["nodes"].get("generate", {})
+        p95 = generate.get("p95", 0)
+        generated = generate.get("completion_tokens", 0) / topics
+        # research content and draft the writer reads, what notes shrink
+        prompted = generate.get("prompt_tokens", 0) / topics
+        print(
+            f"{topics:6d}  {revisions:3d}  {concurrency:4d}  {mode:5s}"
+            f"  {revision:8s}  {critics:7s}  {research:8s}"
+            f"  {result['seconds']:7.2f}  {result['essays_per_second']:8.2f}"
+            f"  {result['steps_per_second']:7.1f}"
+            f"  {result['checkpoint_bytes'] / 1024:7.0f}  {result['peak_rss_mb']:7.1f}"
+            f"  {p95:12.3f}  {generated:13.0f}  {prompted:16.0f}  {change:>7s}"
+        )
+        with open(args.results, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "commit": commit(),
+                        "label": args.label,
+                        "config": config,
+                        "result": result,
+                    }
+                )
+                + "\n"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Load test of EssayGui sessions against a fake graph.
+
+Every simulated session starts a thread and continues it until the graph ends,
+the way a user clicks "Generate Essay" and "Continue Essay". The sessions run
+`EssayGui.arun_agent` on one event loop like the gradio handlers, at most
+`--max-runs` at once like their concurrency limit. Nodes only sleep, so the
+numbers measure the interface and not the model.
+
+    python benchmarks/loadtest.py --sessions 1 2 4 8 16 --max-runs 8
+"""
+
+import argparse
+import asyncio
+import time
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, StateGraph
+
+from essay.agent import AgentState
+from essay.gui import EssayGui
+
+NODES = ["planner", "research_plan", "generate", "reflect", "research_critique"]
+
+
+def build_fake_graph(latency: float):
+    """Graph with the nodes and interrupts of `Agent.graph` whose nodes sleep
+    for `latency` seconds and write values derived from the task.
+    """
+
+    def node(name):
+        def update(state: AgentState) -> dict:
+            update = {"lnode": name, "count": 1}
+            if name == "generate":
+                update["draft"] = f"draft of {state['task']}"
+                update["revisions"] = state.get("revisions", 1) + 1
+            return update
+
+        def run(state: AgentState) -> dict:
+            time.sleep(latency)
+            return update(state)
+
+        async def arun(state: AgentState) -> dict:
+            await asyncio.sleep(latency)
+            return update(state)
+
+        return RunnableLambda(run, arun, name=name)
+
+    builder = StateGraph(AgentState)
+    for name in NODES:
+        builder.add_node(name, node(name))
+    builder.set_entry_point("planner")
+    builder.add_conditional_edges(
+        "generate",
+        lambda s: END if s["revisions"] > s["max_revisions"] else "reflect",
+        {END: END, "reflect": "reflect"},
+    )
+    builder.add_edge("planner", "research_plan")
+    builder.add_edge("research_plan", "generate")
+    builder.add_edge("reflect", "research_critique")
+    builder.add_edge("research_critique", "generate")
+    return builder.compile(checkpointer=InMemorySaver(), interrupt_after=NODES)
+
+
+async def run_session(gui: EssayGui, runs: asyncio.Semaphore, topic: str) -> tuple:
+    """Write one essay in a new session, stopping after every node."""
+    session = gui.new_session()
+    start = True
+    while True:
+        # the semaphore stands in for the concurrency limit of the run events
+        async with runs:
+            async for _ in gui.arun_agent(session, start, topic, NODES):
+                pass
+        start = False
+        lnode, nnode, *_ = await gui.aget_disp_state(session)
+        if not nnode:
+            state = await gui.graph.aget_state(session.thread)
+            return session, state.values
+
+
+async def run_sessions(gui: EssayGui, topics: list) -> list:
+    runs = asyncio.Semaphore(gui.max_runs)
+    return await asyncio.gather(*(run_session(gui, runs, t) for t in topics))
+
+
+def check_isolation(gui: EssayGui, results: list, topics: list) -> None:
+    thread_ids = [session.thread_id for session, _ in results]
+    assert len(set(thread_ids)) == len(thread_ids), "sessions shared a thread"
+    for (session, values), topic in zip(results, topics):
+        assert session.threads == [session.thread_id], "session saw other threads"
+        assert values["task"] == topic, "session ran another session's topic"
+        assert values["draft"] == f"draft of {topic}", "state leaked between threads"
+        assert len(gui.events.entries(session.thread_id)) == values["count"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max-runs", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print("sessions  seconds  essays/s  steps/s")
+    for n in args.sessions:
+        gui = EssayGui(build_fake_graph(args.latency), max_runs=args.max_runs)
+        topics = [f"topic {i}" for i in range(n)]
+        started = time.perf_counter()
+        results = asyncio.run(run_sessions(gui, topics))
+        elapsed = time.perf_counter() - started
+        check_isolation(gui, results, topics)
+        steps = sum(values["count"] for _, values in results)
+        print(f"{n:8d}  {elapsed:7.2f}  {n / elapsed:8.2f}  {steps / elapsed:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
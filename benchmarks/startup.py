@@ -0,0 +1,126 @@
+"""Startup profile of the essay app: import time per module and time to a
+listening port.
+
+The app runs in fresh processes, in a temporary directory and without API
+keys, the way a new container starts.
+
+    python benchmarks/startup.py --top 15 --runs 3
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+STAGES = """
+import json, time
+started = time.perf_counter()
+from essay.app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.demo.launch(prevent_thread_lock=True)
+launched = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": created - imported,
+    "launch": launched - created,
+}))
+app.demo.close()
+"""
+
+
+def environment(port: int) -> dict:
+    env = dict(os.environ, GRADIO_SERVER_PORT=str(port), GRADIO_ANALYTICS_ENABLED="0")
+    for key in ("OPENAI_API_KEY", "TAVILY_API_KEY", "PORT1"):
+        env.pop(key, None)
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_times(top: int) -> list:
+    """Modules with the largest cumulative import time of `essay.app`, with
+    their nesting depth in the import tree.
+    """
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import essay.app"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative) / 1e6, depth, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def time_to_port(workdir: str, timeout: float = 120) -> float:
+    """Seconds from starting `essay gui` to its port accepting connections."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from essay.cli import main; main(['gui'])"],
+        cwd=workdir,
+        env=environment(port),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"essay gui exited with {process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"port {port} not open after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    parser.add_argument("--runs", type=int, default=3, help="cold starts to time")
+    args = parser.parse_args()
+
+    print("cumulative import time of essay.app")
+    for seconds, depth, name in import_times(args.top):
+        print(f"  {seconds:6.3f}s  {'  ' * depth}{name}")
+
+    with tempfile.TemporaryDirectory(prefix="essay-startup-") as workdir:
+        child = subprocess.run(
+            [sys.executable, "-c", STAGES],
+            cwd=workdir,
+            env=environment(free_port()),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        line = next(x for x in child.stdout.splitlines() if x.startswith("{"))
+        stages = json.loads(line)
+        print("stages " + ", ".join(f"{k} {v:.2f}s" for k, v in stages.items()))
+        ports = sorted(time_to_port(workdir) for _ in range(args.runs))
+        print(
+            f"time to listening port over {args.runs} runs: "
+            f"min {ports[0]:.2f}s, median {ports[len(ports) // 2]:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
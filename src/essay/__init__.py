@@ -1,2 +1 @@
-def main() -> None:
-    print("Hello from essay!")
+from essay.cli import main
@@ -1,36 +1,113 @@
+import asyncio
+import contextvars
+import logging
 import operator
 import os
-import sqlite3
-from typing import Annotated, List, TypedDict
+import re
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import cached_property
+from typing import (
+    Annotated,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypedDict,
+    get_type_hints,
+)
 
 from dotenv import find_dotenv, load_dotenv
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import END, StateGraph
+from langgraph.types import Send
 from pydantic import BaseModel, Field
-from tavily import TavilyClient
 
 from essay import prompts
+from essay.cache import LLMCache, SearchCache
+from essay.checkpoint import CheckpointStore
+from essay.context import build_context
+from essay.dedup import IndexCache, jaccard, query_similarity
+from essay.metrics import Metrics, default_metrics, instrument
+from essay.notes import (
+    NotesCache,
+    batches,
+    cited_notes,
+    dump_notes,
+    load_notes,
+    missing_notes,
+    number_snippets,
+    snippet_key,
+)
+from essay.ratelimit import ScheduledClient, Scheduler, default_scheduler
+from essay.retrieval import SearchBackend
+from essay.revision import join_sections, number_sections, splice, split_sections
 
 _ = load_dotenv(find_dotenv())
-# Inmemory ssqlite3 database
-conn = sqlite3.connect(":memory:", check_same_thread=False)
-memory = SqliteSaver(conn)
+logger = logging.getLogger(__name__)
+
+# Last line of a critique finding nothing major left to revise
+NO_MAJOR_ISSUES = re.compile(r"verdict:\W*no major issues", re.IGNORECASE)
+
+
+def last_value(_, new):
+    return new
+
+
+def add_notes(notes: Optional[list], new: Optional[list]) -> list:
+    """Notes of the critics running in parallel, None clears them."""
+    return [] if new is None else (notes or []) + new
 
 
 # Create state object
 class AgentState(TypedDict):
     task: str
-    lnode: str
+    # the parallel critics all write it in one step
+    lnode: Annotated[str, last_value]
     outline: str
     draft: str
     critique: str
     content: List[str]
+    content_dropped: Annotated[int, operator.add]
     queries: List[str]
     count: Annotated[int, operator.add]
     revisions: int
     max_revisions: int
+    context_stats: dict
+    revised_sections: List[int]
+    draft_change: float
+    stop_reason: str
+    critic_notes: Annotated[List[dict], add_notes]
+    # queries searched in the thread, each research node writes the whole
+    # list so that it goes back with the content when an older state is copied
+    searched: List[str]
+    searches_skipped: Annotated[int, operator.add]
+    # set while research runs without a search backend, the critics write it
+    # in one step
+    search_unavailable: Annotated[bool, last_value]
+    # condensed research content by snippet key as one JSON string, see
+    # `compress_node` and `dump_notes`
+    notes: str
+    notes_stats: dict
+
+
+# State keys the graph accumulates with a reducer instead of overwriting
+ACCUMULATED = tuple(
+    key
+    for key, hint in get_type_hints(AgentState, include_extras=True).items()
+    if any(
+        callable(reducer) and reducer is not last_value
+        for reducer in getattr(hint, "__metadata__", ())
+    )
+)
+
+
+def critics_from_env() -> List[str]:
+    """Critics named in ESSAY_CRITICS, e.g. "structure,evidence,style"."""
+    return [c.strip() for c in os.getenv("ESSAY_CRITICS", "").split(",") if c.strip()]
 
 
 # pydantic model for strutured output
@@ -40,13 +117,94 @@ class Queries(BaseModel):
     )
 
 
+# pydantic models for the structured output of the focused critics
+class CritiquePoint(BaseModel):
+    priority: int = Field(
+        description="1 for a major issue, 2 for an important one, 3 for a minor one."
+    )
+    issue: str = Field(description="the problem found in the essay.")
+    recommendation: str = Field(description="how to fix it.")
+
+
+class FocusedCritique(BaseModel):
+    points: List[CritiquePoint] = Field(
+        description="problems of the reviewed aspect, leave it empty if none."
+    )
+    queries: List[str] = Field(
+        description="at most 2 search queries gathering information the revision needs."
+    )
+
+
+# pydantic models for mapping the critique to the sections of the draft
+class SectionEdit(BaseModel):
+    section: int = Field(description="number of the section to revise.")
+    instructions: str = Field(
+        description="the critique points this section must address."
+    )
+
+
+class SectionEdits(BaseModel):
+    rewrite: bool = Field(
+        description="whether the essay must be rewritten as a whole instead."
+    )
+    edits: List[SectionEdit] = Field(
+        description="sections the critique asks to change, leave out the others."
+    )
+
+
+# pydantic models for condensing the research snippets into notes
+class SnippetNote(BaseModel):
+    snippet: int = Field(description="number of the snippet, as labelled.")
+    notes: str = Field(
+        description="compact notes of the snippet, empty if it has nothing usable."
+    )
+
+
+class SnippetNotes(BaseModel):
+    notes: List[SnippetNote] = Field(description="notes of every snippet.")
+
+
 # Agent class that implements the essay writing agent
 class Agent:
     def __init__(
         self,
+        max_search_workers: int = 4,
+        search_timeout: int = 20,
+        search_round_timeout: float = 60,
+        search_cache: Optional[str] = "essay_cache.sqlite",
+        search_cache_ttl: int = 24 * 60 * 60,
+        llm_cache: Optional[str] = None,
+        context_budget: int = 6000,
+        dedup_threshold: float = 0.8,
+        checkpointer: Optional[BaseCheckpointSaver] = None,
+        scheduler: Optional[Scheduler] = None,
+        metrics: Optional[Metrics] = None,
+        model_options: Optional[dict] = None,
+        search_client=None,
+        asearch_client=None,
+        search_backend: Optional[SearchBackend] = None,
+        section_revision: bool = True,
+        min_draft_change: float = 0.05,
+        stop_on_approval: bool = True,
+        critics: Optional[Sequence[str]] = None,
+        query_memo_threshold: Optional[float] = 0.75,
+        compress_research: bool = False,
+        notes_batch_size: int = 8,
+        notes_cache: Optional[str] = "essay_cache.sqlite",
     ) -> None:
-        # Model to use
-        self.model = ChatOpenAI(model="gpt-4o", temperature=0)
+        # Rate limits and retries of the API calls, shared by the process
+        self.scheduler = scheduler or default_scheduler()
+        # Wall time, tokens and cost of the nodes, shared by the process
+        self.metrics = metrics or default_metrics()
+        # The model and the search clients are built on first use, see below
+        self.llm_cache = llm_cache
+        self.model_options = model_options or {}
+        self.search_cache = search_cache
+        self.search_cache_ttl = search_cache_ttl
+        self.search_client = search_client
+        self.asearch_client = asearch_client
+        # e.g. a LocalIndex, searched as is instead of the Tavily clients
+        self.search_backend = search_backend
 
         # Prompts for nodes
         self.PLAN_PROMPT = prompts.OUTLINE_PROMPT
@@ -54,37 +212,164 @@ class Agent:
         self.RESEARCH_PLAN_PROMPT = prompts.RESEARCH_PLAN_PROMPT
         self.REFLECTION_PROMPT = prompts.REFLECTION_PROMPT
         self.RESEARCH_CRITIQUE_PROMPT = prompts.RESEARCH_CRITIQUE_PROMPT
+        self.SECTION_MAP_PROMPT = prompts.SECTION_MAP_PROMPT
+        self.SECTION_WRITER_PROMPT = prompts.SECTION_WRITER_PROMPT
+        self.CRITIC_PROMPT = prompts.CRITIC_PROMPT
+        self.NOTES_PROMPT = prompts.NOTES_PROMPT
+        # Tokens of research content the writer prompt may hold
+        self.context_budget = context_budget
+        # Similarity above which new research content is a near duplicate
+        self.dedup_threshold = dedup_threshold
+        self.dedup_indexes = IndexCache(dedup_threshold)
+        # Similarity above which a query repeats one already searched in the
+        # thread, its results are in the content already. None searches all.
+        self.query_memo_threshold = query_memo_threshold
+        # Revisions regenerate only the sections the critique concerns
+        self.section_revision = section_revision
+        # The loop stops early once a revision changes less than this share of
+        # the draft, or when the critic finds no major issues left
+        self.min_draft_change = min_draft_change
+        self.stop_on_approval = stop_on_approval
+        # Focused critics, e.g. structure, evidence and style, that review the
+        # draft and research their points in parallel. None keeps the single
+        # critique followed by its research.
+        self.critics = list(critics or [])
+        if unknown := set(self.critics) - set(prompts.CRITIC_FOCUS):
+            raise ValueError(f"unknown critics: {', '.join(sorted(unknown))}")
+        # New research content is condensed into numbered notes before each
+        # draft, in parallel batches, and the writer only reads the notes.
+        # They are kept in the thread and cached on disk by snippet.
+        self.compress_research = compress_research
+        self.notes_batch_size = notes_batch_size
+        self.notes_cache_path = notes_cache
 
-        # Search tool
-        self.tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+        # Searches of a research round run concurrently on a bounded pool
+        # shared by every thread of the graph, or on the event loop.
+        self.search_timeout = search_timeout
+        # A round gives up on the searches still queued or running after
+        # this, however long they waited for the pool
+        self.search_round_timeout = search_round_timeout
+        self.max_search_workers = max_search_workers
+        self.search_pool = ThreadPoolExecutor(
+            max_workers=max_search_workers, thread_name_prefix="essay-search"
+        )
+        self.search_limits = weakref.WeakKeyDictionary()
 
         # Build graph
         builder = StateGraph(AgentState)
-        builder.add_node("planner", self.plan_node)
-        builder.add_node("research_plan", self.research_plan_node)
-        builder.add_node("generate", self.generation_node)
-        builder.add_node("reflect", self.reflection_node)
-        builder.add_node("research_critique", self.research_critique_node)
+        # every node has a sync and an async version, `graph.invoke` runs the
+        # first and `graph.ainvoke` the second. Both record their wall time
+        # and usage in the metrics.
+        nodes = {
+            "planner": (self.plan_node, self.aplan_node),
+            "research_plan": (self.research_plan_node, self.aresearch_plan_node),
+            "generate": (self.generation_node, self.ageneration_node),
+        }
+        if self.compress_research:
+            nodes["compress"] = (self.compress_node, self.acompress_node)
+        if self.critics:
+            nodes["critic"] = (self.critic_node, self.acritic_node)
+            nodes["reflect"] = (self.merge_critiques_node, self.amerge_critiques_node)
+        else:
+            nodes["reflect"] = (self.reflection_node, self.areflection_node)
+            nodes["research_critique"] = (
+                self.research_critique_node,
+                self.aresearch_critique_node,
+            )
+        for name, (func, afunc) in nodes.items():
+            builder.add_node(name, instrument(name, func, afunc, self.metrics))
         builder.set_entry_point("planner")
-        builder.add_conditional_edges(
-            "generate", self.should_continue, {END: END, "reflect": "reflect"}
-        )
         # add edges
+        # research goes through compress, when enabled, on its way to generate
+        self.writer = "compress" if self.compress_research else "generate"
         builder.add_edge("planner", "research_plan")
-        builder.add_edge("research_plan", "generate")
-        builder.add_edge("reflect", "research_critique")
-        builder.add_edge("research_critique", "generate")
-        memory = SqliteSaver(conn=sqlite3.connect(":memory:", check_same_thread=False))
-        self.graph = builder.compile(
-            checkpointer=memory,
-            interrupt_after=[
-                "planner",
-                "generate",
+        builder.add_edge("research_plan", self.writer)
+        if self.compress_research:
+            builder.add_edge("compress", "generate")
+        if self.critics:
+            # the critics fan out from generate and fan in at reflect, which
+            # merges their critiques and research
+            builder.add_conditional_edges(
+                "generate", self.should_continue, {END: END, "critic": "critic"}
+            )
+            builder.add_edge("critic", "reflect")
+            builder.add_conditional_edges(
+                "reflect", self.should_continue, {END: END, self.writer: self.writer}
+            )
+        else:
+            builder.add_conditional_edges(
+                "generate", self.should_continue, {END: END, "reflect": "reflect"}
+            )
+            builder.add_conditional_edges(
                 "reflect",
-                "research_plan",
-                "research_critique",
-            ],
+                self.should_continue,
+                {END: END, "research_critique": "research_critique"},
+            )
+            builder.add_edge("research_critique", self.writer)
+        # Checkpoints are kept on disk, see CheckpointStore for the retention
+        self.checkpointer = checkpointer or CheckpointStore()
+        self.graph = builder.compile(
+            checkpointer=self.checkpointer,
+            interrupt_after=list(nodes),
+        )
+
+    @cached_property
+    def model(self):
+        """Chat model, built on first use so that importing and compiling the
+        agent does not load the OpenAI client.
+        """
+        from essay.llm import ScheduledChatOpenAI
+
+        cache = None
+        if self.llm_cache:
+            cache = LLMCache(self.llm_cache)
+            self.metrics.register_cache("llm", cache)
+        # at temperature 0 its answers can be replayed from a cache. The
+        # scheduler retries failed calls, the client must not retry on its own.
+        return ScheduledChatOpenAI(
+            model="gpt-4o",
+            temperature=0,
+            cache=cache,
+            max_retries=0,
+            stream_usage=True,
+            limiter=self.scheduler.limiter("openai"),
+            # e.g. the client options of essay.fakes.FakeOpenAI
+            **self.model_options,
+        )
+
+    @cached_property
+    def notes_cache(self) -> Optional[NotesCache]:
+        """On-disk notes of research snippets, None when disabled."""
+        if not self.notes_cache_path:
+            return None
+        cache = NotesCache(self.notes_cache_path, self.NOTES_PROMPT)
+        self.metrics.register_cache("notes", cache)
+        return cache
+
+    @cached_property
+    def searcher(self) -> SearchBackend:
+        """Search backend of the research nodes, the given `search_backend` or
+        the rate limited and cached Tavily clients. Built on first use so a
+        missing TAVILY_API_KEY fails the searches and not the startup.
+        """
+        if self.search_backend is not None:
+            return self.search_backend
+
+        from tavily import AsyncTavilyClient, TavilyClient
+
+        search_client, asearch_client = self.search_client, self.asearch_client
+        if search_client is None:
+            search_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+            asearch_client = AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        # without an async client `asearch` runs the sync one in a thread
+        client = ScheduledClient(
+            search_client, self.scheduler.limiter("search"), asearch_client
         )
+        if self.search_cache:
+            # answers repeated queries from disk, shared by threads and restarts
+            client = SearchCache(client, self.search_cache, ttl=self.search_cache_ttl)
+            self.metrics.register_cache("search", client)
+        return client
 
     def plan_node(self, state: AgentState) -> dict:
         """node to generate an outline for the essay.
@@ -93,18 +378,28 @@ class Agent:
         Returns:
             dict: A dictionary with the outline and next node and count.
         """
+        response = self.model.invoke(self.plan_messages(state))
+        return {
+            "outline": response.content,
+            "lnode": "planner",
+            "count": 1,
+        }
 
-        messages = [
-            SystemMessage(content=self.PLAN_PROMPT),
-            HumanMessage(content=state["task"]),
-        ]
-        response = self.model.invoke(messages)
+    async def aplan_node(self, state: AgentState) -> dict:
+        """Async `plan_node`."""
+        response = await self.model.ainvoke(self.plan_messages(state))
         return {
             "outline": response.content,
             "lnode": "planner",
             "count": 1,
         }
 
+    def plan_messages(self, state: AgentState) -> list:
+        return [
+            SystemMessage(content=self.PLAN_PROMPT),
+            HumanMessage(content=state["task"]),
+        ]
+
     def research_plan_node(self, state: AgentState) -> dict:
         """Node to genrate a research plan based on the outline of the plan node
 
@@ -112,51 +407,319 @@ class Agent:
             state (AgentState): state of the agent
         Returns:
             dict: dictionary eith the content, next node and count and the \
-                generated queries.
+                generated queries, the number of duplicate results dropped \
+                and the searches run and skipped.
         """  # noqa: E501
         queries = self.model.with_structured_output(Queries).invoke(
-            [
-                SystemMessage(content=self.RESEARCH_PLAN_PROMPT),
-                HumanMessage(content=state["task"]),
-            ]
+            self.research_plan_messages(state)
         )
-        content = state["content"] or []  # add to content
-        for q in queries.queries:
-            response = self.tavily.search(query=q, max_results=2)
-            for r in response["results"]:
-                content.append(r["content"])
+        results, searches = self.research(state, queries.queries)
+        content, dropped = self.add_content(state, results)
         return {
             "content": content,
+            "content_dropped": dropped,
             "queries": queries.queries,
+            **searches,
             "lnode": "research_plan",
             "count": 1,
         }
 
+    async def aresearch_plan_node(self, state: AgentState) -> dict:
+        """Async `research_plan_node`."""
+        queries = await self.model.with_structured_output(Queries).ainvoke(
+            self.research_plan_messages(state)
+        )
+        results, searches = await self.aresearch(state, queries.queries)
+        content, dropped = self.add_content(state, results)
+        return {
+            "content": content,
+            "content_dropped": dropped,
+            "queries": queries.queries,
+            **searches,
+            "lnode": "research_plan",
+            "count": 1,
+        }
+
+    def research_plan_messages(self, state: AgentState) -> list:
+        return [
+            SystemMessage(content=self.RESEARCH_PLAN_PROMPT),
+            HumanMessage(content=state["task"]),
+        ]
+
+    def compress_node(self, state: AgentState) -> dict:
+        """Node condensing the research content gathered since the last draft
+        into notes, a map over batches of snippets run in parallel. Each
+        snippet is condensed once, its notes are kept in the thread and in
+        the notes cache.
+
+        Args:
+            state (AgentState): state of the agent.
+
+        Returns:
+            dict: dictionary with the notes, their stats, last node and count.
+        """
+        notes, cached, todo = self.notes_todo(state)
+        calls = [
+            self.notes_messages(batch) for batch in batches(todo, self.notes_batch_size)
+        ]
+        responses = self.model.with_structured_output(SnippetNotes).batch(calls)
+        return self.new_notes(notes, cached, todo, responses)
+
+    async def acompress_node(self, state: AgentState) -> dict:
+        """Async `compress_node`."""
+        notes, cached, todo = self.notes_todo(state)
+        calls = [
+            self.notes_messages(batch) for batch in batches(todo, self.notes_batch_size)
+        ]
+        responses = await self.model.with_structured_output(SnippetNotes).abatch(calls)
+        return self.new_notes(notes, cached, todo, responses)
+
+    def notes_todo(self, state: AgentState) -> tuple:
+        """Notes of the thread, the notes found in the cache and the snippets
+        without notes to condense.
+        """
+        notes = load_notes(state.get("notes"))
+        cached, todo = missing_notes(state["content"] or [], notes, self.notes_cache)
+        return notes, cached, todo
+
+    def notes_messages(self, snippets: List[str]) -> list:
+        return [
+            SystemMessage(content=self.NOTES_PROMPT),
+            HumanMessage(content=number_snippets(snippets)),
+        ]
+
+    def new_notes(
+        self,
+        notes: Dict[str, Optional[str]],
+        cached: Dict[str, str],
+        todo: List[str],
+        responses: List[SnippetNotes],
+    ) -> dict:
+        """State update adding the cached and the new notes to the thread."""
+        notes.update(cached)
+        for batch, response in zip(batches(todo, self.notes_batch_size), responses):
+            written = {}
+            for note in response.notes:
+                # numbers the model made up are ignored
+                if 1 <= note.snippet <= len(batch):
+                    written.setdefault(note.snippet - 1, note.notes)
+            for i, snippet in enumerate(batch):
+                key = snippet_key(snippet)
+                if i not in written:
+                    # a snippet the model skipped is given to the writer as is
+                    notes[key] = None
+                    continue
+                notes[key] = written[i]
+                if self.notes_cache is not None:
+                    self.notes_cache.set(key, written[i])
+        stats = {
+            "snippets": len(cached) + len(todo),
+            "cached": len(cached),
+            "condensed": len(todo),
+            "calls": len(responses),
+        }
+        logger.info(
+            "notes of %(snippets)s new snippets, %(cached)s cached, "
+            "%(condensed)s condensed in %(calls)s calls",
+            stats,
+        )
+        return {
+            "notes": dump_notes(notes),
+            "notes_stats": stats,
+            "lnode": "compress",
+            "count": 1,
+        }
+
+    def research_content(self, state: AgentState) -> List[str]:
+        """Research content the writer ranks and packs: the snippets, or their
+        numbered notes when the research is compressed.
+        """
+        content = state["content"] or []
+        if not self.compress_research:
+            return content
+        return cited_notes(content, load_notes(state.get("notes")))
+
     def generation_node(self, state: AgentState) -> dict:
         """Node to genearte the draft of the essay based on the
             outline and content gathered from the reserch plan node.
+            A revision only regenerates the sections the critique concerns,
+            see `revise_sections`.
 
         Args:
             state (AgentState): state of the agent
 
         Returns:
-            dict: a dictionary that returns the draft, next node, count and number of revisions.
+            dict: a dictionary that returns the draft, next node, count, number of revisions
+                the revised sections and the token counts of the research content before and after packing.
         """  # noqa: E501
-        content = "\n\n".join(state["content"] or [])
+        if sections := self.draft_sections(state):
+            plan = self.model.with_structured_output(SectionEdits).invoke(
+                self.section_map_messages(state, sections)
+            )
+            edits = self.section_edits(sections, plan)
+            if edits is not None:
+                calls = [self.section_messages(state, sections, i, e) for i, e in edits]
+                # no calls when the critique concerns no section, the draft stays
+                responses = self.model.batch([messages for messages, _ in calls])
+                return self.revise_sections(state, sections, edits, calls, responses)
+        messages, context_stats = self.writer_messages(state)
+        response = self.model.invoke(messages)
+        return self.new_draft(state, response.content, context_stats)
+
+    async def ageneration_node(self, state: AgentState) -> dict:
+        """Async `generation_node`."""
+        if sections := self.draft_sections(state):
+            plan = await self.model.with_structured_output(SectionEdits).ainvoke(
+                self.section_map_messages(state, sections)
+            )
+            edits = self.section_edits(sections, plan)
+            if edits is not None:
+                calls = [self.section_messages(state, sections, i, e) for i, e in edits]
+                # no calls when the critique concerns no section, the draft stays
+                responses = await self.model.abatch([messages for messages, _ in calls])
+                return self.revise_sections(state, sections, edits, calls, responses)
+        messages, context_stats = self.writer_messages(state)
+        response = await self.model.ainvoke(messages)
+        return self.new_draft(state, response.content, context_stats)
+
+    def new_draft(self, state: AgentState, draft: str, context_stats: dict) -> dict:
+        """State update of a new draft, with how much it changed from the last
+        one and why the loop stops after it, if it does.
+        """
+        revisions = state.get("revisions", 1) + 1
+        change = None
+        if state.get("revisions"):
+            change = round(1 - jaccard(state.get("draft") or "", draft), 4)
+        stop_reason = ""
+        if revisions > state["max_revisions"]:
+            stop_reason = "max_revisions"
+        elif change is not None and change < self.min_draft_change:
+            stop_reason = "converged"
+            logger.info("draft changed %.1f%%, stopping", change * 100)
+        return {
+            "draft": draft,
+            "revisions": revisions,
+            "context_stats": context_stats,
+            "revised_sections": [],
+            "draft_change": change,
+            "stop_reason": stop_reason,
+            "lnode": "generate",
+            "count": 1,
+        }
+
+    def draft_sections(self, state: AgentState) -> Optional[List[str]]:
+        """Sections of the draft when this pass is a revision that can be made
+        section by section, None to generate the whole essay.
+        """
+        if not (self.section_revision and state.get("revisions")):
+            return None
+        if not state.get("critique"):
+            return None
+        sections = split_sections(state.get("draft") or "")
+        return sections if len(sections) > 1 else None
+
+    def section_map_messages(self, state: AgentState, sections: List[str]) -> list:
+        return [
+            SystemMessage(content=self.SECTION_MAP_PROMPT),
+            HumanMessage(
+                content=f"{number_sections(sections)}\n\n"
+                f"Critique:\n\n{state['critique']}"
+            ),
+        ]
+
+    def section_edits(
+        self, sections: List[str], plan: SectionEdits
+    ) -> Optional[List[tuple]]:
+        """Sections to revise and the critique points of each.
+
+        Args:
+            sections (List[str]): sections of the draft.
+            plan (SectionEdits): the critique mapped to the numbered sections.
+
+        Returns:
+            List[tuple]: (index, instructions) pairs in section order, empty
+                when the critique concerns no section, None when the whole
+                essay has to be generated again.
+        """
+        if plan.rewrite:
+            return None
+        edits: Dict[int, List[str]] = {}
+        for edit in plan.edits:
+            # numbers the model made up are ignored
+            if 1 <= edit.section <= len(sections):
+                edits.setdefault(edit.section - 1, []).append(edit.instructions)
+        # a critique of every section is a rewrite, one call keeps it coherent
+        if len(edits) == len(sections):
+            return None
+        return [(i, "\n".join(points)) for i, points in sorted(edits.items())]
+
+    def section_messages(
+        self, state: AgentState, sections: List[str], index: int, instructions: str
+    ) -> tuple:
+        """Messages regenerating one section and the stats of its research
+        content, ranked against the section and its critique within half the
+        budget of the writer.
+        """
+        content, context_stats = build_context(
+            self.research_content(state),
+            f"{sections[index]}\n{instructions}",
+            self.context_budget // 2,
+        )
         user_message = HumanMessage(
             content=f"{state['task']}\n\nHere is my plan:\n\n{state['outline']}"
+            f"\n\nHere is the essay:\n\n{join_sections(sections)}"
+            f"\n\nRevise section [{index + 1}]:\n\n{sections[index]}"
+            f"\n\nCritique points to address:\n\n{instructions}"
         )
         messages = [
-            SystemMessage(content=self.WRITER_PROMPT.format(content=content)),
+            SystemMessage(content=self.SECTION_WRITER_PROMPT.format(content=content)),
             user_message,
         ]
-        response = self.model.invoke(messages)
-        return {
-            "draft": response.content,
-            "revisions": state.get("revisions", 1) + 1,
-            "lnode": "generate",
-            "count": 1,
+        return messages, context_stats
+
+    def revise_sections(
+        self,
+        state: AgentState,
+        sections: List[str],
+        edits: List[tuple],
+        calls: List[tuple],
+        responses: list,
+    ) -> dict:
+        """State update splicing the regenerated sections into the draft, the
+        same draft when no section was regenerated.
+        """
+        revised = {i: r.content for (i, _), r in zip(edits, responses)}
+        logger.info("revised sections %s of %s", sorted(revised), len(sections))
+        stats = [context_stats for _, context_stats in calls]
+        context_stats = {
+            "snippets": stats[0]["snippets"] if stats else 0,
+            "tokens": stats[0]["tokens"] if stats else 0,
+            # summed over the sections, the research content sent in total
+            "packed_snippets": sum(s["packed_snippets"] for s in stats),
+            "packed_tokens": sum(s["packed_tokens"] for s in stats),
         }
+        draft = join_sections(splice(sections, revised)) if revised else state["draft"]
+        update = self.new_draft(state, draft, context_stats)
+        update["revised_sections"] = [i + 1 for i in sorted(revised)]
+        return update
+
+    def writer_messages(self, state: AgentState) -> tuple:
+        """Messages of the writer and the stats of the packed research content."""
+        # rank the content against what the draft has to cover
+        query = f"{state['task']}\n{state['outline']}"
+        if state.get("revisions"):
+            query += f"\n{state.get('critique', '')}"
+        content, context_stats = build_context(
+            self.research_content(state), query, self.context_budget
+        )
+        user_message = HumanMessage(
+            content=f"{state['task']}\n\nHere is my plan:\n\n{state['outline']}"
+        )
+        messages = [
+            SystemMessage(content=self.WRITER_PROMPT.format(content=content)),
+            user_message,
+        ]
+        return messages, context_stats
 
     def reflection_node(self, state: AgentState) -> dict:
         """Node that critiques the draft generated by the generation node.
@@ -167,17 +730,35 @@ class Agent:
         Returns:
             dict: A dictionary with the critique, last node and count.
         """
-        messages = [
-            SystemMessage(content=self.REFLECTION_PROMPT),
-            HumanMessage(content=state["draft"]),
-        ]
-        response = self.model.invoke(messages)
+        response = self.model.invoke(self.reflection_messages(state))
+        return self.new_critique(response.content)
+
+    async def areflection_node(self, state: AgentState) -> dict:
+        """Async `reflection_node`."""
+        response = await self.model.ainvoke(self.reflection_messages(state))
+        return self.new_critique(response.content)
+
+    def new_critique(self, critique: str) -> dict:
+        """State update of a critique, the loop stops when its verdict finds
+        no major issues left.
+        """
+        stop_reason = ""
+        if self.stop_on_approval and NO_MAJOR_ISSUES.search(critique[-200:]):
+            stop_reason = "no_major_issues"
+            logger.info("critique found no major issues, stopping")
         return {
-            "critique": response.content,
+            "critique": critique,
+            "stop_reason": stop_reason,
             "lnode": "reflect",
             "count": 1,
         }
 
+    def reflection_messages(self, state: AgentState) -> list:
+        return [
+            SystemMessage(content=self.REFLECTION_PROMPT),
+            HumanMessage(content=state["draft"]),
+        ]
+
     def research_critique_node(self, state: AgentState) -> dict:
         """A ndoe that uses the critique from the reflection node
         to gather more information to improve the draft.
@@ -186,26 +767,401 @@ class Agent:
             state (AgentState): state of the agent.
 
         Returns:
-            dict: dictionary with the content, last node and count.
+            dict: dictionary with the content, last node, count, the number
+                of duplicate results dropped and the searches run and skipped.
         """
         queries = self.model.with_structured_output(Queries).invoke(
-            [
-                SystemMessage(content=self.RESEARCH_CRITIQUE_PROMPT),
-                HumanMessage(content=state["critique"]),
-            ]
+            self.research_critique_messages(state)
         )
-        content = state["content"] or []
-        for q in queries.queries:
-            response = self.tavily.search(query=q, max_results=2)
-            for r in response["results"]:
-                content.append(r["content"])
+        results, searches = self.research(state, queries.queries)
+        content, dropped = self.add_content(state, results)
         return {
             "content": content,
+            "content_dropped": dropped,
+            **searches,
             "lnode": "research_critique",
             "count": 1,
         }
 
-    def should_continue(self, state: AgentState) -> str:
-        if state["revisions"] > state["max_revisions"]:
+    async def aresearch_critique_node(self, state: AgentState) -> dict:
+        """Async `research_critique_node`."""
+        queries = await self.model.with_structured_output(Queries).ainvoke(
+            self.research_critique_messages(state)
+        )
+        results, searches = await self.aresearch(state, queries.queries)
+        content, dropped = self.add_content(state, results)
+        return {
+            "content": content,
+            "content_dropped": dropped,
+            **searches,
+            "lnode": "research_critique",
+            "count": 1,
+        }
+
+    def research_critique_messages(self, state: AgentState) -> list:
+        return [
+            SystemMessage(content=self.RESEARCH_CRITIQUE_PROMPT),
+            HumanMessage(content=state["critique"]),
+        ]
+
+    def critic_node(self, state: dict) -> dict:
+        """Node of one focused critic, it reviews one aspect of the draft and
+        researches its points right away, without waiting for the others.
+
+        Args:
+            state (dict): the task, the draft, the `focus` of the critic and
+                the queries already searched.
+
+        Returns:
+            dict: dictionary with the notes of the critic, the queries it
+                searched among them, the searches skipped, last node and count.
+        """
+        critique = self.model.with_structured_output(FocusedCritique).invoke(
+            self.critic_messages(state)
+        )
+        results, searches = self.research(state, critique.queries[:2])
+        return self.critic_notes(state, critique, results, searches)
+
+    async def acritic_node(self, state: dict) -> dict:
+        """Async `critic_node`."""
+        critique = await self.model.with_structured_output(FocusedCritique).ainvoke(
+            self.critic_messages(state)
+        )
+        results, searches = await self.aresearch(state, critique.queries[:2])
+        return self.critic_notes(state, critique, results, searches)
+
+    def critic_messages(self, state: dict) -> list:
+        focus = prompts.CRITIC_FOCUS[state["focus"]]
+        return [
+            SystemMessage(content=self.CRITIC_PROMPT.format(focus=focus)),
+            HumanMessage(content=state["draft"]),
+        ]
+
+    def critic_notes(
+        self,
+        state: dict,
+        critique: FocusedCritique,
+        results: List[str],
+        searches: dict,
+    ) -> dict:
+        points = [
+            {
+                "focus": state["focus"],
+                # priorities the model made up are clamped to the scale
+                "priority": min(max(point.priority, 1), 3),
+                "issue": point.issue,
+                "recommendation": point.recommendation,
+            }
+            for point in critique.points
+        ]
+        # the critics run in one step and cannot all write the searched list,
+        # the merge adds the queries each of them searched
+        known = len(state.get("searched") or [])
+        searched = searches.pop("searched")[known:]
+        note = {"focus": state["focus"], "points": points, "queries": critique.queries}
+        return {
+            "critic_notes": [dict(note, results=results, searched=searched)],
+            **searches,
+            "lnode": "critic",
+            "count": 1,
+        }
+
+    def merge_critiques_node(self, state: AgentState) -> dict:
+        """Node merging the notes of the critics into one critique, the most
+        important points first, and their research into the content.
+
+        Args:
+            state (AgentState): state of the agent.
+
+        Returns:
+            dict: dictionary with the critique, content, queries, the number
+                of duplicate results dropped, the queries searched, stop
+                reason, last node and count.
+        """
+        # in critic order, whichever finished first
+        notes = sorted(
+            state["critic_notes"], key=lambda note: self.critics.index(note["focus"])
+        )
+        points = sorted(
+            (point for note in notes for point in note["points"]),
+            key=lambda point: point["priority"],
+        )
+        lines = [
+            f"{i}. [{p['focus']}, priority {p['priority']}] {p['issue']} "
+            f"Recommendation: {p['recommendation']}"
+            for i, p in enumerate(points, 1)
+        ]
+        critique = "\n".join(lines) or "No issues found."
+        results = [r for note in notes for r in note["results"]]
+        content, dropped = self.add_content(state, results)
+        stop_reason = ""
+        if self.stop_on_approval and not any(p["priority"] == 1 for p in points):
+            stop_reason = "no_major_issues"
+            logger.info("critics found no major issues, stopping")
+        return {
+            "critique": critique,
+            "content": content,
+            "content_dropped": dropped,
+            "queries": [q for note in notes for q in note["queries"]],
+            "searched": list(state.get("searched") or [])
+            + [q for note in notes for q in note["searched"]],
+            "critic_notes": None,
+            "stop_reason": stop_reason,
+            "lnode": "reflect",
+            "count": 1,
+        }
+
+    async def amerge_critiques_node(self, state: AgentState) -> dict:
+        """Async `merge_critiques_node`, it makes no calls."""
+        return self.merge_critiques_node(state)
+
+    def add_content(self, state: AgentState, results: List[str]) -> tuple:
+        """Add search results to the content of the state, skipping near
+        duplicates of the content already gathered and of each other.
+
+        Args:
+            state (AgentState): state of the agent, left unchanged.
+            results (List[str]): content of the new search results.
+
+        Returns:
+            tuple: the new content list and the number of results dropped.
+        """
+        content = list(state["content"] or [])
+        # the index of the last round, only the new results are indexed
+        index = self.dedup_indexes.take(content)
+        kept = [r for r in results if index.add(r)]
+        if dropped := len(results) - len(kept):
+            logger.info("dropped %s duplicate search results", dropped)
+        self.dedup_indexes.put(content + kept, index)
+        return content + kept, dropped
+
+    def research(self, state: dict, queries: List[str]) -> tuple:
+        """Search the queries of a research round, skipping those that repeat
+        a query already searched, see `new_queries`.
+
+        Args:
+            state (dict): state of the agent, left unchanged.
+            queries (List[str]): search queries of the round.
+
+        Returns:
+            tuple: content of the new results and the state update recording
+                the searches run and skipped, and whether search is unavailable.
+        """
+        fresh, skipped = self.new_queries(state, queries)
+        if self.searcher_or_none() is None:
+            return self.searched(state, None, skipped)
+        return self.searched(state, self.search(fresh), skipped)
+
+    async def aresearch(self, state: dict, queries: List[str]) -> tuple:
+        """Async `research`."""
+        fresh, skipped = self.new_queries(state, queries)
+        if self.searcher_or_none() is None:
+            return self.searched(state, None, skipped)
+        return self.searched(state, await self.asearch(fresh), skipped)
+
+    def new_queries(self, state: dict, queries: List[str]) -> tuple:
+        """Split the queries of a research round into those to search and
+        those worded like a query searched earlier in the thread, or earlier
+        in the round. The results of that query are in the content already.
+
+        Returns:
+            tuple: the queries to search and the queries skipped.
+        """
+        if self.query_memo_threshold is None:
+            return list(queries), []
+        known = list(state.get("searched") or [])
+        fresh, skipped = [], []
+        for query in queries:
+            match = next(
+                (
+                    q
+                    for q in known + fresh
+                    if query_similarity(query, q) >= self.query_memo_threshold
+                ),
+                None,
+            )
+            if match is None:
+                fresh.append(query)
+            else:
+                skipped.append(query)
+                logger.info("skipping search %r, %r was searched already", query, match)
+        return fresh, skipped
+
+    def searched(
+        self,
+        state: dict,
+        responses: Optional[List[Tuple[str, list]]],
+        skipped: List[str],
+    ) -> tuple:
+        """Content of the search results and the state update recording the
+        queries searched in the thread, those of earlier rounds included, and
+        the number skipped. `responses` is None when search is unavailable,
+        the update then says so until a later round can search again.
+        """
+        unavailable = responses is None
+        responses = responses or []
+        content = [r["content"] for _, results in responses for r in results]
+        searches = {
+            # failed searches are left out, a later round may try them again
+            "searched": list(state.get("searched") or []) + [q for q, _ in responses],
+            "searches_skipped": len(skipped),
+        }
+        if unavailable or state.get("search_unavailable"):
+            searches["search_unavailable"] = unavailable
+        return content, searches
+
+    def search(self, queries: List[str]) -> List[Tuple[str, list]]:
+        """Run the search queries concurrently and collect their results.
+
+        Args:
+            queries (List[str]): search queries of one research round.
+
+        Returns:
+            List[Tuple[str, list]]: the queries with their results, in query
+                order. Queries that fail, take longer than `search_timeout`
+                or are not done after `search_round_timeout` are left out.
+        """
+        if (client := self.searcher_or_none()) is None:
+            return []
+        round_deadline = time.monotonic() + self.search_round_timeout
+        # when each search started, the pool is shared by every thread and a
+        # search may wait for a free worker first
+        started = {}
+
+        def run(i: int, query: str) -> dict:
+            started[i] = time.monotonic()
+            return client.search(
+                query=query, max_results=2, timeout=self.search_timeout
+            )
+
+        # the pool threads run the searches with the priority of the caller
+        futures = [
+            self.search_pool.submit(contextvars.copy_context().run, run, i, q)
+            for i, q in enumerate(queries)
+        ]
+        # the deadline of a search runs from its start, time spent queued only
+        # counts against the deadline of the round
+        pending, expired = set(range(len(futures))), set()
+        while pending:
+            now = time.monotonic()
+            if now >= round_deadline:
+                # searches still queued are dropped, running ones abandoned
+                for i in pending:
+                    futures[i].cancel()
+                expired |= pending
+                break
+            expired |= {
+                i
+                for i in pending
+                if i in started and now >= started[i] + self.search_timeout
+            }
+            pending -= expired
+            deadlines = [
+                started[i] + self.search_timeout for i in pending if i in started
+            ]
+            done, _ = wait(
+                [futures[i] for i in pending],
+                timeout=min(deadlines + [round_deadline]) - now,
+                return_when=FIRST_COMPLETED,
+            )
+            pending -= {i for i in pending if futures[i] in done}
+        responses = []
+        for i, (q, future) in enumerate(zip(queries, futures)):
+            if i in expired:
+                logger.warning("search timed out after %ss: %r", self.search_timeout, q)
+                continue
+            if error := future.exception():
+                logger.warning("search failed for %r: %s", q, error)
+                continue
+            responses.append((q, future.result()["results"]))
+        return responses
+
+    async def asearch(self, queries: List[str]) -> List[Tuple[str, list]]:
+        """Async `search`, the queries run concurrently on the event loop with
+        at most `max_search_workers` of them in flight per loop.
+
+        Args:
+            queries (List[str]): search queries of one research round.
+
+        Returns:
+            List[Tuple[str, list]]: the queries with their results, in query
+                order. Queries that fail, take longer than `search_timeout`
+                or are not done after `search_round_timeout` are left out.
+        """
+        if (client := self.searcher_or_none()) is None or not queries:
+            return []
+        limit = self.search_limit()
+
+        async def run(query: str) -> dict:
+            async with limit:
+                # the deadline runs from the start, not from the queue
+                return await asyncio.wait_for(
+                    client.asearch(
+                        query=query, max_results=2, timeout=self.search_timeout
+                    ),
+                    self.search_timeout,
+                )
+
+        tasks = [asyncio.ensure_future(run(q)) for q in queries]
+        # the round deadline also covers the searches waiting for the limit
+        _, pending = await asyncio.wait(tasks, timeout=self.search_round_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        results = []
+        for q, task in zip(queries, tasks):
+            if task in pending or isinstance(task.exception(), asyncio.TimeoutError):
+                logger.warning("search timed out after %ss: %r", self.search_timeout, q)
+                continue
+            if error := task.exception():
+                logger.warning("search failed for %r: %s", q, error)
+                continue
+            results.append((q, task.result()["results"]))
+        return results
+
+    def searcher_or_none(self) -> Optional[SearchBackend]:
+        """The search backend, None without a TAVILY_API_KEY. The research
+        rounds then go on without results and report `search_unavailable`.
+        Any other failure to build the backend is raised.
+        """
+        from tavily.errors import MissingAPIKeyError
+
+        try:
+            return self.searcher
+        except MissingAPIKeyError as error:
+            logger.warning("search unavailable: %s", error)
+            return None
+
+    def search_limit(self) -> asyncio.Semaphore:
+        """Semaphore bounding the searches of the running event loop, a
+        semaphore cannot be shared by loops.
+        """
+        loop = asyncio.get_running_loop()
+        if (limit := self.search_limits.get(loop)) is None:
+            limit = asyncio.Semaphore(self.max_search_workers)
+            self.search_limits[loop] = limit
+        return limit
+
+    def should_continue(self, state: AgentState):
+        """Next node after `generate` or `reflect`, END once the last of them
+        recorded a stop reason. With critics, a draft goes to all of them at once.
+        """
+        if state.get("stop_reason"):
             return END
-        return "reflect"
+        if not self.critics:
+            return "reflect" if state["lnode"] == "generate" else "research_critique"
+        if state["lnode"] != "generate":
+            return self.writer
+        return [
+            Send(
+                "critic",
+                {
+                    "task": state["task"],
+                    "draft": state["draft"],
+                    "focus": f,
+                    "searched": state.get("searched") or [],
+                    "search_unavailable": state.get("search_unavailable", False),
+                },
+            )
+            for f in self.critics
+        ]
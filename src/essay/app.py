@@ -1,10 +1,38 @@
-from essay.agent import Agent
+import os
+from typing import Optional
+
 from essay.gui import EssayGui
+from essay.jobs import JobQueue
+
+
+def create_app(queue: Optional[str] = None, **options) -> EssayGui:
+    """Build the agent and its user interface.
+
+    Args:
+        queue (str, optional): path of a job queue, the runs are then left to
+            `essay worker` processes. Defaults to ESSAY_JOB_QUEUE, unset runs
+            the agent in this process.
+        **options: arguments of `Agent`. ESSAY_LLM_CACHE enables the on-disk
+            model response cache unless `llm_cache` is given, and
+            ESSAY_CRITICS the parallel critics unless `critics` is. With
+            ESSAY_SEARCH_INDEX the research searches that local index.
+            ESSAY_COMPRESS_RESEARCH=1 gives the writer notes of the research
+            instead of the raw snippets.
+
+    Returns:
+        EssayGui: the interface, not launched yet.
+    """
+    from essay.agent import Agent, critics_from_env
+    from essay.retrieval import index_from_env
+
+    options.setdefault("llm_cache", os.getenv("ESSAY_LLM_CACHE"))
+    options.setdefault("critics", critics_from_env())
+    options.setdefault("search_backend", index_from_env())
+    options.setdefault("compress_research", os.getenv("ESSAY_COMPRESS_RESEARCH") == "1")
+    agent = Agent(**options)
+    queue = queue or os.getenv("ESSAY_JOB_QUEUE")
+    return EssayGui(agent.graph, queue=JobQueue(queue) if queue else None)
 
-# Initailize agent
-MultiAgent = Agent()
-# Initailize graphic user interface with the agent.
-app = EssayGui(MultiAgent.graph)
 
 if __name__ == "__main__":
-    app.launch()
+    create_app().launch()
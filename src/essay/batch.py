@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List
+
+from essay.ratelimit import BATCH, priority
+
+logger = logging.getLogger(__name__)
+
+
+def initial_state(task: str, max_revisions: int = 2) -> dict:
+    """Input of a new essay thread."""
+    return {
+        "task": task,
+        "max_revisions": max_revisions,
+        "revisions": 0,
+        "lnode": "",
+        "draft": "no draft",
+        "critique": "no critique",
+        "content": [],
+        "queries": [],
+        "count": 0,
+    }
+
+
+def read_items(path: str) -> List[dict]:
+    """Topics of a JSONL file, one `{"topic": ...}` object per line with an
+    optional `id` and `max_revisions`. Lines without an id are numbered.
+    """
+    items = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(n))
+            items.append(item)
+    return items
+
+
+def finished_ids(path: str) -> set:
+    """Ids of the items an earlier run already wrote to the output."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue  # a line cut short by a crash
+    return done
+
+
+def run_item(graph, item: dict) -> dict:
+    """Write the essay of one item without interrupts, resuming its thread
+    from the checkpointer when an earlier run stopped half way.
+
+    Returns:
+        dict: the essay and the timings of the item.
+    """
+    thread = {"configurable": {"thread_id": f"batch-{item['id']}"}}
+    snapshot = graph.get_state(thread)
+    resumed = bool(snapshot.values)
+    config = None
+    if not resumed:
+        config = initial_state(item["topic"], item.get("max_revisions", 2))
+    started = time.perf_counter()
+    node_seconds = {}
+    # the graph interrupts after every node, each call runs one node
+    while config is not None or snapshot.next:
+        step_started = time.perf_counter()
+        # interactive sessions go first when both wait for the rate limits
+        with priority(BATCH):
+            graph.invoke(config, thread)
+        config = None
+        snapshot = graph.get_state(thread)
+        lnode = snapshot.values["lnode"]
+        node_seconds[lnode] = node_seconds.get(lnode, 0.0) + (
+            time.perf_counter() - step_started
+        )
+    return {
+        "id": item["id"],
+        "topic": snapshot.values["task"],
+        "essay": snapshot.values["draft"],
+        "revisions": snapshot.values["revisions"],
+        # why the revision loop ended and the revisions it did not need
+        "stop_reason": snapshot.values.get("stop_reason", ""),
+        "revisions_saved": max(
+            snapshot.values["max_revisions"] + 1 - snapshot.values["revisions"], 0
+        ),
+        # searches answered by an earlier, similarly worded query
+        "searches_skipped": snapshot.values.get("searches_skipped", 0),
+        # the essay was written without research, e.g. without TAVILY_API_KEY
+        "search_unavailable": snapshot.values.get("search_unavailable", False),
+        "steps": snapshot.values["count"],
+        "resumed": resumed,
+        "seconds": round(time.perf_counter() - started, 3),
+        "node_seconds": {k: round(v, 3) for k, v in node_seconds.items()},
+    }
+
+
+def run_batch(
+    graph, items: List[dict], output: str, concurrency: int = 4
+) -> Iterator[dict]:
+    """Run many items at once and append each result to the output JSONL as
+    soon as it finishes. Items already in the output are skipped.
+
+    Args:
+        graph: compiled essay graph with a persistent checkpointer.
+        items (List[dict]): items of `read_items`.
+        output (str): path of the output JSONL file.
+        concurrency (int): items running at the same time.
+
+    Yields:
+        dict: results, in the order they finish.
+    """
+    done = finished_ids(output)
+    todo = [item for item in items if str(item["id"]) not in done]
+    logger.info("%s items to run, %s already finished", len(todo), len(done))
+    with (
+        open(output, "a") as out,
+        ThreadPoolExecutor(max_workers=concurrency) as pool,
+    ):
+        futures = {pool.submit(run_item, graph, item): item for item in todo}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                # left out of the output, the next run resumes it
+                logger.exception("item %s failed", item["id"])
+                continue
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            yield result
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
+
+
+# Key/value store in sqlite with ttl and least recently used eviction
+class SqliteCache:
+    def __init__(
+        self,
+        path: str,
+        table: str = "cache",
+        ttl: Optional[float] = None,
+        max_entries: int = 10_000,
+    ) -> None:
+        """Open the cache table, creating it if needed.
+
+        Args:
+            path (str): path of the sqlite database, ":memory:" keeps it in process.
+            table (str): name of the table, several caches can share one database.
+            ttl (float, optional): seconds an entry stays valid. Defaults to forever.
+            max_entries (int): entries kept before the least recently used
+                ones are evicted.
+        """
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.executescript(
+                f"""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {table}_accessed_at
+                    ON {table} (accessed_at);
+                """
+            )
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a value, None if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes) -> None:
+        """Store a value and evict expired and least recently used entries."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} "
+                "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.ttl is not None:
+                self.conn.execute(
+                    f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,)
+                )
+            self.conn.execute(
+                f"""DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute(f"DELETE FROM {self.table}")
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        """Hit and miss counters of this process and the number of entries."""
+        with self.lock:
+            (size,) = self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query so trivially different spellings share a key."""
+    return re.sub(r"\s+", " ", query.casefold()).strip(" ?.!,;:\"'")
+
+
+# Caching layer in front of a search client such as TavilyClient
+class SearchCache:
+    def __init__(
+        self,
+        client,
+        path: str,
+        ttl: Optional[float] = 24 * 60 * 60,
+        max_entries: int = 10_000,
+    ) -> None:
+        self.client = client
+        self.cache = SqliteCache(path, "search", ttl=ttl, max_entries=max_entries)
+
+    @staticmethod
+    def key(query: str, **params) -> str:
+        """Cache key of a normalized query and its search parameters."""
+        payload = json.dumps(
+            {"query": normalize_query(query), "params": params},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def search(self, query: str, timeout: Optional[int] = None, **params) -> dict:
+        """Search through the cache, same signature as `TavilyClient.search`.
+        The timeout does not change the results so it is not part of the key.
+        """
+        key = self.key(query, **params)
+        if (value := self.cache.get(key)) is not None:
+            return json.loads(value)
+        if timeout is not None:
+            params["timeout"] = timeout
+        response = self.client.search(query=query, **params)
+        self.cache.set(key, json.dumps(response).encode())
+        return response
+
+    async def asearch(
+        self, query: str, timeout: Optional[int] = None, **params
+    ) -> dict:
+        """Async `search`, it awaits the `asearch` of the client if it has one
+        and otherwise runs its `search` in a worker thread.
+        """
+        key = self.key(query, **params)
+        if (value := self.cache.get(key)) is not None:
+            return json.loads(value)
+        if timeout is not None:
+            params["timeout"] = timeout
+        if hasattr(self.client, "asearch"):
+            response = await self.client.asearch(query=query, **params)
+        else:
+            response = await asyncio.to_thread(
+                self.client.search, query=query, **params
+            )
+        self.cache.set(key, json.dumps(response).encode())
+        return response
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+# Response cache for chat models, passed as `ChatOpenAI(cache=...)`
+class LLMCache(BaseCache):
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = None,
+        max_entries: int = 10_000,
+    ) -> None:
+        self.cache = SqliteCache(path, "llm", ttl=ttl, max_entries=max_entries)
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        """Cache key of the model and its parameters and the serialized messages."""
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if (value := self.cache.get(self.key(prompt, llm_string))) is None:
+            return None
+        return [
+            ChatGeneration(
+                message=messages_from_dict([g["message"]])[0],
+                generation_info=g["generation_info"],
+            )
+            for g in json.loads(value)
+        ]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        value = json.dumps(
+            [
+                {
+                    "message": message_to_dict(g.message),
+                    "generation_info": g.generation_info,
+                }
+                for g in return_val
+            ]
+        )
+        self.cache.set(self.key(prompt, llm_string), value.encode())
+
+    def clear(self, **kwargs: Any) -> None:
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,588 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, List, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a sqlite database tuned for many small concurrent writes."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.executescript(
+        """
+        PRAGMA auto_vacuum=INCREMENTAL;
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA busy_timeout=30000;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-16000;
+        PRAGMA wal_autocheckpoint=1000;
+        """
+    )
+    return conn
+
+
+BLOB_KEY = "__essay_blob__"
+# Seconds between two touches of a stored blob, well below the sweep grace
+TOUCH_INTERVAL = 10
+# Channel of the pending `Send`s of a checkpoint
+TASKS = "__pregel_tasks"
+INDEX_INSERT = "INSERT OR REPLACE INTO checkpoint_index VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+
+def next_nodes(channel_values: dict) -> tuple:
+    """Nodes a checkpoint will run next, the same nodes `StateSnapshot.next`
+    reports: those a `Send` schedules, such as the critics, then those of the
+    trigger channels the graph writes for the edges.
+    """
+    if "__start__" in channel_values:
+        return ("__start__",)
+    sends = tuple(
+        task.node for task in channel_values.get(TASKS) or () if hasattr(task, "node")
+    )
+    prefix = "branch:to:"
+    return sends + tuple(
+        k[len(prefix) :] for k in channel_values if k.startswith(prefix)
+    )
+
+
+def summarize_checkpoint(
+    config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata
+) -> tuple:
+    """Row of the checkpoint index, the small fields the history views show."""
+    values = checkpoint["channel_values"]
+    return (
+        str(config["configurable"]["thread_id"]),
+        checkpoint["id"],
+        metadata.get("step"),
+        values.get("count"),
+        values.get("lnode"),
+        json.dumps(next_nodes(values)),
+        values.get("revisions"),
+    )
+
+
+# Serializer that keeps large strings of the state in a content addressed blob table
+class BlobSerializer:
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        min_size: int = 256,
+        compress: bool = True,
+        cache_size: int = 1024,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        """Create the blob table if needed.
+
+        Args:
+            conn (sqlite3.Connection): database holding the blobs.
+            min_size (int): strings at least this long are moved to a blob,
+                lists such as `content` get one blob per snippet.
+            compress (bool): zlib compress the blobs.
+            cache_size (int): recently used blobs kept in memory.
+            serde (SerializerProtocol, optional): serializer of what is left of
+                the checkpoint once the blobs are taken out.
+        """
+        self.conn = conn
+        self.min_size = min_size
+        self.compress = compress
+        self.cache_size = cache_size
+        self.serde = serde or JsonPlusSerializer()
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        with self.lock:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    compressed INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _remember(self, digest: str, value: str) -> None:
+        self.cache[digest] = value
+        self.cache.move_to_end(digest)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _extract(self, obj: Any, blobs: dict) -> Any:
+        if isinstance(obj, str) and len(obj) >= self.min_size:
+            digest = hashlib.sha256(obj.encode()).hexdigest()
+            blobs[digest] = obj
+            return {BLOB_KEY: digest}
+        if isinstance(obj, list):
+            return [self._extract(item, blobs) for item in obj]
+        if isinstance(obj, dict):
+            return {key: self._extract(value, blobs) for key, value in obj.items()}
+        return obj
+
+    def _resolve(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            if len(obj) == 1 and BLOB_KEY in obj:
+                return self.get(obj[BLOB_KEY])
+            return {key: self._resolve(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [self._resolve(item) for item in obj]
+        return obj
+
+    def get(self, digest: str) -> str:
+        """Get the string stored under a hash."""
+        with self.lock:
+            if digest in self.cache:
+                self.cache.move_to_end(digest)
+                return self.cache[digest]
+            compressed, data = self.conn.execute(
+                "SELECT compressed, data FROM blobs WHERE hash = ?", (digest,)
+            ).fetchone()
+            value = (zlib.decompress(data) if compressed else data).decode()
+            self._remember(digest, value)
+            return value
+
+    def put(self, blobs: dict) -> None:
+        """Store the strings of `blobs`, keyed by hash. Only the blobs not
+        stored yet are compressed and written, those already stored are
+        touched, at most every `TOUCH_INTERVAL` seconds, so a concurrent sweep
+        keeps them.
+        """
+        now = time.time()
+        with self.lock:
+            stored = self._stored(list(blobs))
+            self.conn.executemany(
+                "UPDATE blobs SET created_at = ? WHERE hash = ? AND created_at < ?",
+                [(now, digest, now - TOUCH_INTERVAL) for digest in stored],
+            )
+            self.conn.commit()
+        rows = []
+        for digest, value in blobs.items():
+            if digest in stored:
+                continue
+            data = value.encode()
+            packed = zlib.compress(data) if self.compress else data
+            compressed = len(packed) < len(data)
+            rows.append((digest, compressed, packed if compressed else data, now))
+        with self.lock:
+            if rows:
+                # another writer may have stored the same blob meanwhile
+                self.conn.executemany(
+                    "INSERT INTO blobs (hash, compressed, data, created_at) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (hash) DO UPDATE SET created_at = excluded.created_at",
+                    rows,
+                )
+                self.conn.commit()
+            for digest, value in blobs.items():
+                self._remember(digest, value)
+
+    def _stored(self, digests: List[str]) -> set:
+        """Hashes of `digests` already in the blob table."""
+        stored = set()
+        # sqlite limits the number of parameters of a statement
+        for i in range(0, len(digests), 500):
+            chunk = digests[i : i + 500]
+            cur = self.conn.execute(
+                f"SELECT hash FROM blobs WHERE hash IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            stored.update(digest for (digest,) in cur)
+        return stored
+
+    def refs(self, data: tuple[str, bytes]) -> set:
+        """Hashes of the blobs a serialized value refers to."""
+        found = set()
+
+        def walk(obj: Any) -> None:
+            if isinstance(obj, dict):
+                if len(obj) == 1 and BLOB_KEY in obj:
+                    found.add(obj[BLOB_KEY])
+                else:
+                    for value in obj.values():
+                        walk(value)
+            elif isinstance(obj, list):
+                for item in obj:
+                    walk(item)
+
+        walk(self.serde.loads_typed(data))
+        return found
+
+    def sweep(self, referenced: set, grace: float = 60) -> int:
+        """Delete blobs no checkpoint refers to. Blobs younger than `grace`
+        seconds are kept, their checkpoint may not be written yet.
+
+        Returns:
+            int: number of blobs deleted.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT hash FROM blobs WHERE created_at < ?", (time.time() - grace,)
+            ).fetchall()
+            unused = [(digest,) for (digest,) in rows if digest not in referenced]
+            self.conn.executemany("DELETE FROM blobs WHERE hash = ?", unused)
+            self.conn.commit()
+            for (digest,) in unused:
+                self.cache.pop(digest, None)
+        return len(unused)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        blobs = {}
+        stripped = self._extract(obj, blobs)
+        if blobs:
+            self.put(blobs)
+        return self.serde.dumps_typed(stripped)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        return self._resolve(self.serde.loads_typed(data))
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+
+# File backed checkpointer with a retention policy and background compaction
+class CheckpointStore(SqliteSaver):
+    def __init__(
+        self,
+        path: str = "checkpoints.sqlite",
+        keep_last: Optional[int] = 50,
+        thread_ttl: Optional[float] = 7 * 24 * 60 * 60,
+        compact_interval: Optional[float] = 10 * 60,
+        blobs: bool = True,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        """Open the checkpoint store.
+
+        Args:
+            path (str): path of the sqlite database.
+            keep_last (int, optional): checkpoints kept per thread, older ones
+                are pruned. None keeps them all.
+            thread_ttl (float, optional): seconds after which a thread that
+                received no checkpoint is deleted. None keeps idle threads.
+            compact_interval (float, optional): seconds between background
+                compactions. None disables the background task.
+            blobs (bool): keep large strings of the state, such as the draft
+                and the content snippets, once in a deduplicated blob table.
+            serde (SerializerProtocol, optional): serializer of the checkpoints.
+        """
+        conn = connect(path)
+        if blobs:
+            # a second connection lets blobs load while a listing holds the lock
+            blob_conn = conn if path == ":memory:" else connect(path)
+            serde = BlobSerializer(blob_conn, serde=serde)
+        super().__init__(conn, serde=serde)
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.compact_interval = compact_interval
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval:
+            self.start_compaction()
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS checkpoint_index (
+                thread_id TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                step INTEGER,
+                count INTEGER,
+                lnode TEXT,
+                next TEXT NOT NULL,
+                revisions INTEGER,
+                PRIMARY KEY (thread_id, checkpoint_id)
+            );
+            CREATE INDEX IF NOT EXISTS checkpoint_index_checkpoint_id
+                ON checkpoint_index (checkpoint_id);
+            """
+        )
+        self._index_existing()
+
+    def _index_existing(self) -> None:
+        """Index the checkpoints written before the index existed."""
+        rows = self.conn.execute(
+            """SELECT thread_id, checkpoint_id, type, checkpoint, metadata
+            FROM checkpoints c WHERE checkpoint_ns = '' AND NOT EXISTS (
+                SELECT 1 FROM checkpoint_index i
+                WHERE i.thread_id = c.thread_id AND i.checkpoint_id = c.checkpoint_id
+            )"""
+        ).fetchall()
+        self.conn.executemany(
+            INDEX_INSERT,
+            [
+                summarize_checkpoint(
+                    {"configurable": {"thread_id": thread_id}},
+                    self.serde.loads_typed((type_, checkpoint)),
+                    self.jsonplus_serde.loads(metadata) if metadata else {},
+                )
+                for thread_id, checkpoint_id, type_, checkpoint, metadata in rows
+            ],
+        )
+        self.conn.commit()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+            if not config["configurable"].get("checkpoint_ns"):
+                cur.execute(
+                    INDEX_INSERT, summarize_checkpoint(config, checkpoint, metadata)
+                )
+        return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM threads WHERE thread_id = ?", (str(thread_id),))
+            cur.execute(
+                "DELETE FROM checkpoint_index WHERE thread_id = ?", (str(thread_id),)
+            )
+
+    # SqliteSaver has no async methods, these run the sync ones in a worker
+    # thread so that `graph.ainvoke` and `graph.astream` work on the store.
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        # read at once, the sync listing holds the connection lock while open
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def threads(self) -> List[str]:
+        """Ids of the stored threads, least recently updated first."""
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT thread_id FROM threads ORDER BY updated_at")
+            return [thread_id for (thread_id,) in cur]
+
+    def history(self, thread_id: str, min_step: int = 1) -> List[dict]:
+        """Summaries of the checkpoints of a thread, latest first, read from
+        the index without loading any state.
+
+        Args:
+            thread_id (str): thread to list.
+            min_step (int): skip the checkpoints of earlier steps.
+
+        Returns:
+            List[dict]: thread_id, checkpoint_id, step, count, lnode, next and
+                revisions of every checkpoint.
+        """
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT * FROM checkpoint_index WHERE thread_id = ? AND step >= ? "
+                "ORDER BY checkpoint_id DESC",
+                (str(thread_id), min_step),
+            )
+            return [self._summary(row) for row in cur.fetchall()]
+
+    def lookup(self, checkpoint_id: str) -> Optional[dict]:
+        """Summary of a checkpoint found by id alone."""
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT * FROM checkpoint_index WHERE checkpoint_id = ?",
+                (checkpoint_id,),
+            )
+            row = cur.fetchone()
+        return self._summary(row) if row else None
+
+    @staticmethod
+    def _summary(row: tuple) -> dict:
+        thread_id, checkpoint_id, step, count, lnode, next_, revisions = row
+        return {
+            "thread_id": thread_id,
+            "checkpoint_id": checkpoint_id,
+            "step": step,
+            "count": count,
+            "lnode": lnode,
+            "next": tuple(json.loads(next_)),
+            "revisions": revisions,
+            "config": {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": "",
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+        }
+
+    def prune(self) -> int:
+        """Delete all but the last `keep_last` checkpoints of every thread.
+
+        Returns:
+            int: number of checkpoints deleted.
+        """
+        if self.keep_last is None:
+            return 0
+        with self.cursor() as cur:
+            cur.execute(
+                """DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns
+                            ORDER BY checkpoint_id DESC
+                        ) AS position FROM checkpoints
+                    ) WHERE position > ?
+                )""",
+                (self.keep_last,),
+            )
+            deleted = cur.rowcount
+            cur.execute(
+                """DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                    AND c.checkpoint_ns = writes.checkpoint_ns
+                    AND c.checkpoint_id = writes.checkpoint_id
+                )"""
+            )
+            cur.execute(
+                """DELETE FROM checkpoint_index WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = checkpoint_index.thread_id
+                    AND c.checkpoint_id = checkpoint_index.checkpoint_id
+                )"""
+            )
+        return deleted
+
+    def expire(self) -> List[str]:
+        """Delete the threads idle for longer than `thread_ttl`.
+
+        Returns:
+            List[str]: ids of the deleted threads.
+        """
+        if self.thread_ttl is None:
+            return []
+        with self.cursor() as cur:
+            # threads written before the table existed start their ttl now
+            cur.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, updated_at) "
+                "SELECT DISTINCT thread_id, ? FROM checkpoints",
+                (time.time(),),
+            )
+            cur.execute(
+                "SELECT thread_id FROM threads WHERE updated_at < ?",
+                (time.time() - self.thread_ttl,),
+            )
+            expired = [thread_id for (thread_id,) in cur.fetchall()]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        return expired
+
+    def compact(self) -> None:
+        """Apply the retention policy and give the freed pages back to the disk."""
+        pruned = self.prune()
+        expired = self.expire()
+        if isinstance(self.serde, BlobSerializer):
+            self.sweep_blobs()
+        with self.cursor() as cur:
+            cur.execute("PRAGMA incremental_vacuum").fetchall()
+            cur.execute("PRAGMA optimize").fetchall()
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        logger.info(
+            "compacted checkpoints: %s pruned, %s threads expired", pruned, len(expired)
+        )
+
+    def sweep_blobs(self) -> int:
+        """Delete the blobs no stored checkpoint or write refers to."""
+        referenced = set()
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT type, checkpoint FROM checkpoints "
+                "UNION ALL SELECT type, value FROM writes"
+            )
+            for row in cur:
+                referenced |= self.serde.refs(row)
+        return self.serde.sweep(referenced)
+
+    def start_compaction(self) -> None:
+        """Run `compact` every `compact_interval` seconds on a daemon thread."""
+        if self._compactor is not None:
+            return
+
+        def run() -> None:
+            while not self._stop.wait(self.compact_interval):
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception("checkpoint compaction failed")
+
+        self._compactor = threading.Thread(
+            target=run, name="essay-checkpoint-compaction", daemon=True
+        )
+        self._compactor.start()
+
+    def close(self) -> None:
+        """Stop the background compaction and close the database."""
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,150 @@
+import argparse
+import logging
+import os
+from typing import List, Optional
+
+
+def batch(args: argparse.Namespace) -> None:
+    from essay.agent import Agent
+    from essay.batch import read_items, run_batch
+    from essay.checkpoint import CheckpointStore
+    from essay.retrieval import LocalIndex
+
+    agent = Agent(
+        checkpointer=CheckpointStore(args.checkpoints),
+        section_revision=not args.full_revisions,
+        min_draft_change=args.min_change,
+        critics=args.critics,
+        compress_research=args.compress,
+        search_backend=LocalIndex(args.search_index) if args.search_index else None,
+    )
+    items = read_items(args.input)
+    for result in run_batch(agent.graph, items, args.output, args.concurrency):
+        line = (
+            f"{result['id']}: {result['seconds']}s, {result['revisions']} revisions, "
+            f"stopped on {result['stop_reason'] or 'interrupt'}, "
+            f"{result['searches_skipped']} searches skipped"
+        )
+        if result["search_unavailable"]:
+            line += ", written without research: search unavailable"
+        print(line)
+        if args.metrics:
+            agent.metrics.write(args.metrics, agent.scheduler.prometheus)
+    for name, stats in agent.metrics.cache_stats().items():
+        print(
+            f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['size']} entries"
+        )
+
+
+def index(args: argparse.Namespace) -> None:
+    from essay.retrieval import LocalIndex
+
+    local = LocalIndex(args.index)
+    for directory in args.directories:
+        counts = local.index_directory(directory)
+        print(f"{directory}: " + ", ".join(f"{v} {k}" for k, v in counts.items()))
+    print(f"{args.index}: " + ", ".join(f"{v} {k}" for k, v in local.stats().items()))
+
+
+def gui(args: argparse.Namespace) -> None:
+    from essay.app import create_app
+
+    create_app(queue=args.queue).launch()
+
+
+def worker(args: argparse.Namespace) -> None:
+    from essay.jobs import run_workers
+
+    run_workers(args.processes, args.queue, args.checkpoints)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point of the `essay` command."""
+    parser = argparse.ArgumentParser(prog="essay", description="AI essay assistant")
+    commands = parser.add_subparsers(required=True)
+
+    gui_parser = commands.add_parser("gui", help="launch the web interface")
+    gui_parser.add_argument(
+        "--queue", help="job queue database, runs are left to `essay worker`"
+    )
+    gui_parser.set_defaults(run=gui)
+
+    worker_parser = commands.add_parser(
+        "worker", help="run the queued jobs of the interface in worker processes"
+    )
+    worker_parser.add_argument(
+        "-p", "--processes", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    worker_parser.add_argument(
+        "--queue", default="jobs.sqlite", help="job queue database of the interface"
+    )
+    worker_parser.add_argument(
+        "--checkpoints",
+        default="checkpoints.sqlite",
+        help="checkpoint database of the interface",
+    )
+    worker_parser.set_defaults(run=worker)
+
+    batch_parser = commands.add_parser(
+        "batch", help="write essays for a JSONL file of topics without interrupts"
+    )
+    batch_parser.add_argument("input", help='JSONL file, one {"topic": ...} per line')
+    batch_parser.add_argument(
+        "-o", "--output", required=True, help="JSONL file the essays are appended to"
+    )
+    batch_parser.add_argument(
+        "-c", "--concurrency", type=int, default=4, help="essays written at once"
+    )
+    batch_parser.add_argument(
+        "--checkpoints",
+        default="batch_checkpoints.sqlite",
+        help="checkpoint database, unfinished essays resume from it",
+    )
+    batch_parser.add_argument(
+        "--metrics", help="Prometheus text file updated after every essay"
+    )
+    batch_parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="condense new research into cited notes before each draft, the writer "
+        "reads the notes instead of the search results",
+    )
+    batch_parser.add_argument(
+        "--full-revisions",
+        action="store_true",
+        help="regenerate the whole essay on every revision, not only the sections "
+        "the critique concerns",
+    )
+    batch_parser.add_argument(
+        "--min-change",
+        type=float,
+        default=0.05,
+        help="stop revising once a revision changes less than this share of the "
+        "draft, 0 to always run max_revisions",
+    )
+    batch_parser.add_argument(
+        "--critics",
+        nargs="+",
+        choices=["structure", "evidence", "style"],
+        help="focused critics reviewing each draft in parallel instead of one critique",
+    )
+    batch_parser.add_argument(
+        "--search-index", help="local index researched instead of Tavily, see `index`"
+    )
+    batch_parser.set_defaults(run=batch)
+
+    index_parser = commands.add_parser(
+        "index", help="index directories of documents for offline research"
+    )
+    index_parser.add_argument("directories", nargs="+", help="directories to index")
+    index_parser.add_argument(
+        "--index",
+        default="search_index.sqlite",
+        help="index database, only changed files are indexed again",
+    )
+    index_parser.set_defaults(run=index)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    args.run(args)
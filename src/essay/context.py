@@ -0,0 +1,114 @@
+import logging
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """Tokenizer of a model, None when its files cannot be loaded. The failure
+    is cached too, otherwise every count would retry the download.
+    """
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        logger.warning("no tokenizer for %s, estimating token counts", model)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Count the tokens of a text for a model. Falls back to an estimate of
+    four characters per token when the tokenizer files are not available.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+# Okapi BM25 index over the research snippets
+class BM25Index:
+    def __init__(self, docs: List[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.terms = [Counter(tokenize(doc)) for doc in docs]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.avg_length = sum(self.lengths) / len(docs) if docs else 0.0
+        df = Counter(term for terms in self.terms for term in terms)
+        n = len(docs)
+        self.idf = {
+            term: math.log(1 + (n - freq + 0.5) / (freq + 0.5))
+            for term, freq in df.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """Score every document of the index against the query."""
+        query_terms = set(tokenize(query)) & self.idf.keys()
+        scores = []
+        for terms, length in zip(self.terms, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            scores.append(
+                sum(
+                    self.idf[t] * terms[t] * (self.k1 + 1) / (terms[t] + norm)
+                    for t in query_terms
+                    if t in terms
+                )
+            )
+        return scores
+
+
+def build_context(
+    snippets: List[str], query: str, budget: int, model: str = "gpt-4o"
+) -> Tuple[str, dict]:
+    """Pack the snippets most relevant to the query into a token budget.
+
+    Args:
+        snippets (List[str]): research content gathered so far.
+        query (str): text the snippets are ranked against.
+        budget (int): maximum number of tokens of the packed context.
+        model (str): model whose tokenizer counts the tokens.
+
+    Returns:
+        Tuple[str, dict]: the context, best snippets first, and the token
+            counts before and after packing.
+    """
+    separator = "\n\n"
+    sep_tokens = count_tokens(separator, model)
+    tokens = [count_tokens(snippet, model) for snippet in snippets]
+    scores = BM25Index(snippets).scores(query)
+    # best score first, ties keep the order the research was gathered in
+    ranked = sorted(range(len(snippets)), key=lambda i: (-scores[i], i))
+
+    packed, used = [], 0
+    for i in ranked:
+        cost = tokens[i] + (sep_tokens if packed else 0)
+        if used + cost > budget:
+            continue
+        packed.append(snippets[i])
+        used += cost
+
+    stats = {
+        "snippets": len(snippets),
+        "packed_snippets": len(packed),
+        "tokens": sum(tokens) + sep_tokens * max(len(snippets) - 1, 0),
+        "packed_tokens": used,
+    }
+    logger.info(
+        "context packed %(packed_snippets)s/%(snippets)s snippets, "
+        "%(packed_tokens)s/%(tokens)s tokens",
+        stats,
+    )
+    return separator.join(packed), stats
@@ -0,0 +1,180 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from typing import List, Tuple
+
+# Mersenne prime for the universal hash family of the permutations
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NUM_PERM = 64
+_rng = random.Random(1729)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(_NUM_PERM)
+]
+# Words that do not change what a search query asks for
+_QUERY_STOPWORDS = frozenset(
+    "a an and are as at be between by de for from how in into is it its of on or "
+    "the their to vs what when which who why with".split()
+)
+
+
+def shingles(text: str, k: int = 3) -> set:
+    """Set of the k-word shingles of a text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + k]) for i in range(len(words) - k + 1)}
+
+
+def jaccard(a: str, b: str) -> float:
+    """Exact Jaccard similarity of the shingles of two texts, 1 for two
+    texts without words.
+    """
+    sa, sb = shingles(a), shingles(b)
+    if not sa and not sb:
+        return 1.0
+    return len(sa & sb) / len(sa | sb)
+
+
+def query_terms(query: str) -> frozenset:
+    """Content words of a search query, lowercased and without plural s, so
+    that rewordings such as "impact of X on Y" and "X impacts on Y" match.
+    """
+    terms = set()
+    for word in re.findall(r"\w+", query.lower()):
+        if word in _QUERY_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the content words of two search queries."""
+    ta, tb = query_terms(a), query_terms(b)
+    if not ta or not tb:
+        return float(ta == tb)
+    return len(ta & tb) / len(ta | tb)
+
+
+@lru_cache(maxsize=4096)
+def minhash(text: str) -> Tuple[int, ...]:
+    """MinHash signature of the shingles of a text. Cached, so snippets kept
+    across research rounds are only hashed once per process.
+    """
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in shingles(text)
+    ]
+    if not hashes:
+        return ()
+    return tuple(
+        min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH for a, b in _PERMUTATIONS
+    )
+
+
+# Incremental near duplicate detection with MinHash and locality sensitive hashing
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = 0.8, bands: int = 16) -> None:
+        """Create an empty index.
+
+        Args:
+            threshold (float): estimated Jaccard similarity of the shingles
+                above which a text is a near duplicate.
+            bands (int): LSH bands, the signature is split into bands of
+                equal rows and texts sharing a band become candidates.
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = _NUM_PERM // bands
+        self.buckets = defaultdict(list)
+        self.signatures = []
+
+    def _bands(self, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [
+            (i, signature[i * self.rows : (i + 1) * self.rows])
+            for i in range(self.bands)
+        ]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Whether the text is empty or a near duplicate of an indexed text."""
+        signature = minhash(text)
+        if not signature:
+            return True
+        candidates = {i for band in self._bands(signature) for i in self.buckets[band]}
+        for i in candidates:
+            other = self.signatures[i]
+            same = sum(x == y for x, y in zip(signature, other))
+            if same / _NUM_PERM >= self.threshold:
+                return True
+        return False
+
+    def add(self, text: str, force: bool = False) -> bool:
+        """Index a text unless it is a near duplicate.
+
+        Args:
+            text (str): text to index.
+            force (bool): index it even if it is a near duplicate.
+
+        Returns:
+            bool: whether the text was indexed.
+        """
+        if not force and self.is_duplicate(text):
+            return False
+        signature = minhash(text)
+        for band in self._bands(signature):
+            self.buckets[band].append(len(self.signatures))
+        self.signatures.append(signature)
+        return True
+
+
+def content_digest(texts: List[str]) -> str:
+    """Digest of a list of texts, in order."""
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        digest.update(text.encode())
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+# Indexes of the content of recent research rounds, so that a round only
+# indexes its new results instead of all the content gathered so far
+class IndexCache:
+    def __init__(self, threshold: float = 0.8, max_entries: int = 256) -> None:
+        """Create an empty cache.
+
+        Args:
+            threshold (float): threshold of the indexes, see NearDuplicateIndex.
+            max_entries (int): indexes kept before the least recently used
+                ones are dropped.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+
+    def take(self, content: List[str]) -> NearDuplicateIndex:
+        """Index of exactly this content, removed from the cache as the caller
+        adds to it, or a new one when no round ended with this content, e.g.
+        after a rollback to an earlier checkpoint.
+        """
+        with self.lock:
+            index = self.indexes.pop(content_digest(content), None)
+        if index is None:
+            index = NearDuplicateIndex(self.threshold)
+            for text in content:
+                index.add(text, force=True)
+        return index
+
+    def put(self, content: List[str], index: NearDuplicateIndex) -> None:
+        """Keep the index of the content for the next round."""
+        key = content_digest(content)
+        with self.lock:
+            self.indexes[key] = index
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.max_entries:
+                self.indexes.popitem(last=False)
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+
+def summarize(update: dict, skip=("lnode", "count")) -> str:
+    """Compact summary of the state update of a node, large fields are
+    replaced by their size.
+    """
+    parts = []
+    for key, value in update.items():
+        if key in skip:
+            continue
+        if isinstance(value, str):
+            parts.append(f"{key}: {len(value)} chars")
+        elif isinstance(value, (list, tuple)):
+            parts.append(f"{key}: {len(value)} items")
+        elif isinstance(value, dict):
+            fields = ", ".join(f"{k}={v}" for k, v in value.items())
+            parts.append(f"{key}: {{{fields}}}")
+        else:
+            parts.append(f"{key}: {value}")
+    return ", ".join(parts)
+
+
+# Bounded log of step summaries per thread, for the least recently used threads
+class EventLog:
+    def __init__(self, maxlen: int = 200, max_threads: int = 1000) -> None:
+        """Create an empty log.
+
+        Args:
+            maxlen (int): entries kept per thread. The oldest quarter is
+                dropped at once when it is full, so the text of a thread only
+                grows at the end between two trims.
+            max_threads (int): threads kept, the least recently used ones are
+                dropped.
+        """
+        self.maxlen = maxlen
+        self.trim = max(maxlen // 4, 1)
+        self.max_threads = max_threads
+        self.lock = threading.Lock()
+        self.logs = OrderedDict()
+
+    def add(self, thread_id, entry: str) -> None:
+        with self.lock:
+            log = self.logs.setdefault(thread_id, [])
+            self.logs.move_to_end(thread_id)
+            log.append(entry)
+            if len(log) > self.maxlen:
+                del log[: self.trim]
+            while len(self.logs) > self.max_threads:
+                self.logs.popitem(last=False)
+
+    def entries(self, thread_id) -> List[str]:
+        with self.lock:
+            return list(self.logs.get(thread_id, ()))
+
+    def render(self, thread_id) -> str:
+        """Text of the log of a thread. It only grows at the end between two
+        trims, so gradio streams just the new entries to the client.
+        """
+        return "".join(f"{entry}\n" for entry in self.entries(thread_id))
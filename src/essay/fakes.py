@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Iterator, List, Optional
+
+import httpx
+
+# Words the fake completions and search results are made of
+VOCABULARY = (
+    "essay research evidence argument history policy economy climate energy "
+    "society culture science data model theory practice impact growth risk "
+    "market public private global local change future past present study "
+    "report survey analysis result method source author claim counter point"
+).split()
+
+
+def _rng(*parts: str) -> random.Random:
+    """Random generator seeded by the text parts, so replies are repeatable."""
+    digest = hashlib.sha256("\x00".join(parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def _fill(schema: dict, rng: random.Random, defs: Optional[dict] = None):
+    """A value matching a JSON schema, enough for the structured outputs of
+    the agent.
+    """
+    defs = schema.get("$defs", defs or {})
+    if ref := schema.get("$ref"):
+        schema = defs[ref.rsplit("/", 1)[-1]]
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: _fill(prop, rng, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [_fill(schema.get("items", {}), rng, defs) for _ in range(3)]
+    if kind == "integer":
+        return rng.randint(1, 10)
+    if kind == "number":
+        return rng.random()
+    if kind == "boolean":
+        return False
+    return _text(rng, 4)
+
+
+# Stand-in for the OpenAI chat completions API, plugged into ChatOpenAI as an
+# httpx transport so the real client code runs without network or API credit
+class FakeOpenAI:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        token_latency: float = 0.0,
+        words: int = 300,
+        seed: int = 0,
+    ) -> None:
+        """Create the fake API.
+
+        Args:
+            latency (float): seconds before the first token of a reply.
+            token_latency (float): seconds between two streamed words.
+            words (int): words of a text reply.
+            seed (int): seed of the replies, the same prompt and seed give
+                the same reply.
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.words = words
+        self.seed = seed
+        self.requests = 0
+
+    def options(self) -> dict:
+        """Keyword arguments of ChatOpenAI that route it to this fake."""
+        return {
+            "api_key": "fake",
+            "base_url": "http://fake-openai/v1",
+            "http_client": httpx.Client(transport=httpx.MockTransport(self.handle)),
+            "http_async_client": httpx.AsyncClient(
+                transport=httpx.MockTransport(self.ahandle)
+            ),
+        }
+
+    def reply(self, body: dict) -> dict:
+        """Message and usage of a chat completion request."""
+        self.requests += 1
+        prompt = "\n".join(str(m.get("content") or "") for m in body["messages"])
+        rng = _rng(str(self.seed), prompt)
+        usage = {"prompt_tokens": len(prompt) // 4 + 4 * len(body["messages"])}
+        if tools := body.get("tools"):
+            function = tools[0]["function"]
+            arguments = json.dumps(_fill(function["parameters"], rng))
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": "call_0",
+                        "type": "function",
+                        "function": {"name": function["name"], "arguments": arguments},
+                    }
+                ],
+            }
+            usage["completion_tokens"] = len(arguments) // 4
+        else:
+            response_format = body.get("response_format") or {}
+            if response_format.get("type") == "json_schema":
+                schema = response_format["json_schema"]["schema"]
+                content = json.dumps(_fill(schema, rng))
+            else:
+                content = self.essay(rng)
+            message = {"role": "assistant", "content": content}
+            usage["completion_tokens"] = len(content) // 4
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return {"message": message, "usage": usage}
+
+    def essay(self, rng: random.Random) -> str:
+        """Text reply of `words` words in paragraphs of about 60."""
+        paragraphs = max(1, round(self.words / 60))
+        sizes = [self.words // paragraphs] * paragraphs
+        sizes[-1] += self.words % paragraphs
+        return "\n\n".join(_text(rng, size) for size in sizes)
+
+    def _completion(self, body: dict, reply: dict) -> dict:
+        finish = "tool_calls" if reply["message"].get("tool_calls") else "stop"
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [
+                {"index": 0, "message": reply["message"], "finish_reason": finish}
+            ],
+            "usage": reply["usage"],
+        }
+
+    def _chunks(self, body: dict, reply: dict) -> Iterator[dict]:
+        """Chunks of a streamed reply, one per word of the content."""
+        base = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": body["model"],
+        }
+        message = reply["message"]
+        if message.get("tool_calls"):
+            call = dict(message["tool_calls"][0], index=0)
+            deltas = [{"role": "assistant", "tool_calls": [call]}]
+            finish = "tool_calls"
+        else:
+            words = message["content"].split(" ")
+            deltas = [{"role": "assistant", "content": words[0]}]
+            deltas += [{"content": f" {word}"} for word in words[1:]]
+            finish = "stop"
+        for i, delta in enumerate(deltas):
+            last = i == len(deltas) - 1
+            choice = {
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish if last else None,
+            }
+            yield dict(base, choices=[choice])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield dict(base, choices=[], usage=reply["usage"])
+
+    @staticmethod
+    def _event(chunk: dict) -> bytes:
+        return f"data: {json.dumps(chunk)}\n\n".encode()
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        reply = self.reply(body)
+        time.sleep(self.latency)
+        if not body.get("stream"):
+            return httpx.Response(200, json=self._completion(body, reply))
+
+        def events() -> Iterator[bytes]:
+            for chunk in self._chunks(body, reply):
+                yield self._event(chunk)
+                time.sleep(self.token_latency)
+            yield b"data: [DONE]\n\n"
+
+        headers = {"content-type": "text/event-stream"}
+        return httpx.Response(200, headers=headers, content=events())
+
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        reply = self.reply(body)
+        await asyncio.sleep(self.latency)
+        if not body.get("stream"):
+            return httpx.Response(200, json=self._completion(body, reply))
+
+        async def events():
+            for chunk in self._chunks(body, reply):
+                yield self._event(chunk)
+                await asyncio.sleep(self.token_latency)
+            yield b"data: [DONE]\n\n"
+
+        headers = {"content-type": "text/event-stream"}
+        return httpx.Response(200, headers=headers, content=events())
+
+
+# Stand-in for TavilyClient with repeatable results and a fixed latency
+class FakeSearch:
+    def __init__(self, latency: float = 0.3, words: int = 120, seed: int = 0) -> None:
+        self.latency = latency
+        self.words = words
+        self.seed = seed
+        self.requests = 0
+
+    def results(self, query: str, max_results: int) -> dict:
+        self.requests += 1
+        rng = _rng(str(self.seed), query)
+        results: List[dict] = [
+            {
+                "title": _text(rng, 5),
+                "url": f"https://example.com/{rng.getrandbits(32):x}",
+                "content": _text(rng, self.words),
+                "score": round(rng.random(), 3),
+            }
+            for _ in range(max_results)
+        ]
+        return {"query": query, "results": results}
+
+    def search(self, query: str, max_results: int = 5, **params) -> dict:
+        time.sleep(self.latency)
+        return self.results(query, max_results)
+
+
+# Async stand-in for AsyncTavilyClient
+class AsyncFakeSearch(FakeSearch):
+    async def search(self, query: str, max_results: int = 5, **params) -> dict:
+        await asyncio.sleep(self.latency)
+        return self.results(query, max_results)
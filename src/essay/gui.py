@@ -1,28 +1,121 @@
+import asyncio
+import difflib
+import json
 import os
-from typing import Generator, Union
+import threading
+import time
+from typing import AsyncGenerator, Generator, Optional, Union
 
 import gradio as gr
 from langgraph.graph import StateGraph
 
+from essay.agent import ACCUMULATED
+from essay.events import EventLog, summarize
+from essay.jobs import DONE, FAILED, JobQueue
+from essay.metrics import default_metrics
+from essay.ratelimit import default_scheduler
+
+
+def diff_values(old: dict, new: dict) -> str:
+    """Per field differences between two states: a unified diff for text,
+    added and removed items for lists and the old and new value otherwise.
+    """
+    lines = []
+    for key in [*new, *(k for k in old if k not in new)]:
+        before, after = old.get(key), new.get(key)
+        if before == after:
+            continue
+        lines.append(f"== {key}")
+        if isinstance(before, str) and isinstance(after, str):
+            diff = difflib.unified_diff(
+                before.splitlines(), after.splitlines(), lineterm="", n=1
+            )
+            lines.extend(list(diff)[2:])  # skip the file headers
+        elif isinstance(before, list) and isinstance(after, list):
+            lines.extend(f"- {item}" for item in before if item not in after)
+            lines.extend(f"+ {item}" for item in after if item not in before)
+        else:
+            lines.append(f"{before!r} -> {after!r}")
+    return "\n".join(lines) or "no changes"
+
+
+def edit_values(values: dict) -> dict:
+    """Values of a state edit, without the keys the graph accumulates with a
+    reducer: sending their stored value back would add it to itself. The stop
+    reason is cleared, an edited thread goes on revising.
+    """
+    values = {k: v for k, v in values.items() if k not in ACCUMULATED}
+    values["stop_reason"] = ""
+    return values
+
+
+# State of one browser session, kept in a gr.State so sessions do not share threads
+class Session:
+    def __init__(self, threads=()):
+        self.threads = list(threads)
+        self.thread_id = max(self.threads, default=-1)
+        self.thread = {"configurable": {"thread_id": str(self.thread_id)}}
+        self.iterations = {}
+        # node updates of the running step, a list as parallel critics share
+        # a node name
+        self.updates = []
+
 
 # Graphical User Interface for the Essay Agent
 class EssayGui:
-    def __init__(self, graph, share=False):
+    def __init__(
+        self,
+        graph,
+        share=False,
+        stream=True,
+        max_runs=4,
+        metrics=None,
+        scheduler=None,
+        queue: Optional[JobQueue] = None,
+    ):
         self.graph = graph
+        # with a queue, worker processes run the agent and the interface only
+        # submits runs and follows their progress
+        self.queue = queue
+        self.poll_interval = 0.5
+        # node and API call metrics shown in the Metrics tab
+        self.metrics = metrics or default_metrics()
+        self.scheduler = scheduler or default_scheduler()
         self.share = share
-        self.partial_message = ""
-        self.response = {}
+        # push model tokens to the live output while a node runs
+        self.stream = stream
+        # agent runs executing at once, further runs wait in the gradio queue
+        self.max_runs = max_runs
+        # compact step summaries of every thread, bounded
+        self.events = EventLog()
         self.max_iterations = 10
-        self.iterations = []
-        self.threads = []
-        self.thread_id = -1
-        self.thread = {"configurable": {"thread_id": str(self.thread_id)}}
-        # self.sdisps = {} #global
+        # rows per page of the state snapshots table
+        self.page_size = 20
+        # new threads get ids after those the checkpointer kept from earlier
+        # runs. The saved threads belong to no session, so none can open them.
+        self.saved = self.saved_threads()
+        self.last_thread_id = max(self.saved, default=-1)
+        self.lock = threading.Lock()
         self.demo = self.create_interface()
 
-    def run_agent(self, start, topic, stop_after) -> Generator[tuple, None, None]:
+    def new_session(self) -> Session:
+        """State of a new browser session, it only sees the threads it starts."""
+        return Session()
+
+    def new_thread_id(self) -> int:
+        """Allocate a thread id no other session uses."""
+        with self.lock:
+            self.last_thread_id += 1
+            return self.last_thread_id
+
+    def begin_run(self, session, start, topic) -> Optional[dict]:
+        """Input of a run, a new essay gets a new thread.
+
+        Returns:
+            dict: the initial state of the new thread, None to continue the
+                current one.
+        """
         if start:
-            self.iterations.append(0)
             config = {
                 "task": topic,
                 "max_revisions": 2,
@@ -37,91 +130,247 @@ class EssayGui:
                 "queries": "no queries",
                 "count": 0,
             }
-            self.thread_id += 1  # new agent, new thread
-            self.threads.append(self.thread_id)
+            session.thread_id = self.new_thread_id()  # new agent, new thread
+            session.threads.append(session.thread_id)
+            session.iterations[session.thread_id] = 0
         else:
             config = None
-        self.thread = {"configurable": {"thread_id": str(self.thread_id)}}
-        while self.iterations[self.thread_id] < self.max_iterations:
-            self.response = self.graph.invoke(config, self.thread)
-            self.iterations[self.thread_id] += 1
-            self.partial_message += str(self.response)
-            self.partial_message += "\n------------------\n\n"
-
-            lnode, nnode, _, rev, acount = self.get_disp_state()
-            yield self.partial_message, lnode, nnode, self.thread_id, rev, acount
+        session.thread = {"configurable": {"thread_id": str(session.thread_id)}}
+        return config
+
+    def begin_step(self, session) -> dict:
+        """Timing and streamed tokens of the step about to run."""
+        session.updates = []
+        return {"started": time.perf_counter(), "ttft": None, "tokens": ""}
+
+    def add_chunk(self, session, mode: str, chunk, step: dict) -> bool:
+        """Record a chunk of `graph.stream`.
+
+        Returns:
+            bool: whether it added tokens to the live output.
+        """
+        if mode == "updates":
+            chunk.pop("__interrupt__", None)
+            session.updates.extend(chunk.values())
+            return False
+        message, metadata = chunk
+        # structured output calls stream tool call arguments, no content
+        if not isinstance(message.content, str) or not message.content:
+            return False
+        if step["ttft"] is None:
+            step["ttft"] = time.perf_counter() - step["started"]
+            step["tokens"] = f"[{metadata['langgraph_node']}] "
+        step["tokens"] += message.content
+        return True
+
+    def end_step(self, session, step: dict, disp: tuple) -> None:
+        """Log the step that just ran, `disp` is the display state after it."""
+        session.iterations[session.thread_id] = (
+            session.iterations.get(session.thread_id, 0) + 1
+        )
+        lnode, nnode, _, rev, acount = disp
+        entry = f"{acount}: {lnode} -> {', '.join(nnode) or 'END'}, rev {rev}"
+        for update in session.updates:
+            entry += f" | {summarize(update)}"
+        entry += f" | {time.perf_counter() - step['started']:.1f}s"
+        if step["ttft"] is not None:
+            entry += f", time to first token {step['ttft']:.2f}s"
+        self.events.add(session.thread_id, entry)
+
+    def run_agent(
+        self, session, start, topic, stop_after
+    ) -> Generator[tuple, None, None]:
+        config = self.begin_run(session, start, topic)
+        stream_mode = ["messages", "updates"] if self.stream else ["updates"]
+        disp = (
+            self.get_disp_state(session)
+            if config is None
+            else ("", (), session.thread_id, 0, 0)
+        )
+        while session.iterations.get(session.thread_id, 0) < self.max_iterations:
+            step = self.begin_step(session)
+            # each call runs a single node, the graph interrupts after every node
+            for mode, chunk in self.graph.stream(
+                config, session.thread, stream_mode=stream_mode
+            ):
+                if self.add_chunk(session, mode, chunk, step):
+                    yield self.events.render(session.thread_id), step["tokens"], *disp
+            disp = self.get_disp_state(session)
+            self.end_step(session, step, disp)
+            yield self.events.render(session.thread_id), step["tokens"], *disp
             config = None
 
-            if not nnode:
+            lnode, nnode, *_ = disp
+            if not nnode or lnode in stop_after:
                 return
-            if lnode in stop_after:
+
+    async def arun_agent(
+        self, session, start, topic, stop_after
+    ) -> AsyncGenerator[tuple, None]:
+        """Async `run_agent`, the nodes run on the event loop of gradio so a
+        waiting run does not hold a worker thread.
+        """
+        if self.queue is not None:
+            async for update in self.arun_job(session, start, topic, stop_after):
+                yield update
+            return
+        config = self.begin_run(session, start, topic)
+        stream_mode = ["messages", "updates"] if self.stream else ["updates"]
+        disp = (
+            await self.aget_disp_state(session)
+            if config is None
+            else ("", (), session.thread_id, 0, 0)
+        )
+        while session.iterations.get(session.thread_id, 0) < self.max_iterations:
+            step = self.begin_step(session)
+            async for mode, chunk in self.graph.astream(
+                config, session.thread, stream_mode=stream_mode
+            ):
+                if self.add_chunk(session, mode, chunk, step):
+                    yield self.events.render(session.thread_id), step["tokens"], *disp
+            disp = await self.aget_disp_state(session)
+            self.end_step(session, step, disp)
+            yield self.events.render(session.thread_id), step["tokens"], *disp
+            config = None
+
+            lnode, nnode, *_ = disp
+            if not nnode or lnode in stop_after:
                 return
-            else:
-                pass
-        return
 
-    def get_disp_state(
-        self,
-    ) -> tuple:
+    async def arun_job(
+        self, session, start, topic, stop_after
+    ) -> AsyncGenerator[tuple, None]:
+        """`arun_agent` through the job queue: a worker runs the nodes and the
+        step summaries it logs are polled into the event log of the thread.
+        """
+        config = self.begin_run(session, start, topic)
+        max_steps = self.max_iterations - session.iterations.get(session.thread_id, 0)
+        if max_steps <= 0:
+            return
+        job_id = await asyncio.to_thread(
+            self.queue.submit, session.thread_id, config, stop_after, max_steps
+        )
+        disp = (
+            await self.aget_disp_state(session)
+            if config is None
+            else ("", (), session.thread_id, 0, 0)
+        )
+        last_event, last_status = 0, None
+        while True:
+            job = await asyncio.to_thread(self.queue.get, job_id)
+            events = await asyncio.to_thread(self.queue.events, job_id, last_event)
+            for last_event, step, entry in events:
+                self.events.add(session.thread_id, entry)
+                if step:
+                    session.iterations[session.thread_id] = (
+                        session.iterations.get(session.thread_id, 0) + 1
+                    )
+            status = f"job {job_id} {job['status']}"
+            if job["worker"]:
+                status += f" on {job['worker']}"
+            if events:
+                disp = await self.aget_disp_state(session)
+            if events or status != last_status:
+                yield self.events.render(session.thread_id), status, *disp
+            last_status = status
+            if job["status"] in (DONE, FAILED):
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def saved_threads(self) -> list:
+        """Ids of the threads the checkpointer kept from earlier runs."""
+        threads = getattr(self.graph.checkpointer, "threads", list)()
+        return sorted(int(t) for t in threads if t.isdigit())
+
+    def get_disp_state(self, session) -> tuple:
         """Get the current state of the agent for display purposes.
         Returns:
             tuple: last node, next node, thread id, revisions, count.
         """
-        # get the current state of the agent
-        current_state = self.graph.get_state(self.thread)
+        return self.disp_values(session, self.graph.get_state(session.thread))
+
+    async def aget_disp_state(self, session) -> tuple:
+        """Async `get_disp_state`."""
+        current_state = await self.graph.aget_state(session.thread)
+        return self.disp_values(session, current_state)
+
+    def disp_values(self, session, current_state) -> tuple:
         lnode = current_state.values["lnode"]
         acount = current_state.values["count"]
         rev = current_state.values["revisions"]
         nnode = current_state.next
 
-        return lnode, nnode, self.thread_id, rev, acount
+        return lnode, nnode, session.thread_id, rev, acount
 
-    def get_state(self, key: str) -> Union[gr.update, str]:
+    def get_state(self, session, key: str) -> Union[gr.update, str]:
         """ "Get the state of the agent for a specific key.
         Args:
             key (str): The key to get the state for.
         Returns:
             gr.update: Gradio update object with the label and value."""
-        current_values = self.graph.get_state(self.thread)
+        current_values = self.graph.get_state(session.thread)
         if key in current_values.values:
-            lnode, nnode, self.thread_id, rev, astep = self.get_disp_state()
-            new_label = f"last_node: {lnode}, thread_id: {self.thread_id}, rev: {rev}, step: {astep}"  # noqa: E501
+            lnode, nnode, session.thread_id, rev, astep = self.get_disp_state(session)
+            new_label = f"last_node: {lnode}, thread_id: {session.thread_id}, rev: {rev}, step: {astep}"  # noqa: E501
             return gr.update(label=new_label, value=current_values.values[key])
         else:
             return ""
 
-    def get_content(
-        self,
-    ) -> Union[gr.update, str]:
+    def get_full_state(self, session) -> str:
+        """Get every field of the current state of the agent."""
+        current_values = self.graph.get_state(session.thread)
+        return json.dumps(current_values.values, indent=2, default=str)
+
+    def get_content(self, session) -> Union[gr.update, str]:
         """Get the content from the current state of the agent."""
-        current_values = self.graph.get_state(self.thread)
+        current_values = self.graph.get_state(session.thread)
         if "content" in current_values.values:
             content = current_values.values["content"]
-            lnode, nnode, thread_id, rev, astep = self.get_disp_state()
-            new_label = f"last_node: {lnode}, thread_id: {self.thread_id}, rev: {rev}, step: {astep}"  # noqa: E501
+            lnode, nnode, thread_id, rev, astep = self.get_disp_state(session)
+            new_label = f"last_node: {lnode}, thread_id: {session.thread_id}, rev: {rev}, step: {astep}"  # noqa: E501
             return gr.update(
                 label=new_label, value="\n\n".join(item for item in content) + "\n\n"
             )
         else:
             return ""
 
-    def update_hist_pd(
-        self,
-    ):
-        """Update the history pulldown with the current states."""
+    def history(self, session, min_step: int = 1) -> list:
+        """Summaries of the checkpoints of the current thread, latest first.
+        Read from the index of the checkpointer when it keeps one, so no
+        state is loaded.
+        """
+        if hasattr(self.graph.checkpointer, "history"):
+            return self.graph.checkpointer.history(session.thread_id, min_step)
         hist = []
         # curiously, this generator returns the latest first
-        for state in self.graph.get_state_history(self.thread):
-            if state.metadata["step"] < 1:
+        for state in self.graph.get_state_history(session.thread):
+            if state.metadata["step"] < min_step:
                 continue
-            checkpoint_id = state.config["configurable"]["checkpoint_id"]
-            tid = state.config["configurable"]["thread_id"]
-            count = state.values["count"]
-            lnode = state.values["lnode"]
-            rev = state.values["revisions"]
-            nnode = state.next
-            st = f"{tid}:{count}:{lnode}:{nnode}:{rev}:{checkpoint_id}"
-            hist.append(st)
+            hist.append(
+                {
+                    "thread_id": state.config["configurable"]["thread_id"],
+                    "checkpoint_id": state.config["configurable"]["checkpoint_id"],
+                    "step": state.metadata["step"],
+                    "count": state.values.get("count"),
+                    "lnode": state.values.get("lnode"),
+                    "next": state.next,
+                    "revisions": state.values.get("revisions"),
+                    "config": state.config,
+                }
+            )
+        return hist
+
+    def history_choices(self, session) -> list:
+        """Entries of the step pulldown."""
+        return [
+            f"{h['thread_id']}:{h['count']}:{h['lnode']}:{h['next']}:"
+            f"{h['revisions']}:{h['checkpoint_id']}"
+            for h in self.history(session)
+        ]
+
+    def update_hist_pd(self, session):
+        """Update the history pulldown with the current states."""
+        hist = self.history_choices(session)
         return gr.Dropdown(
             label="update_state from: thread:count:last_node:next_node:rev:checkpoint_id",  # noqa: E501
             choices=hist,
@@ -129,26 +378,92 @@ class EssayGui:
             interactive=True,
         )
 
-    def find_config(self, checkpoint_id):
-        for state in self.graph.get_state_history(self.thread):
-            config = state.config
-            if config["configurable"]["checkpoint_id"] == checkpoint_id:
-                return config
+    def find_config(self, session, checkpoint_id):
+        if hasattr(self.graph.checkpointer, "lookup"):
+            summary = self.graph.checkpointer.lookup(checkpoint_id)
+            if summary and summary["thread_id"] == str(session.thread_id):
+                return summary["config"]
+            return None
+        for h in self.history(session):
+            if h["checkpoint_id"] == checkpoint_id:
+                return h["config"]
         return None
 
-    def copy_state(self, hist_str) -> tuple:
+    def snapshot_page(self, session, page: int) -> tuple:
+        """One page of summary rows of the state snapshots, latest first.
+
+        Returns:
+            tuple: gradio update of the table and the page number shown.
+        """
+        hist = self.history(session, min_step=-1)
+        pages = max((len(hist) + self.page_size - 1) // self.page_size, 1)
+        page = min(max(int(page or 1), 1), pages)
+        start = (page - 1) * self.page_size
+        rows = [
+            [
+                h["step"],
+                h["count"],
+                h["lnode"],
+                str(h["next"]),
+                h["revisions"],
+                h["checkpoint_id"],
+            ]
+            for h in hist[start : start + self.page_size]
+        ]
+        label = f"thread_id: {session.thread_id}, page {page} of {pages}, {len(hist)} snapshots"  # noqa: E501
+        return gr.update(value=rows, label=label), page
+
+    def snapshot_detail(self, session, evt: gr.SelectData) -> tuple:
+        """Full values of the snapshot of the selected row and what changed
+        since the previous checkpoint.
+        """
+        config = self.find_config(session, evt.row_value[-1])
+        if config is None:
+            return "", ""
+        state = self.graph.get_state(config)
+        previous = {}
+        if state.parent_config is not None:
+            previous = self.graph.get_state(state.parent_config).values
+        values = json.dumps(state.values, indent=2, default=str)
+        return values, diff_values(previous, state.values)
+
+    def metrics_tables(self, session) -> tuple:
+        """Node metrics of all threads and of the current one, the queues of
+        the rate limits and the hits and misses of the caches.
+        """
+        limits = [
+            [
+                api,
+                m["calls"],
+                m["queued"],
+                m["max_queued"],
+                round(m["mean_wait_seconds"], 2),
+                round(m["max_wait_seconds"], 2),
+                m["retries"],
+                m["throttled"],
+            ]
+            for api, m in sorted(self.scheduler.stats().items())
+        ]
+        return (
+            self.metrics.node_rows(),
+            self.metrics.thread_rows(session.thread_id),
+            limits,
+            self.metrics.cache_rows(),
+        )
+
+    def copy_state(self, session, hist_str) -> tuple:
         """result of selecting an old state from the step pulldown.
         Note does not change thread. This copies an old state to a new current state.
         """
         checkpoint_id = hist_str.split(":")[-1]
         # print(f"copy_state from {checkpoint_id}")
-        config = self.find_config(checkpoint_id)
+        config = self.find_config(session, checkpoint_id)
         # print(config)
         state = self.graph.get_state(config)
         self.graph.update_state(
-            self.thread, state.values, as_node=state.values["lnode"]
+            session.thread, edit_values(state.values), as_node=state.values["lnode"]
         )
-        new_state = self.graph.get_state(self.thread)  # should now match
+        new_state = self.graph.get_state(session.thread)  # should now match
         new_checkpoint_id = new_state.config["configurable"]["checkpoint_id"]
         # tid = new_state.config["configurable"]["thread_id"]
         count = new_state.values["count"]
@@ -157,32 +472,33 @@ class EssayGui:
         nnode = new_state.next
         return lnode, nnode, new_checkpoint_id, rev, count
 
-    def update_thread_pd(
-        self,
-    ):
+    def update_thread_pd(self, session):
         """Update the thread pulldown with the current threads."""
         return gr.Dropdown(
             label="choose thread",
-            choices=self.threads,
-            value=self.thread_id,
+            choices=session.threads,
+            value=session.thread_id,
             interactive=True,
         )
 
-    def switch_thread(self, new_thread_id: str) -> None:
-        self.thread = {"configurable": {"thread_id": str(new_thread_id)}}
-        self.thread_id = new_thread_id
+    def switch_thread(self, session, new_thread_id: str) -> None:
+        session.thread = {"configurable": {"thread_id": str(new_thread_id)}}
+        session.thread_id = new_thread_id
         return
 
-    def modify_state(self, key: str, asnode: StateGraph, new_state: StateGraph) -> None:
+    def modify_state(
+        self, session, key: str, asnode: StateGraph, new_state: StateGraph
+    ) -> None:
         """gets the current state, modifes a single value in the state identified
         by key, and updates state with it. note that this will create a new
         'current state' node. If you do this multiple times with different keys,
          it will create one for each update. Note also that it doesn't resume after
          the update.
         """
-        current_values = self.graph.get_state(self.thread)
-        current_values.values[key] = new_state
-        self.graph.update_state(self.thread, current_values.values, as_node=asnode)
+        current_values = self.graph.get_state(session.thread)
+        values = edit_values(current_values.values)
+        values[key] = new_state
+        self.graph.update_state(session.thread, values, as_node=asnode)
         return
 
     def create_interface(self) -> gr.Blocks:
@@ -191,23 +507,13 @@ class EssayGui:
         with gr.Blocks(
             theme=gr.themes.Default(spacing_size="sm", text_size="sm")
         ) as demo:
+            # gradio gives every session its own deep copy
+            session = gr.State(self.new_session())
 
-            def updt_disp() -> dict:
+            def updt_disp(session) -> dict:
                 """general update display on state change"""
-                current_state = self.graph.get_state(self.thread)
-                hist = []
-                # curiously, this generator returns the latest first
-                for state in self.graph.get_state_history(self.thread):
-                    if state.metadata["step"] < 1:  # ignore early states
-                        continue
-                    s_checkpoint_id = state.config["configurable"]["checkpoint_id"]
-                    s_tid = state.config["configurable"]["thread_id"]
-                    s_count = state.values["count"]
-                    s_lnode = state.values["lnode"]
-                    s_rev = state.values["revisions"]
-                    s_nnode = state.next
-                    st = f"{s_tid}:{s_count}:{s_lnode}:{s_nnode}:{s_rev}:{s_checkpoint_id}"  # noqa: E501
-                    hist.append(st)
+                current_state = self.graph.get_state(session.thread)
+                hist = self.history_choices(session)
                 if not current_state.metadata:  # handle init call
                     return {}
                 else:
@@ -217,11 +523,11 @@ class EssayGui:
                         count_bx: current_state.values["count"],
                         revision_bx: current_state.values["revisions"],
                         nnode_bx: current_state.next,
-                        threadid_bx: self.thread_id,
+                        threadid_bx: session.thread_id,
                         thread_pd: gr.Dropdown(
                             label="choose thread",
-                            choices=self.threads,
-                            value=self.thread_id,
+                            choices=session.threads,
+                            value=session.thread_id,
                             interactive=True,
                         ),
                         step_pd: gr.Dropdown(
@@ -232,24 +538,6 @@ class EssayGui:
                         ),
                     }
 
-            def get_snapshots() -> gr.update:
-                """Get the summaries of all state snapshots."""
-                new_label = f"thread_id: {self.thread_id}, Summary of snapshots"
-                sstate = ""
-                for state in self.graph.get_state_history(self.thread):
-                    for key in ["plan", "draft", "critique"]:
-                        if key in state.values:
-                            state.values[key] = state.values[key][:80] + "..."
-                    if "content" in state.values:
-                        for i in range(len(state.values["content"])):
-                            state.values["content"][i] = (
-                                state.values["content"][i][:20] + "..."
-                            )
-                    if "writes" in state.metadata:
-                        state.metadata["writes"] = "not shown"
-                    sstate += str(state) + "\n\n"
-                return gr.update(label=new_label, value=sstate)
-
             def vary_btn(stat) -> gr.update:
                 return gr.update(variant=stat)
 
@@ -281,7 +569,7 @@ class EssayGui:
                     )
                     with gr.Row():
                         thread_pd = gr.Dropdown(
-                            choices=self.threads,
+                            choices=[],
                             interactive=True,
                             label="select thread",
                             min_width=120,
@@ -294,7 +582,16 @@ class EssayGui:
                             min_width=160,
                             scale=1,
                         )
-                live = gr.Textbox(label="Live Agent Output", lines=5, max_lines=10)
+                live = gr.Textbox(
+                    label="Live Agent Output", lines=5, max_lines=10, autoscroll=True
+                )
+                node_output = gr.Textbox(label="Node Output", lines=3, max_lines=10)
+                with gr.Accordion("Full State", open=False):
+                    full_state_btn = gr.Button("Refresh")
+                    full_state = gr.Textbox(label="state", lines=10)
+                full_state_btn.click(
+                    fn=self.get_full_state, inputs=session, outputs=full_state
+                )
 
                 # actions
                 sdisps = [
@@ -307,29 +604,52 @@ class EssayGui:
                     step_pd,
                     thread_pd,
                 ]
-                thread_pd.input(self.switch_thread, [thread_pd], None).then(
-                    fn=updt_disp, inputs=None, outputs=sdisps
+                live_outputs = [
+                    live,
+                    node_output,
+                    lnode_bx,
+                    nnode_bx,
+                    threadid_bx,
+                    revision_bx,
+                    count_bx,
+                ]
+                thread_pd.input(self.switch_thread, [session, thread_pd], None).then(
+                    fn=updt_disp, inputs=session, outputs=sdisps
                 )
-                step_pd.input(self.copy_state, [step_pd], None).then(
-                    fn=updt_disp, inputs=None, outputs=sdisps
+                step_pd.input(self.copy_state, [session, step_pd], None).then(
+                    fn=updt_disp, inputs=session, outputs=sdisps
                 )
                 gen_btn.click(
                     vary_btn, gr.Number("secondary", visible=False), gen_btn
                 ).then(
-                    fn=self.run_agent,
-                    inputs=[gr.Number(True, visible=False), topic_bx, stop_after],
-                    outputs=[live],
+                    fn=self.arun_agent,
+                    inputs=[
+                        session,
+                        gr.Number(True, visible=False),
+                        topic_bx,
+                        stop_after,
+                    ],
+                    outputs=live_outputs,
                     show_progress=True,
-                ).then(fn=updt_disp, inputs=None, outputs=sdisps).then(
+                    concurrency_limit=self.max_runs,
+                    concurrency_id="run_agent",
+                ).then(fn=updt_disp, inputs=session, outputs=sdisps).then(
                     vary_btn, gr.Number("primary", visible=False), gen_btn
                 ).then(vary_btn, gr.Number("primary", visible=False), cont_btn)
                 cont_btn.click(
                     vary_btn, gr.Number("secondary", visible=False), cont_btn
                 ).then(
-                    fn=self.run_agent,
-                    inputs=[gr.Number(False, visible=False), topic_bx, stop_after],
-                    outputs=[live],
-                ).then(fn=updt_disp, inputs=None, outputs=sdisps).then(
+                    fn=self.arun_agent,
+                    inputs=[
+                        session,
+                        gr.Number(False, visible=False),
+                        topic_bx,
+                        stop_after,
+                    ],
+                    outputs=live_outputs,
+                    concurrency_limit=self.max_runs,
+                    concurrency_id="run_agent",
+                ).then(fn=updt_disp, inputs=session, outputs=sdisps).then(
                     vary_btn, gr.Number("primary", visible=False), cont_btn
                 )
 
@@ -340,22 +660,25 @@ class EssayGui:
                 plan = gr.Textbox(label="Plan", lines=10, interactive=True)
                 refresh_btn.click(
                     fn=self.get_state,
-                    inputs=gr.Number("outline", visible=False),
+                    inputs=[session, gr.Number("outline", visible=False)],
                     outputs=plan,
                 )
                 modify_btn.click(
                     fn=self.modify_state,
                     inputs=[
+                        session,
                         gr.Number("outline", visible=False),
                         gr.Number("planner", visible=False),
                         plan,
                     ],
                     outputs=None,
-                ).then(fn=updt_disp, inputs=None, outputs=sdisps)
+                ).then(fn=updt_disp, inputs=session, outputs=sdisps)
             with gr.Tab("Research Content"):
                 refresh_btn = gr.Button("Refresh")
                 content_bx = gr.Textbox(label="content", lines=10)
-                refresh_btn.click(fn=self.get_content, inputs=None, outputs=content_bx)
+                refresh_btn.click(
+                    fn=self.get_content, inputs=session, outputs=content_bx
+                )
             with gr.Tab("Draft"):
                 with gr.Row():
                     refresh_btn = gr.Button("Refresh")
@@ -363,18 +686,19 @@ class EssayGui:
                 draft_bx = gr.Textbox(label="draft", lines=10, interactive=True)
                 refresh_btn.click(
                     fn=self.get_state,
-                    inputs=gr.Number("draft", visible=False),
+                    inputs=[session, gr.Number("draft", visible=False)],
                     outputs=draft_bx,
                 )
                 modify_btn.click(
                     fn=self.modify_state,
                     inputs=[
+                        session,
                         gr.Number("draft", visible=False),
                         gr.Number("generate", visible=False),
                         draft_bx,
                     ],
                     outputs=None,
-                ).then(fn=updt_disp, inputs=None, outputs=sdisps)
+                ).then(fn=updt_disp, inputs=session, outputs=sdisps)
             with gr.Tab("Critique"):
                 with gr.Row():
                     refresh_btn = gr.Button("Refresh")
@@ -382,23 +706,114 @@ class EssayGui:
                 critique_bx = gr.Textbox(label="Critique", lines=10, interactive=True)
                 refresh_btn.click(
                     fn=self.get_state,
-                    inputs=gr.Number("critique", visible=False),
+                    inputs=[session, gr.Number("critique", visible=False)],
                     outputs=critique_bx,
                 )
                 modify_btn.click(
                     fn=self.modify_state,
                     inputs=[
+                        session,
                         gr.Number("critique", visible=False),
                         gr.Number("reflect", visible=False),
                         critique_bx,
                     ],
                     outputs=None,
-                ).then(fn=updt_disp, inputs=None, outputs=sdisps)
+                ).then(fn=updt_disp, inputs=session, outputs=sdisps)
             with gr.Tab("StateSnapShots"):
                 with gr.Row():
                     refresh_btn = gr.Button("Refresh")
-                snapshots = gr.Textbox(label="State Snapshots Summaries")
-                refresh_btn.click(fn=get_snapshots, inputs=None, outputs=snapshots)
+                    prev_btn = gr.Button("Previous")
+                    next_btn = gr.Button("Next")
+                    page_nb = gr.Number(1, label="page", precision=0, min_width=80)
+                snapshots = gr.Dataframe(
+                    headers=["step", "count", "lnode", "next", "rev", "checkpoint_id"],
+                    label="State Snapshots Summaries",
+                    interactive=False,
+                )
+                with gr.Row():
+                    snapshot_bx = gr.Textbox(label="Selected snapshot", lines=10)
+                    diff_bx = gr.Textbox(label="Changes from previous", lines=10)
+                refresh_btn.click(
+                    fn=self.snapshot_page,
+                    inputs=[session, page_nb],
+                    outputs=[snapshots, page_nb],
+                )
+                prev_btn.click(
+                    fn=lambda session, page: self.snapshot_page(session, page - 1),
+                    inputs=[session, page_nb],
+                    outputs=[snapshots, page_nb],
+                )
+                next_btn.click(
+                    fn=lambda session, page: self.snapshot_page(session, page + 1),
+                    inputs=[session, page_nb],
+                    outputs=[snapshots, page_nb],
+                )
+                snapshots.select(
+                    fn=self.snapshot_detail,
+                    inputs=session,
+                    outputs=[snapshot_bx, diff_bx],
+                )
+            with gr.Tab("Metrics"):
+                metrics_btn = gr.Button("Refresh")
+                node_metrics = gr.Dataframe(
+                    headers=[
+                        "node",
+                        "runs",
+                        "p50 s",
+                        "p95 s",
+                        "mean s",
+                        "prompt tokens",
+                        "completion tokens",
+                        "searches",
+                        "search KB",
+                        "cost $",
+                    ],
+                    label="All threads",
+                    interactive=False,
+                )
+                thread_metrics = gr.Dataframe(
+                    headers=[
+                        "node",
+                        "runs",
+                        "seconds",
+                        "prompt tokens",
+                        "completion tokens",
+                        "searches",
+                        "search KB",
+                        "cost $",
+                    ],
+                    label="Current thread",
+                    interactive=False,
+                )
+                limit_metrics = gr.Dataframe(
+                    headers=[
+                        "api",
+                        "calls",
+                        "queued",
+                        "max queued",
+                        "mean wait s",
+                        "max wait s",
+                        "retries",
+                        "throttled",
+                    ],
+                    label="Rate limits",
+                    interactive=False,
+                )
+                cache_metrics = gr.Dataframe(
+                    headers=["cache", "hits", "misses", "hit rate", "entries"],
+                    label="Caches",
+                    interactive=False,
+                )
+                metrics_btn.click(
+                    fn=self.metrics_tables,
+                    inputs=session,
+                    outputs=[
+                        node_metrics,
+                        thread_metrics,
+                        limit_metrics,
+                        cache_metrics,
+                    ],
+                )
         return demo
 
     def launch(self, share=None) -> None:
@@ -407,6 +822,8 @@ class EssayGui:
             share (bool, optional): Whether to share the interface publicly.
             Defaults to False.
         """
+        if metrics_port := os.getenv("ESSAY_METRICS_PORT"):
+            self.metrics.serve(int(metrics_port), self.scheduler.prometheus)
         if port := os.getenv("PORT1"):
             self.demo.launch(share=True, server_port=int(port), server_name="0.0.0.0")
         else:
@@ -0,0 +1,356 @@
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from typing import List, Optional
+
+from essay.checkpoint import connect
+from essay.events import summarize
+
+logger = logging.getLogger(__name__)
+
+# Lifecycle of a job: queued -> running -> done or failed. A running job whose
+# lease ran out is queued work again, its worker is presumed dead.
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+# Durable queue of agent runs in sqlite, shared by the interface and the workers
+class JobQueue:
+    def __init__(
+        self, path: str = "jobs.sqlite", lease: float = 120, max_attempts: int = 3
+    ) -> None:
+        """Open the queue, creating its tables if needed.
+
+        Args:
+            path (str): path of the sqlite database.
+            lease (float): seconds a worker owns a job without renewing it.
+            max_attempts (int): claims of a job before it is failed, so a job
+                that kills its workers does not take down every one of them.
+        """
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = connect(path)
+        # transactions are explicit, claiming a job must lock the database
+        self.conn.isolation_level = None
+        with self.lock:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    thread_id TEXT NOT NULL,
+                    input TEXT,
+                    stop_after TEXT NOT NULL,
+                    max_steps INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    step INTEGER NOT NULL,
+                    entry TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS job_events_job_id
+                    ON job_events (job_id, id);
+                """
+            )
+
+    def submit(
+        self,
+        thread_id: str,
+        input: Optional[dict] = None,
+        stop_after: List[str] = (),
+        max_steps: int = 10,
+    ) -> int:
+        """Queue a run of a thread.
+
+        Args:
+            thread_id (str): thread the run continues, or starts with `input`.
+            input (dict, optional): initial state of a new thread, None to
+                continue from its last checkpoint.
+            stop_after (List[str]): nodes after which the run stops.
+            max_steps (int): nodes the run executes at most.
+
+        Returns:
+            int: id of the job.
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (thread_id, input, stop_after, max_steps, status, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(thread_id),
+                    None if input is None else json.dumps(input),
+                    json.dumps(list(stop_after)),
+                    max_steps,
+                    QUEUED,
+                    now,
+                    now,
+                ),
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Take the oldest queued job, or one whose worker stopped renewing its
+        lease, None when there is nothing to do.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # jobs abandoned too often are failed instead of claimed again
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "worker lost", now, RUNNING, now, self.max_attempts),
+                )
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? "
+                    "OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, "
+                        "attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (RUNNING, worker, now + self.lease, now, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return None if row is None else self.get(row[0])
+
+    def renew(self, job_id: int, worker: str) -> bool:
+        """Extend the lease of a running job.
+
+        Returns:
+            bool: False when the worker lost the job to another one.
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (now + self.lease, now, job_id, worker, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: int, worker: str, error: Optional[str] = None) -> None:
+        """Mark a job of the worker done, or failed with an error."""
+        status = FAILED if error else DONE
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (status, error, time.time(), job_id, worker, RUNNING),
+            )
+
+    def add_event(self, job_id: int, entry: str, step: bool = True) -> None:
+        """Log a line of progress, `step` tells a node run from a note."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO job_events (job_id, step, entry) VALUES (?, ?, ?)",
+                (job_id, step, entry),
+            )
+
+    def events(self, job_id: int, after: int = 0) -> List[tuple]:
+        """(event id, step, entry) of the events of a job logged after the
+        event `after`.
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, step, entry FROM job_events WHERE job_id = ? AND id > ? "
+                "ORDER BY id",
+                (job_id, after),
+            ).fetchall()
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([c[0] for c in cursor.description], row))
+        job["input"] = None if job["input"] is None else json.loads(job["input"])
+        job["stop_after"] = json.loads(job["stop_after"])
+        return job
+
+    def counts(self) -> dict:
+        """Number of jobs per status."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+# Executes queued jobs on a graph, one at a time
+class Worker:
+    def __init__(
+        self, graph, queue: JobQueue, name: Optional[str] = None, poll: float = 0.5
+    ) -> None:
+        """Create a worker.
+
+        Args:
+            graph: compiled essay graph, its checkpointer must be the store the
+                interface reads.
+            queue (JobQueue): queue the jobs are claimed from.
+            name (str, optional): worker name stored with its jobs, defaults
+                to host and process id.
+            poll (float): seconds between two claims of an empty queue.
+        """
+        self.graph = graph
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll = poll
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        """Claim and run jobs until `stop`."""
+        logger.info("worker %s waiting for jobs in %s", self.name, self.queue.path)
+        while not self.stopped.is_set():
+            job = self.queue.claim(self.name)
+            if job is None:
+                self.stopped.wait(self.poll)
+                continue
+            self.run_job(job)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run_job(self, job: dict) -> None:
+        """Run a job, renewing its lease from a thread while a node runs. A
+        worker that lost the lease stops after the running node, the job and
+        its thread belong to the worker that took it over.
+        """
+        done = threading.Event()
+        lost = threading.Event()
+
+        def renew() -> None:
+            while not done.wait(self.queue.lease / 3):
+                if not self.queue.renew(job["id"], self.name):
+                    logger.warning("job %s was taken over by another worker", job["id"])
+                    lost.set()
+                    return
+
+        renewer = threading.Thread(target=renew, name="essay-job-lease", daemon=True)
+        renewer.start()
+        try:
+            self.steps(job, lost)
+        except Exception as error:
+            logger.exception("job %s failed", job["id"])
+            self.queue.add_event(
+                job["id"], f"job {job['id']} failed: {error}", step=False
+            )
+            self.queue.finish(job["id"], self.name, error=repr(error))
+        else:
+            if not lost.is_set():
+                self.queue.finish(job["id"], self.name)
+        finally:
+            done.set()
+            renewer.join()
+
+    def steps(self, job: dict, lost: Optional[threading.Event] = None) -> None:
+        """Run the nodes of a job, one per call as the graph interrupts after
+        each, and log a summary of every step. Stops before the next node once
+        `lost` is set.
+        """
+        thread = {"configurable": {"thread_id": job["thread_id"]}}
+        config = job["input"]
+        if job["attempts"] > 1 and self.graph.get_state(thread).values:
+            # an earlier attempt died, resume from its last checkpoint
+            config = None
+            self.queue.add_event(
+                job["id"], f"job {job['id']} resumed by {self.name}", step=False
+            )
+        for _ in range(job["max_steps"]):
+            if lost is not None and lost.is_set():
+                logger.warning("job %s lost, stopping %s", job["id"], self.name)
+                return
+            started = time.perf_counter()
+            # a list, parallel critics share a node name
+            updates = []
+            for chunk in self.graph.stream(config, thread, stream_mode="updates"):
+                chunk.pop("__interrupt__", None)
+                updates.extend(chunk.values())
+            config = None
+            snapshot = self.graph.get_state(thread)
+            lnode = snapshot.values["lnode"]
+            entry = (
+                f"{snapshot.values['count']}: {lnode} -> "
+                f"{', '.join(snapshot.next) or 'END'}, "
+                f"rev {snapshot.values['revisions']}"
+            )
+            for update in updates:
+                entry += f" | {summarize(update)}"
+            entry += f" | {time.perf_counter() - started:.1f}s"
+            self.queue.add_event(job["id"], entry)
+            if not snapshot.next or lnode in job["stop_after"]:
+                return
+
+
+def work(queue_path: str, checkpoints: str) -> None:
+    """Entry point of a worker process: build an agent on the shared
+    checkpoint store and run the jobs of the queue.
+    """
+    from essay.agent import Agent, critics_from_env
+    from essay.checkpoint import CheckpointStore
+    from essay.retrieval import index_from_env
+
+    logging.basicConfig(level=logging.INFO)
+    # the interface process compacts the store, workers only write to it
+    store = CheckpointStore(checkpoints, compact_interval=None)
+    # configured like the agent of the interface
+    agent = Agent(
+        checkpointer=store,
+        llm_cache=os.getenv("ESSAY_LLM_CACHE"),
+        critics=critics_from_env(),
+        search_backend=index_from_env(),
+        compress_research=os.getenv("ESSAY_COMPRESS_RESEARCH") == "1",
+    )
+    Worker(agent.graph, JobQueue(queue_path)).run()
+
+
+def run_workers(processes: int, queue_path: str, checkpoints: str) -> None:
+    """Run worker processes until they exit or the parent is interrupted.
+
+    Args:
+        processes (int): worker processes, one job runs in each at a time.
+        queue_path (str): path of the job queue database.
+        checkpoints (str): path of the checkpoint database of the interface.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=work, args=(queue_path, checkpoints), name=f"essay-worker-{i}"
+        )
+        for i in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        # an interrupted job is claimed again once its lease runs out
+        for process in workers:
+            process.terminate()
+            process.join()
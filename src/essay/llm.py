@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import time
+from typing import Any, AsyncIterator, Iterator, List
+
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+from pydantic import Field
+
+from essay import metrics
+from essay.ratelimit import estimate_tokens
+
+
+# ChatOpenAI whose requests go through a rate limiter. It limits below the
+# response cache, so cached answers neither wait for the limits nor count
+# in the token and cost metrics.
+class ScheduledChatOpenAI(ChatOpenAI):
+    limiter: Any = Field(exclude=True)
+    # completion tokens assumed by the estimate of a call
+    completion_estimate: int = Field(default=1000, exclude=True)
+
+    def _estimate(self, messages: List[BaseMessage]) -> int:
+        return estimate_tokens(messages, self.max_tokens or self.completion_estimate)
+
+    def _account(self, estimate: int, message) -> None:
+        """Settle the estimate of a call and count its reported usage."""
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return
+        self.limiter.settle(estimate, usage["total_tokens"])
+        metrics.count(
+            prompt_tokens=usage["input_tokens"],
+            completion_tokens=usage["output_tokens"],
+            cost=metrics.llm_cost(
+                self.model_name, usage["input_tokens"], usage["output_tokens"]
+            ),
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._estimate(messages)
+        result = self.limiter.call(
+            super()._generate, messages, stop, run_manager, tokens=tokens, **kwargs
+        )
+        self._account(tokens, result.generations[0].message)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._estimate(messages)
+        result = await self.limiter.acall(
+            super()._agenerate, messages, stop, run_manager, tokens=tokens, **kwargs
+        )
+        self._account(tokens, result.generations[0].message)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator:
+        tokens = self._estimate(messages)
+        # a stream is retried only until its first chunk arrived
+        for attempt in itertools.count():
+            self.limiter.acquire(tokens)
+            started = time.perf_counter()
+            chunks = super()._stream(messages, stop, run_manager, **kwargs)
+            try:
+                first = next(chunks, None)
+                break
+            except Exception as error:
+                metrics.record_call(self.limiter.name, time.perf_counter() - started)
+                if (delay := self.limiter.backoff(error, attempt)) is None:
+                    raise
+                time.sleep(delay)
+        try:
+            for chunk in itertools.chain([first] if first else [], chunks):
+                self._account(tokens, chunk.message)
+                yield chunk
+        finally:
+            metrics.record_call(self.limiter.name, time.perf_counter() - started)
+
+    async def _astream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator:
+        tokens = self._estimate(messages)
+        for attempt in itertools.count():
+            await self.limiter.aacquire(tokens)
+            started = time.perf_counter()
+            chunks = super()._astream(messages, stop, run_manager, **kwargs)
+            try:
+                first = await anext(chunks, None)
+                break
+            except Exception as error:
+                metrics.record_call(self.limiter.name, time.perf_counter() - started)
+                if (delay := self.limiter.backoff(error, attempt)) is None:
+                    raise
+                await asyncio.sleep(delay)
+        try:
+            if first is None:
+                return
+            self._account(tokens, first.message)
+            yield first
+            async for chunk in chunks:
+                self._account(tokens, chunk.message)
+                yield chunk
+        finally:
+            metrics.record_call(self.limiter.name, time.perf_counter() - started)
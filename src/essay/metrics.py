@@ -0,0 +1,318 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.config import get_config
+
+logger = logging.getLogger(__name__)
+
+# USD per million prompt and completion tokens
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+# USD per search request, a basic Tavily search costs one credit
+SEARCH_PRICE = 0.008
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, float("inf"))
+COUNTERS = (
+    "prompt_tokens",
+    "completion_tokens",
+    "searches",
+    "search_bytes",
+    "cost",
+)
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a chat call, 0 for models without a price."""
+    prompt, completion = PRICES.get(model, (0.0, 0.0))
+    return (prompt * prompt_tokens + completion * completion_tokens) / 1e6
+
+
+# Counters of the external calls made by one node run
+class Step:
+    def __init__(self, metrics: "Metrics") -> None:
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def add(self, **counters) -> None:
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+
+# Node run the external calls of the current context are counted for
+STEP = contextvars.ContextVar("essay_step", default=None)
+
+
+# Cumulative Prometheus style histogram with recent samples for percentiles
+class Histogram:
+    def __init__(self, recent: int = 1000) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=recent)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        """Percentile of the recent samples, 0 without samples."""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+# Wall time and usage of the graph nodes and external calls, per thread and overall
+class Metrics:
+    def __init__(self, max_threads: int = 1000) -> None:
+        self.lock = threading.Lock()
+        self.max_threads = max_threads
+        self.node_seconds = defaultdict(Histogram)
+        self.call_seconds = defaultdict(Histogram)
+        self.nodes = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        # per thread totals of every node, least recently updated dropped
+        self.threads = OrderedDict()
+        # caches whose hits and misses are reported, by name
+        self.caches = {}
+
+    def record_node(self, thread_id, node: str, seconds: float, step: Step) -> None:
+        with self.lock:
+            self.node_seconds[node].observe(seconds)
+            totals = self.nodes[node]
+            thread = self.threads.setdefault(str(thread_id), {})
+            self.threads.move_to_end(str(thread_id))
+            if len(self.threads) > self.max_threads:
+                self.threads.popitem(last=False)
+            per_thread = thread.setdefault(
+                node, {"runs": 0, "seconds": 0.0, **dict.fromkeys(COUNTERS, 0)}
+            )
+            per_thread["runs"] += 1
+            per_thread["seconds"] += seconds
+            for key, value in step.counters.items():
+                totals[key] += value
+                per_thread[key] += value
+
+    def record_call(self, api: str, seconds: float) -> None:
+        with self.lock:
+            self.call_seconds[api].observe(seconds)
+
+    def register_cache(self, name: str, cache) -> None:
+        """Report the hits, misses and entries of a cache with a `stats`
+        method, such as SearchCache, LLMCache or NotesCache.
+        """
+        with self.lock:
+            self.caches[name] = cache
+
+    def cache_stats(self) -> Dict[str, dict]:
+        """Hits, misses and size of the registered caches, by name."""
+        with self.lock:
+            caches = dict(self.caches)
+        # read outside the lock, the caches query their databases
+        return {name: cache.stats() for name, cache in sorted(caches.items())}
+
+    def cache_rows(self) -> List[list]:
+        """Rows of the cache metrics, for the GUI table."""
+        return [
+            [
+                name,
+                s["hits"],
+                s["misses"],
+                round(s["hits"] / (s["hits"] + s["misses"]), 3)
+                if s["hits"] + s["misses"]
+                else 0.0,
+                s["size"],
+            ]
+            for name, s in self.cache_stats().items()
+        ]
+
+    def node_rows(self) -> List[list]:
+        """Rows of the aggregated node metrics, for the GUI table."""
+        with self.lock:
+            return [
+                [
+                    node,
+                    hist.count,
+                    round(hist.percentile(50), 2),
+                    round(hist.percentile(95), 2),
+                    round(hist.sum / hist.count, 2),
+                    self.nodes[node]["prompt_tokens"],
+                    self.nodes[node]["completion_tokens"],
+                    self.nodes[node]["searches"],
+                    round(self.nodes[node]["search_bytes"] / 1024, 1),
+                    round(self.nodes[node]["cost"], 4),
+                ]
+                for node, hist in sorted(self.node_seconds.items())
+            ]
+
+    def thread_rows(self, thread_id) -> List[list]:
+        """Rows of the node metrics of one thread, for the GUI table."""
+        with self.lock:
+            nodes = dict(self.threads.get(str(thread_id), {}))
+        return [
+            [
+                node,
+                m["runs"],
+                round(m["seconds"], 2),
+                m["prompt_tokens"],
+                m["completion_tokens"],
+                m["searches"],
+                round(m["search_bytes"] / 1024, 1),
+                round(m["cost"], 4),
+            ]
+            for node, m in sorted(nodes.items())
+        ]
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        caches = self.cache_stats()
+        lines = []
+        with self.lock:
+            for name, label, histograms, help_ in (
+                ("essay_node_seconds", "node", self.node_seconds, "node wall time"),
+                ("essay_call_seconds", "api", self.call_seconds, "external call"),
+            ):
+                lines.append(f"# HELP {name} {help_} in seconds")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, hist.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(
+                            f'{name}_bucket{{{label}="{key}",le="{le}"}} {cumulative}'
+                        )
+                    lines.append(f'{name}_sum{{{label}="{key}"}} {hist.sum}')
+                    lines.append(f'{name}_count{{{label}="{key}"}} {hist.count}')
+            for counter, name in (
+                ("prompt_tokens", "essay_llm_prompt_tokens_total"),
+                ("completion_tokens", "essay_llm_completion_tokens_total"),
+                ("searches", "essay_search_calls_total"),
+                ("search_bytes", "essay_search_result_bytes_total"),
+                ("cost", "essay_cost_usd_total"),
+            ):
+                lines.append(f"# TYPE {name} counter")
+                for node, totals in sorted(self.nodes.items()):
+                    lines.append(f'{name}{{node="{node}"}} {totals[counter]}')
+        for key, name, kind in (
+            ("hits", "essay_cache_hits_total", "counter"),
+            ("misses", "essay_cache_misses_total", "counter"),
+            ("size", "essay_cache_entries", "gauge"),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            for cache, stats in caches.items():
+                lines.append(f'{name}{{cache="{cache}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, *extra: Callable[[], str]) -> None:
+        """Write the metrics to a file for the textfile collector of the node
+        exporter, replaced atomically so it is never read half written.
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+            for source in extra:
+                f.write(source())
+        os.replace(tmp, path)
+
+    def serve(self, port: int, *extra: Callable[[], str]) -> ThreadingHTTPServer:
+        """Serve the metrics on http://0.0.0.0:port/metrics from a daemon thread.
+
+        Args:
+            port (int): port to listen on.
+            *extra: functions returning more metrics in the text format.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = (metrics.prometheus() + "".join(f() for f in extra)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                logger.debug(format, *args)
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(
+            target=server.serve_forever, name="essay-metrics", daemon=True
+        ).start()
+        logger.info("serving metrics on port %s", server.server_port)
+        return server
+
+
+@lru_cache(maxsize=None)
+def default_metrics() -> Metrics:
+    """Metrics shared by the agents of the process."""
+    return Metrics()
+
+
+def record_call(api: str, seconds: float) -> None:
+    """Record the wall time of an external call, "openai" or "search"."""
+    step = STEP.get()
+    (step.metrics if step else default_metrics()).record_call(api, seconds)
+
+
+def count(**counters) -> None:
+    """Add the prompt_tokens, completion_tokens, searches, search_bytes or
+    cost of an external call to the node run that made it.
+    """
+    if (step := STEP.get()) is not None:
+        step.add(**counters)
+
+
+def _thread_id() -> Optional[str]:
+    try:
+        return get_config()["configurable"].get("thread_id")
+    except RuntimeError:
+        return None
+
+
+def instrument(name: str, func, afunc, metrics: Metrics) -> RunnableLambda:
+    """Graph node running `func` or `afunc` that records its wall time and the
+    external calls it makes.
+    """
+
+    def node(state: Dict) -> dict:
+        step = Step(metrics)
+        token = STEP.set(step)
+        started = time.perf_counter()
+        try:
+            return func(state)
+        finally:
+            STEP.reset(token)
+            elapsed = time.perf_counter() - started
+            metrics.record_node(_thread_id(), name, elapsed, step)
+
+    async def anode(state: Dict) -> dict:
+        step = Step(metrics)
+        token = STEP.set(step)
+        started = time.perf_counter()
+        try:
+            return await afunc(state)
+        finally:
+            STEP.reset(token)
+            elapsed = time.perf_counter() - started
+            metrics.record_node(_thread_id(), name, elapsed, step)
+
+    return RunnableLambda(node, anode, name=name)
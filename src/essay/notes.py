@@ -0,0 +1,107 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from essay.cache import SqliteCache
+
+
+def snippet_key(snippet: str) -> str:
+    """Key of a research snippet, its notes are stored under it."""
+    return hashlib.sha256(snippet.encode()).hexdigest()
+
+
+def load_notes(text: Optional[str]) -> Dict[str, Optional[str]]:
+    """Notes of a thread by snippet key, from the state value of `dump_notes`."""
+    return json.loads(text) if text else {}
+
+
+def dump_notes(notes: Dict[str, Optional[str]]) -> str:
+    """Notes of a thread as one string. The checkpoint store keeps a long
+    string in a single content addressed blob, which the checkpoints share
+    until the notes change, where a dict of short notes is stored inline in
+    every checkpoint.
+    """
+    return json.dumps(notes, sort_keys=True)
+
+
+def batches(items: List, size: int) -> List[List]:
+    return [items[i : i + size] for i in range(0, len(items), max(size, 1))]
+
+
+def number_snippets(snippets: List[str]) -> str:
+    """Snippets labelled [1], [2], ... for the prompt condensing them."""
+    return "\n\n".join(f"[{i}]\n{snippet}" for i, snippet in enumerate(snippets, 1))
+
+
+def cited_notes(content: List[str], notes: Dict[str, Optional[str]]) -> List[str]:
+    """Research content for the writer: each snippet replaced by its notes
+    when it has some, tagged with its number in the content so the essay can
+    cite it. Snippets whose notes are empty held nothing worth keeping.
+
+    Args:
+        content (List[str]): research content gathered so far.
+        notes (Dict[str, Optional[str]]): notes by `snippet_key`, snippets without
+            notes, or with None, are kept as they are.
+
+    Returns:
+        List[str]: the tagged notes, in content order.
+    """
+    cited = []
+    for i, snippet in enumerate(content, 1):
+        note = notes.get(snippet_key(snippet))
+        if note is None:
+            note = snippet
+        if note.strip():
+            cited.append(f"[{i}] {note.strip()}")
+    return cited
+
+
+# Notes of research snippets on disk, shared by threads and restarts
+class NotesCache:
+    def __init__(self, path: str, prompt: str, max_entries: int = 50_000) -> None:
+        """Open the cache.
+
+        Args:
+            path (str): path of the sqlite database, it may hold other caches.
+            prompt (str): prompt the notes are written with, notes of another
+                prompt are not reused.
+            max_entries (int): notes kept before the least recently used ones
+                are evicted.
+        """
+        self.cache = SqliteCache(path, "notes", max_entries=max_entries)
+        self.version = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+    def key(self, key: str) -> str:
+        return f"{self.version}:{key}"
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Cached notes of the snippet keys, missing ones left out."""
+        found = {}
+        for key in keys:
+            if (value := self.cache.get(self.key(key))) is not None:
+                found[key] = value.decode()
+        return found
+
+    def set(self, key: str, note: str) -> None:
+        self.cache.set(self.key(key), note.encode())
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def missing_notes(
+    content: List[str], notes: Dict[str, Optional[str]], cache: Optional[NotesCache]
+) -> tuple:
+    """Snippets of the content without notes, after looking them up in the
+    cache.
+
+    Returns:
+        tuple: the notes found in the cache by snippet key and the snippets
+            still to condense, each once.
+    """
+    todo = {}
+    for snippet in content:
+        if (key := snippet_key(snippet)) not in notes:
+            todo.setdefault(key, snippet)
+    cached = cache.get_many(todo) if cache and todo else {}
+    return cached, [snippet for key, snippet in todo.items() if key not in cached]
@@ -16,7 +16,9 @@ Utilize all the information below as needed:
 
 REFLECTION_PROMPT = """You are a teacher grading an essay submission. \
 Generate critique and recommendations for the user's submission. \
-Provide detailed recommendations, including requests for length, depth, style, etc."""  # noqa: E501
+Provide detailed recommendations, including requests for length, depth, style, etc. \
+End with a last line that is either "VERDICT: REVISE" or, when the essay has no major issues left \
+and only minor polishing could be suggested, "VERDICT: NO MAJOR ISSUES"."""  # noqa: E501
 
 
 RESEARCH_PLAN_PROMPT = """You are a researcher charged with providing information that can \
@@ -27,3 +29,43 @@ any relevant information. Only generate 3 queries max."""  # noqa: E501
 RESEARCH_CRITIQUE_PROMPT = """You are a researcher charged with providing information that can \
 be used when making any requested revisions (as outlined below). \
 Generate a list of search queries that will gather any relevant information. Only generate 3 queries max."""  # noqa: E501
+
+
+SECTION_MAP_PROMPT = """You are an editor planning the revision of an essay. \
+The essay is given as numbered sections, followed by a teacher's critique. \
+For each section the critique asks to change, give its number and the critique points it must address. \
+Leave out sections the critique does not concern. Set rewrite when the critique asks for changes \
+to the essay as a whole, such as its structure, thesis or overall length, that cannot be made section by section."""  # noqa: E501
+
+
+SECTION_WRITER_PROMPT = """You are an essay assistant revising one section of an essay. \
+You are given the user's request, the outline, the full current essay and the section to revise \
+with the critique points it must address. Respond with the revised section only, keeping its heading \
+if it has one, so that it fits back into the essay between its neighbours. \
+Utilize the information below as needed: 
+
+------
+
+{content}"""  # noqa: E501
+
+
+CRITIC_PROMPT = """You are a teacher grading an essay submission, reviewing only its {focus}. \
+List the problems you find with that aspect and a recommendation for each, with priority 1 for a \
+major issue, 2 for an important one and 3 for a minor one. Ignore every other aspect of the essay, \
+other reviewers cover them. Also give at most 2 search queries gathering information the \
+revision needs, none if it needs no research."""  # noqa: E501
+
+
+# Aspect each focused critic reviews
+CRITIC_FOCUS = {
+    "structure": "structure: thesis, organisation of the paragraphs, transitions and conclusion",  # noqa: E501
+    "evidence": "evidence: facts, examples, sources and how well they support the claims",  # noqa: E501
+    "style": "style: clarity, tone, grammar, word choice and length",
+}
+
+
+NOTES_PROMPT = """You are a research assistant condensing search results for an essay writer. \
+For each numbered snippet, write compact notes keeping only the facts, figures, names, dates, \
+definitions and claims an essay could use, in at most 3 short sentences and without commentary. \
+Give the number of the snippet with its notes, and empty notes for a snippet with nothing usable \
+such as navigation text or advertising."""  # noqa: E501
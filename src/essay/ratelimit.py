@@ -0,0 +1,447 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional
+
+from essay import metrics
+from essay.context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Priorities of the calls, lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+# Priority of the calls made in the current context, batch runs lower it
+PRIORITY = contextvars.ContextVar("essay_priority", default=INTERACTIVE)
+
+# Status codes worth retrying: timeouts, conflicts, rate limits, server errors
+RETRY_STATUS = {408, 409, 429}
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Run the calls of a block at a priority, e.g. `with priority(BATCH):`."""
+    token = PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        PRIORITY.reset(token)
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an error of the openai, httpx or requests clients."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_throttled(error: BaseException) -> bool:
+    # tavily raises its own error for 429, without the response
+    return status_code(error) == 429 or type(error).__name__ in (
+        "RateLimitError",
+        "UsageLimitExceededError",
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a call that failed with the error may succeed when retried."""
+    if is_throttled(error):
+        return True
+    status = status_code(error)
+    if status is not None:
+        return status in RETRY_STATUS or status >= 500
+    # connection errors and timeouts of the openai, httpx and requests clients
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(
+        error
+    ).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "ConnectError",
+        "ReadTimeout",
+        "ConnectTimeout",
+        "RemoteProtocolError",
+    )
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked to wait before the next request, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: List, completion: int = 1000) -> int:
+    """Tokens a chat call is expected to use, the prompt plus a completion
+    allowance. Corrected with the reported usage once the call returns.
+    """
+    prompt = sum(count_tokens(str(m.content)) + 4 for m in messages)
+    return prompt + completion
+
+
+# Requests or tokens per minute, refilled continuously up to a minute worth
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until the bucket holds the amount, after a refill."""
+        amount = min(amount, self.capacity)  # larger calls would never fit
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+# A call waiting in the queue of a RateLimiter
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "wake")
+
+    def __init__(self, priority: int, seq: int, tokens: int) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.wake = None
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# Limits, priority queue and retries of the calls to one API
+class RateLimiter:
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        """Create a limiter.
+
+        Args:
+            name (str): name of the API, used in logs and metrics.
+            rpm (float, optional): requests per minute, None for no limit.
+            tpm (float, optional): tokens per minute, None for no limit.
+            max_retries (int): retries of a call that failed with a rate
+                limit, server or connection error.
+            base_delay (float): backoff of the first retry in seconds, it
+                doubles with every further retry.
+            max_delay (float): upper bound of the backoff in seconds.
+        """
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.queue = []
+        self.seq = itertools.count()
+        # a rate limit response holds back every call, not only the failed one
+        self.paused_until = 0.0
+        self.metrics = {
+            "calls": 0,
+            "retries": 0,
+            "throttled": 0,
+            "max_queued": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "tokens": 0,
+        }
+
+    def _push(self, tokens: int, wake) -> _Ticket:
+        ticket = _Ticket(PRIORITY.get(), next(self.seq), tokens)
+        ticket.wake = wake
+        with self.lock:
+            heapq.heappush(self.queue, ticket)
+            queued = len(self.queue)
+            self.metrics["max_queued"] = max(self.metrics["max_queued"], queued)
+        return ticket
+
+    def _poll(self, ticket: _Ticket) -> Optional[float]:
+        """Let the ticket go if it heads the queue and the buckets allow it.
+        Called with the lock held.
+
+        Returns:
+            float: None when the ticket may go, otherwise the seconds to wait,
+                infinite when it waits for the tickets ahead of it.
+        """
+        if self.queue[0] is not ticket:
+            return math.inf
+        now = time.monotonic()
+        delay = self.paused_until - now
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delay = max(delay, bucket.delay(amount))
+        if delay > 0:
+            return delay
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is not None:
+                bucket.take(amount)
+        self._leave(ticket)
+        return None
+
+    def _leave(self, ticket: _Ticket) -> None:
+        """Drop the ticket from the queue and wake the next head. Called with
+        the lock held.
+        """
+        if ticket not in self.queue:
+            return
+        head = self.queue[0] is ticket
+        self.queue.remove(ticket)
+        heapq.heapify(self.queue)
+        if head and self.queue:
+            self.queue[0].wake()
+
+    def _granted(self, ticket: _Ticket, started: float) -> float:
+        waited = time.monotonic() - started
+        with self.lock:
+            self.metrics["calls"] += 1
+            self.metrics["tokens"] += ticket.tokens
+            self.metrics["wait_seconds"] += waited
+            self.metrics["max_wait_seconds"] = max(
+                self.metrics["max_wait_seconds"], waited
+            )
+        if waited > 1:
+            logger.debug("%s call waited %.1fs for its turn", self.name, waited)
+        return waited
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until a call of the estimated tokens may go.
+
+        Returns:
+            float: seconds waited.
+        """
+        started = time.monotonic()
+        event = threading.Event()
+        ticket = self._push(tokens, event.set)
+        try:
+            while True:
+                with self.lock:
+                    event.clear()
+                    delay = self._poll(ticket)
+                if delay is None:
+                    return self._granted(ticket, started)
+                event.wait(None if delay == math.inf else delay)
+        finally:
+            with self.lock:
+                self._leave(ticket)
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """Async `acquire`, cancelling the wait gives up the place in the queue."""
+        started = time.monotonic()
+        event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        ticket = self._push(tokens, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while True:
+                with self.lock:
+                    event.clear()
+                    delay = self._poll(ticket)
+                if delay is None:
+                    return self._granted(ticket, started)
+                try:
+                    timeout = None if delay == math.inf else delay
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.lock:
+                self._leave(ticket)
+
+    def settle(self, estimate: int, actual: int) -> None:
+        """Correct the token bucket with the usage a call reported."""
+        with self.lock:
+            self.metrics["tokens"] += actual - estimate
+            if self.tokens is not None:
+                self.tokens.level = min(
+                    self.tokens.capacity, self.tokens.level + estimate - actual
+                )
+
+    def backoff(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Delay before retrying a failed call.
+
+        Args:
+            error (BaseException): error of the call.
+            attempt (int): retries already made, 0 after the first failure.
+
+        Returns:
+            float: seconds to wait, None when the call should not be retried.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        # exponential with equal jitter, so failed calls do not retry together
+        ceiling = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        delay = max(delay, retry_after(error) or 0)
+        with self.lock:
+            self.metrics["retries"] += 1
+            if is_throttled(error):
+                self.metrics["throttled"] += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logger.warning(
+            "%s call failed (%s), retry %s in %.1fs",
+            self.name,
+            error,
+            attempt + 1,
+            delay,
+        )
+        return delay
+
+    def call(self, fn, *args, tokens: int = 0, **kwargs) -> Any:
+        """Call a function when the limits allow it, retrying failures."""
+        for attempt in itertools.count():
+            self.acquire(tokens)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as error:
+                if (delay := self.backoff(error, attempt)) is None:
+                    raise
+                time.sleep(delay)
+            finally:
+                metrics.record_call(self.name, time.perf_counter() - started)
+
+    async def acall(self, fn, *args, tokens: int = 0, **kwargs) -> Any:
+        """Async `call` of a coroutine function."""
+        for attempt in itertools.count():
+            await self.aacquire(tokens)
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as error:
+                if (delay := self.backoff(error, attempt)) is None:
+                    raise
+                await asyncio.sleep(delay)
+            finally:
+                metrics.record_call(self.name, time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.metrics)
+            stats["queued"] = len(self.queue)
+            stats["queued_batch"] = sum(t.priority >= BATCH for t in self.queue)
+        stats["mean_wait_seconds"] = stats["wait_seconds"] / max(stats["calls"], 1)
+        return stats
+
+
+# Process wide set of rate limiters, one per API
+class Scheduler:
+    def __init__(self) -> None:
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def configure(self, name: str, **limits) -> RateLimiter:
+        """Set the limits of an API, see `RateLimiter` for the arguments."""
+        with self.lock:
+            self.limiters[name] = RateLimiter(name, **limits)
+            return self.limiters[name]
+
+    def limiter(self, name: str) -> RateLimiter:
+        """Limiter of an API, one without limits that only retries if the API
+        was not configured.
+        """
+        with self.lock:
+            if name not in self.limiters:
+                self.limiters[name] = RateLimiter(name)
+            return self.limiters[name]
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+    def prometheus(self) -> str:
+        """Queue and retry metrics in the Prometheus text exposition format."""
+        stats = self.stats()
+        lines = []
+        for key, name, kind in (
+            ("queued", "essay_ratelimit_queued", "gauge"),
+            ("calls", "essay_ratelimit_calls_total", "counter"),
+            ("wait_seconds", "essay_ratelimit_wait_seconds_total", "counter"),
+            ("max_wait_seconds", "essay_ratelimit_max_wait_seconds", "gauge"),
+            ("retries", "essay_ratelimit_retries_total", "counter"),
+            ("throttled", "essay_ratelimit_throttled_total", "counter"),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            for api, values in sorted(stats.items()):
+                lines.append(f'{name}{{api="{api}"}} {values[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def _env_limit(name: str, default: float) -> Optional[float]:
+    """Limit of an environment variable, 0 disables the limit."""
+    return float(os.getenv(name, default)) or None
+
+
+@lru_cache(maxsize=None)
+def default_scheduler() -> Scheduler:
+    """Scheduler shared by the agents of the process. The limits default to a
+    gpt-4o tier 1 account and can be set with ESSAY_OPENAI_RPM,
+    ESSAY_OPENAI_TPM and ESSAY_SEARCH_RPM.
+    """
+    scheduler = Scheduler()
+    scheduler.configure(
+        "openai",
+        rpm=_env_limit("ESSAY_OPENAI_RPM", 500),
+        tpm=_env_limit("ESSAY_OPENAI_TPM", 30_000),
+    )
+    scheduler.configure("search", rpm=_env_limit("ESSAY_SEARCH_RPM", 100))
+    return scheduler
+
+
+# Search client whose calls go through a rate limiter
+class ScheduledClient:
+    def __init__(self, client, limiter: RateLimiter, aclient=None) -> None:
+        """Wrap a search client.
+
+        Args:
+            client: sync client such as TavilyClient.
+            limiter (RateLimiter): limiter of the search API.
+            aclient: async client such as AsyncTavilyClient, without one
+                `asearch` runs the sync client in a worker thread.
+        """
+        self.client = client
+        self.aclient = aclient
+        self.limiter = limiter
+
+    def search(self, query: str, **params) -> dict:
+        response = self.limiter.call(self.client.search, query=query, **params)
+        self._account(response)
+        return response
+
+    async def asearch(self, query: str, **params) -> dict:
+        if self.aclient is None:
+            return await asyncio.to_thread(self.search, query, **params)
+        response = await self.limiter.acall(self.aclient.search, query=query, **params)
+        self._account(response)
+        return response
+
+    @staticmethod
+    def _account(response: dict) -> None:
+        metrics.count(
+            searches=1,
+            search_bytes=len(json.dumps(response).encode()),
+            cost=metrics.SEARCH_PRICE,
+        )
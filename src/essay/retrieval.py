@@ -0,0 +1,244 @@
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Protocol, Sequence
+
+from essay import metrics
+
+logger = logging.getLogger(__name__)
+
+# Files indexed by default, read as plain text
+PATTERNS = ("*.txt", "*.md", "*.rst", "*.html", "*.htm")
+# The passages of a document have the rowids (document id << BITS) + chunk, so
+# they are replaced with a rowid range instead of a scan of the index
+BITS = 20
+
+
+# What the research nodes need from a search backend. ScheduledClient gives a
+# sync client such as TavilyClient the async method.
+class SearchBackend(Protocol):
+    def search(self, query: str, max_results: int = 5, **params) -> dict:
+        """Search results as `{"query": ..., "results": [{"title", "url",
+        "content", "score"}, ...]}`, best first. Unknown params are ignored.
+        """
+        ...
+
+    async def asearch(self, query: str, max_results: int = 5, **params) -> dict:
+        """Async `search`."""
+        ...
+
+
+def chunks(text: str, words: int = 200) -> List[str]:
+    """Split a document into passages of about `words` words, along its
+    paragraphs when they are short enough.
+    """
+    passages, current = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        tokens = paragraph.split()
+        while len(tokens) > words:  # a paragraph too long for one passage
+            passages.append(" ".join(tokens[:words]))
+            tokens = tokens[words:]
+        if current and len(current) + len(tokens) > words:
+            passages.append(" ".join(current))
+            current = []
+        current += tokens
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def match_query(query: str) -> str:
+    """FTS5 query matching any word of a free text query, quoted so that
+    operators and punctuation in it are taken literally.
+    """
+    return " OR ".join(f'"{w}"' for w in re.findall(r"\w+", query.lower()))
+
+
+# On-disk BM25 index of a directory of documents, in sqlite FTS5. A Chroma
+# collection through langchain-chroma would fit behind SearchBackend as well,
+# but it needs an embedding model, and the default one of chromadb is
+# downloaded on first use, which an offline index cannot rely on
+class LocalIndex:
+    def __init__(
+        self,
+        path: str = "search_index.sqlite",
+        chunk_words: int = 200,
+        mmap_size: int = 256 * 1024 * 1024,
+    ) -> None:
+        """Open the index, creating it if needed.
+
+        Args:
+            path (str): path of the sqlite database.
+            chunk_words (int): words per indexed passage, the unit returned.
+            mmap_size (int): bytes of the database memory-mapped, so repeated
+                queries read the index from the page cache without copies.
+        """
+        self.path = path
+        self.chunk_words = chunk_words
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.executescript(
+                f"""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA mmap_size={int(mmap_size)};
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL UNIQUE,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    indexed_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+                    title, content, tokenize = 'porter unicode61'
+                );
+                """
+            )
+
+    def index_directory(self, root: str, patterns: Sequence[str] = PATTERNS) -> dict:
+        """Bring the index up to date with the documents under a directory.
+        Only new and modified files are read, and files that are gone are
+        dropped, so indexing again after a few edits is cheap.
+
+        Args:
+            root (str): directory searched recursively.
+            patterns (Sequence[str]): glob patterns of the file names to index.
+
+        Returns:
+            dict: number of files added, updated, removed and unchanged.
+        """
+        started = time.perf_counter()
+        files = {}
+        for folder, _, names in os.walk(root):
+            for name in names:
+                if any(fnmatch.fnmatch(name.lower(), p) for p in patterns):
+                    path = os.path.abspath(os.path.join(folder, name))
+                    stat = os.stat(path)
+                    files[path] = (stat.st_mtime, stat.st_size)
+        prefix = os.path.join(os.path.abspath(root), "")
+        with self.lock:
+            known = {
+                path: (mtime, size)
+                for path, mtime, size in self.conn.execute(
+                    "SELECT path, mtime, size FROM documents "
+                    "WHERE path LIKE ? ESCAPE '\\'",
+                    (re.sub(r"([%_\\])", r"\\\1", prefix) + "%",),
+                )
+            }
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        for path in known.keys() - files.keys():
+            self.remove(path)
+            counts["removed"] += 1
+        for path, (mtime, size) in sorted(files.items()):
+            if known.get(path) == (mtime, size):
+                counts["unchanged"] += 1
+                continue
+            try:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            except OSError as error:
+                logger.warning("cannot index %s: %s", path, error)
+                continue
+            self.add(path, text, mtime, size)
+            counts["updated" if path in known else "added"] += 1
+        logger.info(
+            "indexed %s in %.2fs: %s", root, time.perf_counter() - started, counts
+        )
+        return counts
+
+    def add(self, path: str, text: str, mtime: float = 0.0, size: int = 0) -> None:
+        """Index a document, replacing its earlier passages."""
+        if path.lower().endswith((".html", ".htm")):
+            text = re.sub(r"<[^>]+>", " ", text)
+        title = os.path.splitext(os.path.basename(path))[0]
+        passages = chunks(text, self.chunk_words)[: (1 << BITS) - 1]
+        with self.lock, self.conn:
+            (doc_id,) = self.conn.execute(
+                "INSERT INTO documents (path, mtime, size, indexed_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                "mtime = excluded.mtime, size = excluded.size, "
+                "indexed_at = excluded.indexed_at RETURNING id",
+                (path, mtime, size, time.time()),
+            ).fetchone()
+            self._delete_passages(doc_id)
+            self.conn.executemany(
+                "INSERT INTO passages (rowid, title, content) VALUES (?, ?, ?)",
+                [
+                    ((doc_id << BITS) + i, title, passage)
+                    for i, passage in enumerate(passages)
+                ],
+            )
+
+    def remove(self, path: str) -> None:
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "DELETE FROM documents WHERE path = ? RETURNING id", (path,)
+            ).fetchone()
+            if row is not None:
+                self._delete_passages(row[0])
+
+    def _delete_passages(self, doc_id: int) -> None:
+        self.conn.execute(
+            "DELETE FROM passages WHERE rowid >= ? AND rowid < ?",
+            (doc_id << BITS, (doc_id + 1) << BITS),
+        )
+
+    def search(self, query: str, max_results: int = 5, **params) -> dict:
+        """Passages best matching the query by BM25, in the response format of
+        TavilyClient.search. Params such as `timeout` are ignored.
+        """
+        started = time.perf_counter()
+        results = []
+        if match := match_query(query):
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT title, content, path, passages.rowid, rank FROM passages "
+                    f"JOIN documents ON documents.id = passages.rowid >> {BITS} "
+                    "WHERE passages MATCH ? ORDER BY rank LIMIT ?",
+                    (match, max_results),
+                ).fetchall()
+            results = [
+                {
+                    "title": title,
+                    "url": f"file://{path}#{rowid & ((1 << BITS) - 1)}",
+                    "content": content,
+                    # the bm25 rank is lower for better matches
+                    "score": round(-rank, 4),
+                }
+                for title, content, path, rowid, rank in rows
+            ]
+        response = {"query": query, "results": results}
+        metrics.record_call("search", time.perf_counter() - started)
+        # local searches are free, only their volume is counted
+        metrics.count(searches=1, search_bytes=len(json.dumps(response).encode()))
+        return response
+
+    async def asearch(self, query: str, max_results: int = 5, **params) -> dict:
+        """Async `search`, run in a worker thread."""
+        return await asyncio.to_thread(self.search, query, max_results, **params)
+
+    def stats(self) -> dict:
+        """Number of documents and passages in the index."""
+        with self.lock:
+            (documents,) = self.conn.execute(
+                "SELECT COUNT(*) FROM documents"
+            ).fetchone()
+            (passages,) = self.conn.execute("SELECT COUNT(*) FROM passages").fetchone()
+        return {"documents": documents, "passages": passages}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def index_from_env() -> Optional[LocalIndex]:
+    """Local index of ESSAY_SEARCH_INDEX, None when it is not set."""
+    path = os.getenv("ESSAY_SEARCH_INDEX")
+    return LocalIndex(path) if path else None
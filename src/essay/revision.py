@@ -0,0 +1,43 @@
+import re
+from typing import Dict, List
+
+# A markdown heading, or a bold line standing alone as one
+_HEADING = re.compile(r"^(#{1,6}\s+\S|\*\*[^*\n]+\*\*\s*$)")
+
+
+def split_sections(draft: str) -> List[str]:
+    """Split a draft into sections. A section starts at each heading and holds
+    the paragraphs up to the next one; a draft without headings is split into
+    its paragraphs.
+
+    Args:
+        draft (str): essay draft in plain text or markdown.
+
+    Returns:
+        List[str]: the sections in order, `join_sections` puts them back.
+    """
+    blocks = [b.strip() for b in re.split(r"\n\s*\n", draft.strip()) if b.strip()]
+    if not any(_HEADING.match(block) for block in blocks):
+        return blocks
+    sections: List[str] = []
+    for block in blocks:
+        # text before the first heading is a section of its own
+        if _HEADING.match(block) or not sections:
+            sections.append(block)
+        else:
+            sections[-1] += f"\n\n{block}"
+    return sections
+
+
+def join_sections(sections: List[str]) -> str:
+    return "\n\n".join(section.strip() for section in sections)
+
+
+def number_sections(sections: List[str]) -> str:
+    """Sections labelled [1], [2], ... for the prompt mapping critique to them."""
+    return "\n\n".join(f"[{i}]\n{section}" for i, section in enumerate(sections, 1))
+
+
+def splice(sections: List[str], revised: Dict[int, str]) -> List[str]:
+    """Sections with those of `revised`, indexed from 0, replaced."""
+    return [revised.get(i, section) for i, section in enumerate(sections)]
@@ -0,0 +1,61 @@
+import pytest
+
+from essay.agent import Agent
+from essay.checkpoint import CheckpointStore
+from essay.fakes import FakeOpenAI, FakeSearch
+from essay.metrics import Metrics
+from essay.ratelimit import Scheduler
+
+
+@pytest.fixture
+def fake_openai():
+    """Chat API answering at once with short repeatable replies."""
+    return FakeOpenAI(latency=0, words=120)
+
+
+@pytest.fixture
+def fake_search():
+    """Search client answering at once with repeatable results."""
+    return FakeSearch(latency=0, words=40)
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"), compact_interval=None)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def make_agent(fake_openai, fake_search, checkpoints):
+    """Factory of agents on the fakes, without rate limits or disk caches.
+    Keyword arguments override those of `Agent`.
+    """
+
+    def make(**options) -> Agent:
+        defaults = {
+            "checkpointer": checkpoints,
+            "scheduler": Scheduler(),
+            "metrics": Metrics(),
+            "model_options": fake_openai.options(),
+            "search_client": fake_search,
+            "search_cache": None,
+            "notes_cache": None,
+        }
+        return Agent(**{**defaults, **options})
+
+    return make
+
+
+@pytest.fixture
+def run_thread():
+    """Run a thread of a graph to its end, resuming after each interrupt."""
+
+    def run(graph, thread_id: str, state: dict) -> dict:
+        thread = {"configurable": {"thread_id": thread_id}}
+        graph.invoke(state, thread)
+        while graph.get_state(thread).next:
+            graph.invoke(None, thread)
+        return graph.get_state(thread).values
+
+    return run
@@ -0,0 +1,131 @@
+from essay.agent import SectionEdit, SectionEdits
+from essay.batch import initial_state
+from essay.fakes import FakeSearch
+
+DRAFT = "# One\n\nfirst\n\n# Two\n\nsecond\n\n# Three\n\nthird"
+
+
+def test_missing_search_key_reports_unavailable(make_agent, monkeypatch):
+    monkeypatch.delenv("TAVILY_API_KEY", raising=False)
+    agent = make_agent(search_client=None)
+    content, update = agent.research({}, ["history of Rome"])
+    assert content == []
+    assert update["search_unavailable"] is True
+    # a later round that can search clears it
+    agent = make_agent(search_client=FakeSearch(latency=0))
+    _, update = agent.research({"search_unavailable": True}, ["history of Rome"])
+    assert update["search_unavailable"] is False
+
+
+def test_essay_is_written_without_a_search_key(make_agent, run_thread, monkeypatch):
+    monkeypatch.delenv("TAVILY_API_KEY", raising=False)
+    agent = make_agent(search_client=None)
+    values = run_thread(agent.graph, "1", initial_state("solar power", 1))
+    assert values["draft"] != "no draft"
+    assert values["content"] == []
+    assert values["search_unavailable"] is True
+
+
+def test_section_edits(make_agent):
+    agent = make_agent()
+    sections = ["a", "b", "c"]
+
+    def plan(*edits, rewrite=False):
+        edits = [SectionEdit(section=s, instructions=i) for s, i in edits]
+        return SectionEdits(rewrite=rewrite, edits=edits)
+
+    assert agent.section_edits(sections, plan(rewrite=True)) is None
+    # no section to revise keeps the draft, it is not a rewrite
+    assert agent.section_edits(sections, plan()) == []
+    assert agent.section_edits(sections, plan((9, "made up"))) == []
+    assert agent.section_edits(sections, plan((3, "x"), (1, "y"), (3, "z"))) == [
+        (0, "y"),
+        (2, "x\nz"),
+    ]
+    # every section is a rewrite
+    assert agent.section_edits(sections, plan((1, ""), (2, ""), (3, ""))) is None
+
+
+def test_no_section_edits_keep_the_draft(make_agent):
+    agent = make_agent()
+    state = {"revisions": 1, "max_revisions": 3, "draft": DRAFT}
+    update = agent.revise_sections(state, DRAFT.split("\n\n"), [], [], [])
+    assert update["draft"] == DRAFT
+    assert update["revised_sections"] == []
+    assert update["stop_reason"] == "converged"
+
+
+def test_essay_runs_to_the_end(make_agent, run_thread):
+    agent = make_agent()
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    assert values["draft"] != "no draft"
+    assert values["stop_reason"] in ("max_revisions", "converged")
+    assert values["content"]
+    assert values["searched"]
+
+
+def test_essay_runs_to_the_end_with_critics(make_agent, run_thread):
+    agent = make_agent(critics=["structure", "evidence"])
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    assert values["stop_reason"]
+    # the critiques of both critics are merged, their notes dropped
+    assert "[structure," in values["critique"]
+    assert "[evidence," in values["critique"]
+    assert not values["critic_notes"]
+
+
+def test_draft_converges(make_agent):
+    agent = make_agent(min_draft_change=0.05)
+    state = {"revisions": 1, "max_revisions": 5, "draft": DRAFT}
+    assert agent.new_draft(state, DRAFT, {})["stop_reason"] == "converged"
+    update = agent.new_draft(state, "a different essay altogether", {})
+    assert update["stop_reason"] == ""
+    assert update["draft_change"] > 0.05
+    # the first draft has nothing to converge to
+    first = agent.new_draft({**state, "revisions": 0}, DRAFT, {})
+    assert first["draft_change"] is None
+    assert first["stop_reason"] == ""
+
+
+def test_max_revisions_stops_before_convergence(make_agent):
+    agent = make_agent()
+    state = {"revisions": 2, "max_revisions": 2, "draft": DRAFT}
+    assert agent.new_draft(state, DRAFT, {})["stop_reason"] == "max_revisions"
+
+
+def test_converged_thread_stops_early(make_agent, run_thread):
+    # any revision short of a rewrite counts as converged
+    agent = make_agent(min_draft_change=1.0)
+    values = run_thread(agent.graph, "1", initial_state("solar power", 5))
+    assert values["stop_reason"] == "converged"
+    assert values["revisions"] == 2
+
+
+def test_query_memo_skips_reworded_queries(make_agent, fake_search):
+    agent = make_agent(query_memo_threshold=0.75)
+    state = {"searched": ["impact of tariffs on trade"]}
+    queries = ["tariff impacts on trade", "history of Rome", "Rome history"]
+    content, update = agent.research(state, queries)
+    assert update["searched"] == ["impact of tariffs on trade", "history of Rome"]
+    assert update["searches_skipped"] == 2
+    assert fake_search.requests == 1
+    assert len(content) == 2
+
+
+def test_query_memo_disabled(make_agent):
+    agent = make_agent(query_memo_threshold=None)
+    queries = ["history of Rome", "Rome history"]
+    assert agent.new_queries({}, queries) == (queries, [])
+
+
+def test_critics_add_their_queries_to_the_searched_list(make_agent, run_thread):
+    agent = make_agent(critics=["structure", "evidence"])
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    thread = {"configurable": {"thread_id": "1"}}
+    [planned] = [
+        s.values["searched"]
+        for s in agent.graph.get_state_history(thread)
+        if s.values.get("lnode") == "research_plan"
+    ]
+    assert values["searched"][: len(planned)] == planned
+    assert len(values["searched"]) > len(planned)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from essay.batch import initial_state
+from essay.fakes import AsyncFakeSearch
+
+
+async def arun_thread(graph, thread_id: str, state: dict) -> dict:
+    thread = {"configurable": {"thread_id": thread_id}}
+    await graph.ainvoke(state, thread)
+    while (await graph.aget_state(thread)).next:
+        await graph.ainvoke(None, thread)
+    return (await graph.aget_state(thread)).values
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"critics": ["structure", "evidence", "style"]},
+        {"compress_research": True},
+        {"section_revision": False},
+    ],
+    ids=["reflect", "critics", "compress", "full_revisions"],
+)
+def test_async_nodes_match_sync_nodes(make_agent, run_thread, options):
+    agent = make_agent(asearch_client=AsyncFakeSearch(latency=0, words=40), **options)
+    state = initial_state("solar power", 2)
+    sync = run_thread(agent.graph, "sync", state)
+    asynchronous = asyncio.run(arun_thread(agent.graph, "async", state))
+    assert asynchronous == sync
+
+
+def test_async_runs_share_the_event_loop(make_agent, fake_openai):
+    fake_openai.latency = 0.2
+    agent = make_agent(model_options=fake_openai.options())
+
+    async def run_all():
+        return await asyncio.gather(
+            *(
+                arun_thread(agent.graph, str(i), initial_state(f"topic {i}", 1))
+                for i in range(8)
+            )
+        )
+
+    loop = asyncio.new_event_loop()
+    started = loop.time()
+    results = loop.run_until_complete(run_all())
+    elapsed = loop.time() - started
+    loop.close()
+    assert len({r["task"] for r in results}) == 8
+    # the model calls of the threads overlap on the loop
+    assert elapsed < fake_openai.requests * fake_openai.latency / 4
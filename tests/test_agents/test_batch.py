@@ -0,0 +1,57 @@
+import json
+
+from essay.batch import finished_ids, initial_state, read_items, run_batch, run_item
+
+
+def write_lines(path, lines) -> str:
+    path.write_text("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+
+def test_read_items_numbers_lines_without_id(tmp_path):
+    path = write_lines(
+        tmp_path / "topics.jsonl",
+        ['{"topic": "solar"}', "", '{"id": "wind", "topic": "wind"}'],
+    )
+    assert read_items(path) == [
+        {"topic": "solar", "id": "1"},
+        {"id": "wind", "topic": "wind"},
+    ]
+
+
+def test_finished_ids_skip_a_line_cut_short(tmp_path):
+    path = write_lines(tmp_path / "out.jsonl", ['{"id": 1, "essay": "x"}', '{"id": "2'])
+    assert finished_ids(path) == {"1"}
+    assert finished_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_batch_writes_every_item_once(make_agent, tmp_path):
+    agent = make_agent()
+    items = [
+        {"id": str(i), "topic": f"topic {i}", "max_revisions": 1} for i in range(3)
+    ]
+    output = str(tmp_path / "essays.jsonl")
+    results = list(run_batch(agent.graph, items, output, concurrency=3))
+    assert sorted(r["id"] for r in results) == ["0", "1", "2"]
+    assert all(r["essay"] and r["stop_reason"] for r in results)
+    # a second run finds them all in the output
+    assert list(run_batch(agent.graph, items, output)) == []
+    with open(output) as f:
+        assert len([json.loads(line) for line in f]) == 3
+
+
+def test_item_resumes_its_thread(make_agent, tmp_path):
+    agent = make_agent()
+    thread = {"configurable": {"thread_id": "batch-1"}}
+    # a run that stopped after the first node
+    agent.graph.invoke(initial_state("solar power", 1), thread)
+    steps = agent.graph.get_state(thread).values["count"]
+    result = run_item(agent.graph, {"id": "1", "topic": "solar power"})
+    assert result["resumed"]
+    assert "planner" not in result["node_seconds"]
+    assert result["steps"] > steps
+    assert result["stop_reason"]
+    # a finished thread is returned as it is
+    again = run_item(agent.graph, {"id": "1", "topic": "solar power"})
+    assert again["resumed"] and again["node_seconds"] == {}
+    assert again["essay"] == result["essay"]
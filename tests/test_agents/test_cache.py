@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+
+from essay.cache import LLMCache, SearchCache, SqliteCache, normalize_query
+from essay.fakes import FakeSearch
+from essay.metrics import Metrics
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite"), ttl=0.05)
+    cache.set("a", b"1")
+    assert cache.get("a") == b"1"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        cache.set(key, key.encode())
+        time.sleep(0.01)
+    assert cache.get("a") == b"a"
+    time.sleep(0.01)
+    cache.set("c", b"c")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a"
+    assert cache.get("c") == b"c"
+    assert cache.stats()["size"] == 2
+
+
+def test_caches_share_a_database(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    search, llm = SqliteCache(path, "search"), SqliteCache(path, "llm")
+    search.set("a", b"search")
+    llm.set("a", b"llm")
+    assert search.get("a") == b"search"
+    assert SqliteCache(path, "llm").get("a") == b"llm"
+
+
+def test_normalized_queries_share_a_key():
+    assert normalize_query("  Impact of  Tariffs?") == "impact of tariffs"
+    assert SearchCache.key("Impact of tariffs?", max_results=2) == SearchCache.key(
+        "impact of  TARIFFS", max_results=2
+    )
+    assert SearchCache.key("tariffs", max_results=2) != SearchCache.key(
+        "tariffs", max_results=5
+    )
+
+
+def test_search_cache_answers_repeated_queries(tmp_path):
+    client = FakeSearch(latency=0)
+    cache = SearchCache(client, str(tmp_path / "cache.sqlite"))
+    first = cache.search("history of Rome", max_results=2, timeout=5)
+    # the timeout is not part of the key
+    assert cache.search("History of Rome?", max_results=2, timeout=20) == first
+    assert client.requests == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+# Search client with both methods, as ScheduledClient
+class BothSearch(FakeSearch):
+    async def asearch(self, query: str, max_results: int = 5, **params) -> dict:
+        return self.results(query, max_results)
+
+
+def test_search_cache_async(tmp_path):
+    client = BothSearch(latency=0)
+    cache = SearchCache(client, str(tmp_path / "cache.sqlite"))
+    first = asyncio.run(cache.asearch("history of Rome", max_results=2))
+    assert asyncio.run(cache.asearch("history of rome", max_results=2)) == first
+    assert cache.search("history of Rome", max_results=2) == first
+    assert client.requests == 1
+    # a sync only client runs in a thread
+    cache = SearchCache(FakeSearch(latency=0), str(tmp_path / "other.sqlite"))
+    assert asyncio.run(cache.asearch("history of Rome", max_results=2)) == first
+
+
+def test_cache_hits_are_reported(make_agent, tmp_path):
+    metrics = Metrics()
+    agent = make_agent(metrics=metrics, search_cache=str(tmp_path / "cache.sqlite"))
+    agent.search(["history of Rome"])
+    agent.search(["history of Rome", "economy of Japan"])
+    assert metrics.cache_stats() == {"search": {"hits": 1, "misses": 2, "size": 2}}
+    assert metrics.cache_rows() == [["search", 1, 2, 0.333, 2]]
+    text = metrics.prometheus()
+    assert 'essay_cache_hits_total{cache="search"} 1' in text
+    assert 'essay_cache_misses_total{cache="search"} 2' in text
+    assert 'essay_cache_entries{cache="search"} 2' in text
+
+
+def test_llm_cache_round_trip(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite"))
+    generation = ChatGeneration(
+        message=AIMessage(content="an essay"), generation_info={"finish": "stop"}
+    )
+    assert cache.lookup("prompt", "gpt-4o") is None
+    cache.update("prompt", "gpt-4o", [generation])
+    (found,) = cache.lookup("prompt", "gpt-4o")
+    assert found.message.content == "an essay"
+    assert found.generation_info == {"finish": "stop"}
+    # another model or parameters is another key
+    assert cache.lookup("prompt", "gpt-4o-mini") is None
+    cache.clear()
+    assert cache.lookup("prompt", "gpt-4o") is None
+
+
+def test_model_answers_repeated_prompts_from_cache(make_agent, fake_openai, tmp_path):
+    agent = make_agent(llm_cache=str(tmp_path / "cache.sqlite"))
+    first = agent.model.invoke([HumanMessage(content="write about Rome")])
+    again = agent.model.invoke([HumanMessage(content="write about Rome")])
+    assert again.content == first.content
+    assert fake_openai.requests == 1
+    agent.model.invoke([HumanMessage(content="write about Japan")])
+    assert fake_openai.requests == 2
+    assert agent.metrics.cache_stats()["llm"]["hits"] == 1
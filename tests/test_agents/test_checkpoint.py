@@ -0,0 +1,171 @@
+import hashlib
+
+from essay import checkpoint
+from essay.batch import initial_state
+from essay.checkpoint import CheckpointStore
+
+
+def graph_history(graph, thread_id: str) -> list:
+    thread = {"configurable": {"thread_id": thread_id}}
+    return [
+        (s.config["configurable"]["checkpoint_id"], s.metadata["step"], s.next)
+        for s in graph.get_state_history(thread)
+    ]
+
+
+def index_history(store: CheckpointStore, thread_id: str) -> list:
+    return [
+        (c["checkpoint_id"], c["step"], c["next"])
+        for c in store.history(thread_id, min_step=-1)
+    ]
+
+
+def test_prune_keeps_last_checkpoints(make_agent, run_thread, tmp_path):
+    store = CheckpointStore(
+        str(tmp_path / "pruned.sqlite"), keep_last=3, compact_interval=None
+    )
+    agent = make_agent(checkpointer=store)
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    run_thread(agent.graph, "2", initial_state("wind power", 1))
+    kept = graph_history(agent.graph, "1")[:3]
+    assert store.prune() > 0
+    assert graph_history(agent.graph, "1") == kept
+    assert len(graph_history(agent.graph, "2")) == 3
+    thread = {"configurable": {"thread_id": "1"}}
+    assert agent.graph.get_state(thread).values == values
+    assert store.prune() == 0
+    store.close()
+
+
+def test_expire_deletes_idle_threads(make_agent, run_thread, tmp_path):
+    store = CheckpointStore(
+        str(tmp_path / "expired.sqlite"), thread_ttl=0, compact_interval=None
+    )
+    agent = make_agent(checkpointer=store)
+    run_thread(agent.graph, "1", initial_state("solar power", 1))
+    assert store.expire() == ["1"]
+    assert store.threads() == []
+    assert graph_history(agent.graph, "1") == []
+    store.close()
+
+
+def test_compact_applies_retention(make_agent, run_thread, tmp_path):
+    store = CheckpointStore(
+        str(tmp_path / "compact.sqlite"), keep_last=2, compact_interval=None
+    )
+    agent = make_agent(checkpointer=store)
+    run_thread(agent.graph, "1", initial_state("solar power", 1))
+    store.compact()
+    assert len(graph_history(agent.graph, "1")) == 2
+    store.close()
+
+
+def test_store_uses_wal(checkpoints):
+    checkpoints.setup()
+    (mode,) = checkpoints.conn.execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+def test_large_strings_are_stored_once(checkpoints):
+    checkpoints.setup()
+    serde = checkpoints.serde
+    draft = "word " * 200
+    state = {"draft": draft, "content": [draft, "short"], "count": 3}
+    data = serde.dumps_typed(state)
+    assert draft.encode() not in data[1]
+    assert serde.loads_typed(data) == state
+    (blobs,) = checkpoints.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()
+    assert blobs == 1
+    # a fresh serializer reads the blob from the table
+    serde.cache.clear()
+    assert serde.loads_typed(data) == state
+
+
+def test_stored_blobs_are_not_written_again(checkpoints, monkeypatch):
+    checkpoints.setup()
+    serde = checkpoints.serde
+    compressed = []
+    compress = checkpoint.zlib.compress
+    monkeypatch.setattr(
+        checkpoint.zlib,
+        "compress",
+        lambda data: compressed.append(data) or compress(data),
+    )
+    serde.dumps_typed({"draft": "first " * 100})
+    (created,) = checkpoints.conn.execute("SELECT created_at FROM blobs").fetchone()
+    serde.dumps_typed({"draft": "first " * 100, "critique": "second " * 100})
+    assert len(compressed) == 2
+    # touched again only once it is older than the touch interval
+    (touched,) = checkpoints.conn.execute(
+        "SELECT created_at FROM blobs WHERE hash = ?",
+        (hashlib.sha256(("first " * 100).encode()).hexdigest(),),
+    ).fetchone()
+    assert touched == created
+    checkpoints.conn.execute("UPDATE blobs SET created_at = 0")
+    checkpoints.conn.commit()
+    serde.dumps_typed({"draft": "first " * 100})
+    assert len(compressed) == 2
+    rows = checkpoints.conn.execute("SELECT created_at FROM blobs").fetchall()
+    assert min(rows)[0] == 0 and max(rows)[0] > 0
+
+
+def test_sweep_deletes_unreferenced_blobs(make_agent, run_thread, tmp_path):
+    store = CheckpointStore(
+        str(tmp_path / "blobs.sqlite"), keep_last=1, compact_interval=None
+    )
+    agent = make_agent(checkpointer=store)
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    store.prune()
+    # a blob whose checkpoint was pruned, old enough for the sweep
+    store.serde.put({"orphan": "gone " * 100})
+    store.conn.execute("UPDATE blobs SET created_at = 0")
+    store.conn.commit()
+    assert store.sweep_blobs() == 1
+    store.serde.cache.clear()
+    thread = {"configurable": {"thread_id": "1"}}
+    assert agent.graph.get_state(thread).values == values
+    assert store.sweep_blobs() == 0
+    store.close()
+
+
+def test_index_matches_state_history(make_agent, checkpoints, run_thread):
+    agent = make_agent()
+    values = run_thread(agent.graph, "1", initial_state("solar power", 2))
+    assert index_history(checkpoints, "1") == graph_history(agent.graph, "1")
+    latest = checkpoints.history("1")[0]
+    assert latest["count"] == values["count"]
+    assert latest["revisions"] == values["revisions"]
+    assert checkpoints.lookup(latest["checkpoint_id"]) == latest
+
+
+def test_index_matches_state_history_with_critics(make_agent, checkpoints, run_thread):
+    # the critics are pending Send tasks, not branch channels
+    agent = make_agent(critics=["structure", "evidence"])
+    run_thread(agent.graph, "1", initial_state("solar power", 2))
+    history = index_history(checkpoints, "1")
+    assert ("critic", "critic") in [next_ for _, _, next_ in history]
+    assert history == graph_history(agent.graph, "1")
+
+
+def test_index_of_existing_checkpoints(make_agent, checkpoints, run_thread, tmp_path):
+    run_thread(make_agent().graph, "1", initial_state("solar power", 1))
+    checkpoints.conn.execute("DELETE FROM checkpoint_index")
+    checkpoints.conn.commit()
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"), compact_interval=None)
+    store.setup()
+    assert index_history(store, "1") == graph_history(make_agent().graph, "1")
+    assert len(index_history(store, "1")) > 1
+    store.close()
+
+
+def test_prune_and_delete_update_the_index(make_agent, run_thread, tmp_path):
+    store = CheckpointStore(
+        str(tmp_path / "index.sqlite"), keep_last=2, compact_interval=None
+    )
+    agent = make_agent(checkpointer=store)
+    run_thread(agent.graph, "1", initial_state("solar power", 1))
+    store.prune()
+    assert index_history(store, "1") == graph_history(agent.graph, "1")
+    store.delete_thread("1")
+    assert index_history(store, "1") == []
+    store.close()
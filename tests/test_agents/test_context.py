@@ -0,0 +1,38 @@
+from essay.context import build_context, count_tokens
+
+SNIPPETS = [
+    "Bananas are rich in potassium and grow in tropical climates.",
+    "The steam engine drove the industrial revolution in Britain.",
+    "Railways spread the steam engine across Europe within decades.",
+    "Tea was first cultivated in China thousands of years ago.",
+]
+
+
+def test_most_relevant_snippets_first():
+    context, stats = build_context(SNIPPETS, "steam engine railways", budget=10_000)
+    assert context.split("\n\n")[:2] == [SNIPPETS[2], SNIPPETS[1]]
+    assert stats["packed_snippets"] == stats["snippets"] == 4
+    assert stats["packed_tokens"] == stats["tokens"]
+
+
+def test_context_fits_budget():
+    budget = count_tokens(SNIPPETS[1]) + count_tokens(SNIPPETS[2])
+    context, stats = build_context(SNIPPETS, "steam engine", budget=budget)
+    assert count_tokens(context) <= budget
+    assert stats["packed_tokens"] <= budget
+    assert SNIPPETS[1] in context
+    assert stats["packed_snippets"] < stats["snippets"]
+
+
+def test_snippet_over_budget_is_skipped_not_cut():
+    long = "steam " * 500
+    context, stats = build_context([long, SNIPPETS[1]], "steam", budget=50)
+    assert context == SNIPPETS[1]
+    assert stats["packed_snippets"] == 1
+
+
+def test_empty_research():
+    assert build_context([], "anything", budget=100) == (
+        "",
+        {"snippets": 0, "packed_snippets": 0, "tokens": 0, "packed_tokens": 0},
+    )
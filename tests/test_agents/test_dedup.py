@@ -0,0 +1,95 @@
+from essay.dedup import IndexCache, NearDuplicateIndex, jaccard, query_similarity
+
+TEXT = (
+    "Solar panels convert sunlight into electricity and their price fell by "
+    "ninety percent over the last decade, which made rooftop installations "
+    "common in many countries across Europe and Asia."
+)
+
+
+def test_index_keeps_first_copy_only():
+    index = NearDuplicateIndex(threshold=0.8)
+    assert index.add(TEXT)
+    assert not index.add(TEXT)
+    assert not index.add(TEXT.replace("Asia.", "Asia"))
+
+
+def test_index_keeps_distinct_texts():
+    index = NearDuplicateIndex(threshold=0.8)
+    other = (
+        "Wind turbines are built offshore where the wind is steadier, and "
+        "their output is stored in batteries for the evening peak."
+    )
+    assert index.add(TEXT)
+    assert index.add(other)
+    assert len(index.signatures) == 2
+
+
+def test_index_skips_empty_text_unless_forced():
+    index = NearDuplicateIndex()
+    assert not index.add("")
+    assert index.add(TEXT)
+    assert index.add(TEXT, force=True)
+
+
+def test_jaccard():
+    assert jaccard(TEXT, TEXT) == 1.0
+    assert jaccard("", "") == 1.0
+    assert jaccard(TEXT, "nothing in common here at all") == 0.0
+
+
+OTHER = (
+    "Wind turbines are built offshore where the wind is steadier, and their "
+    "output is stored in batteries for the evening peak."
+)
+
+
+def spy(func, calls: list):
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def test_query_similarity_matches_rewordings():
+    assert query_similarity("impact of tariffs on trade", "tariff impacts on trade")
+    assert query_similarity("history of Rome", "rome history") == 1
+    assert query_similarity("history of Rome", "economy of Japan") == 0
+    assert query_similarity("the", "of") == 1
+
+
+def test_index_cache_reuses_the_index_of_the_last_round(monkeypatch):
+    cache = IndexCache()
+    built = []
+    monkeypatch.setattr(
+        NearDuplicateIndex, "__init__", spy(NearDuplicateIndex.__init__, built)
+    )
+    index = cache.take([TEXT])
+    assert index.add(OTHER)
+    cache.put([TEXT, OTHER], index)
+    assert cache.take([TEXT, OTHER]) is index
+    assert len(built) == 1
+    # taken indexes are not shared, another thread or a rollback builds one
+    again = cache.take([TEXT, OTHER])
+    assert again is not index
+    assert again.is_duplicate(OTHER)
+    assert len(built) == 2
+
+
+def test_index_cache_is_bounded():
+    cache = IndexCache(max_entries=2)
+    for i in range(3):
+        cache.put([str(i)], NearDuplicateIndex())
+    assert len(cache.indexes) == 2
+
+
+def test_add_content_drops_duplicates_across_rounds(make_agent):
+    agent = make_agent()
+    content, dropped = agent.add_content({"content": []}, [TEXT, TEXT, OTHER])
+    assert (content, dropped) == ([TEXT, OTHER], 1)
+    content, dropped = agent.add_content({"content": content}, [OTHER + " Today."])
+    assert (content, dropped) == ([TEXT, OTHER], 1)
+    # a rollback to the first round only knows its content
+    content, dropped = agent.add_content({"content": [TEXT]}, [OTHER])
+    assert (content, dropped) == ([TEXT, OTHER], 0)
@@ -0,0 +1,49 @@
+from essay.events import EventLog, summarize
+
+
+def test_summarize_replaces_large_fields_by_size():
+    update = {
+        "draft": "x" * 500,
+        "content": ["a", "b"],
+        "context_stats": {"snippets": 2, "tokens": 40},
+        "revisions": 2,
+        "lnode": "generate",
+        "count": 1,
+    }
+    assert summarize(update) == (
+        "draft: 500 chars, content: 2 items, "
+        "context_stats: {snippets=2, tokens=40}, revisions: 2"
+    )
+
+
+def test_log_is_bounded_per_thread():
+    log = EventLog(maxlen=8)
+    for i in range(9):
+        log.add("1", str(i))
+    # the oldest quarter is dropped at once
+    assert log.entries("1") == [str(i) for i in range(2, 9)]
+    assert log.entries("2") == []
+
+
+def test_render_only_grows_at_the_end_between_trims():
+    log = EventLog(maxlen=200)
+    rewrites, text = 0, ""
+    for i in range(1000):
+        log.add("1", f"step {i}")
+        new = log.render("1")
+        rewrites += not new.startswith(text)
+        text = new
+    assert text.endswith("step 999\n")
+    # one rewrite per trim of 50 entries, not one per entry once full
+    assert rewrites == (1000 - 200) // 50
+
+
+def test_least_recently_used_threads_are_dropped():
+    log = EventLog(max_threads=2)
+    log.add("1", "a")
+    log.add("2", "b")
+    log.add("1", "c")
+    log.add("3", "d")
+    assert list(log.logs) == ["1", "3"]
+    assert log.entries("2") == []
+    assert log.render("1") == "a\nc\n"
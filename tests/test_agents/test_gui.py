@@ -0,0 +1,181 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from essay.agent import ACCUMULATED
+from essay.batch import initial_state
+from essay.gui import EssayGui
+from essay.ratelimit import Scheduler
+
+NODES = ["planner", "research_plan", "generate", "reflect", "research_critique"]
+
+
+@pytest.fixture
+def make_gui(make_agent):
+    """Factory of interfaces on an agent of the fakes."""
+
+    def make(agent=None, **options) -> EssayGui:
+        agent = agent or make_agent()
+        return EssayGui(
+            agent.graph, metrics=agent.metrics, scheduler=Scheduler(), **options
+        )
+
+    return make
+
+
+def run(gui, session, topic="solar power", stop_after=()) -> list:
+    """Outputs of a run of the interface until it stops."""
+    return list(gui.run_agent(session, True, topic, list(stop_after)))
+
+
+def test_sessions_start_without_threads(make_agent, run_thread, make_gui):
+    agent = make_agent()
+    run_thread(agent.graph, "0", initial_state("saved essay", 1))
+    gui = make_gui(agent)
+    session = gui.new_session()
+    assert session.threads == []
+    # new threads are numbered after the saved ones
+    run(gui, session, stop_after=["planner"])
+    assert session.threads == [1]
+
+
+def test_concurrent_sessions_keep_their_own_threads(make_gui):
+    gui = make_gui(stream=False)
+    sessions = [gui.new_session() for _ in range(4)]
+    outputs = {}
+
+    def work(i):
+        outputs[i] = run(gui, sessions[i], f"topic {i}", stop_after=["generate"])
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    threads = [s.thread_id for s in sessions]
+    assert sorted(threads) == [0, 1, 2, 3]
+    for i, session in enumerate(sessions):
+        assert session.threads == [session.thread_id]
+        values = gui.graph.get_state(session.thread).values
+        assert values["task"] == f"topic {i}"
+        assert values["lnode"] == "generate"
+        # the log of a session only holds its own steps
+        log = outputs[i][-1][0].splitlines()
+        assert [entry.split(" ")[1] for entry in log] == NODES[:3]
+
+
+def test_async_run_matches_sync_run(make_gui):
+    gui = make_gui()
+    sync, asynchronous = gui.new_session(), gui.new_session()
+    run(gui, sync, stop_after=["generate"])
+
+    async def arun():
+        gen = gui.arun_agent(asynchronous, True, "solar power", ["generate"])
+        return [output async for output in gen]
+
+    outputs = asyncio.run(arun())
+    assert outputs[-1][2:] == ("generate", ("reflect",), asynchronous.thread_id, 1, 3)
+    assert (
+        gui.graph.get_state(asynchronous.thread).values["draft"]
+        == gui.graph.get_state(sync.thread).values["draft"]
+    )
+
+
+def test_session_cannot_open_checkpoints_of_another(make_gui):
+    gui = make_gui(stream=False)
+    mine, other = gui.new_session(), gui.new_session()
+    run(gui, mine, stop_after=["planner"])
+    run(gui, other, stop_after=["planner"])
+    theirs = gui.history(other)[0]["checkpoint_id"]
+    assert gui.find_config(mine, theirs) is None
+    assert gui.find_config(other, theirs) is not None
+
+
+def test_snapshots_are_paginated(make_gui):
+    gui = make_gui(stream=False)
+    gui.page_size = 3
+    session = gui.new_session()
+    run(gui, session, stop_after=["reflect"])
+    snapshots = len(gui.history(session, min_step=-1))
+    pages = (snapshots + 2) // 3
+    table, page = gui.snapshot_page(session, 1)
+    assert page == 1
+    assert len(table["value"]) == 3
+    assert table["value"][0][2] == "reflect"
+    assert table["label"].endswith(f"page 1 of {pages}, {snapshots} snapshots")
+    table, page = gui.snapshot_page(session, 99)
+    assert page == pages
+    assert len(table["value"]) == snapshots - 3 * (pages - 1)
+
+
+def test_snapshot_detail_diffs_with_the_previous_checkpoint(make_gui):
+    gui = make_gui(stream=False)
+    session = gui.new_session()
+    run(gui, session, stop_after=["generate"])
+    table, _ = gui.snapshot_page(session, 1)
+    row = SimpleNamespace(row_value=table["value"][0])
+    values, diff = gui.snapshot_detail(session, row)
+    assert json.loads(values)["lnode"] == "generate"
+    assert "== draft" in diff and "== lnode" in diff
+    assert gui.snapshot_detail(gui.new_session(), row) == ("", "")
+
+
+def test_parallel_critics_are_both_logged(make_agent, make_gui):
+    agent = make_agent(critics=["structure", "evidence"])
+    gui = make_gui(agent, stream=False)
+    session = gui.new_session()
+    run(gui, session, stop_after=["critic"])
+    [entry] = [
+        line
+        for line in gui.events.render(session.thread_id).splitlines()
+        if ": critic ->" in line
+    ]
+    assert entry.count("critic_notes: 1 items") == 2
+
+
+def test_copied_state_clears_the_stop_reason(make_gui):
+    gui = make_gui(stream=False)
+    session = gui.new_session()
+    run(gui, session)
+    assert gui.get_disp_state(session)[1] == ()
+    # the last draft, it stopped the thread
+    choice = next(c for c in gui.history_choices(session) if ":generate:" in c)
+    lnode, nnode, *_ = gui.copy_state(session, choice)
+    assert (lnode, nnode) == ("generate", ("reflect",))
+    assert gui.graph.get_state(session.thread).values["stop_reason"] == ""
+    gui.modify_state(session, "draft", "generate", "an edited draft")
+    values = gui.graph.get_state(session.thread).values
+    assert values["draft"] == "an edited draft"
+    assert values["stop_reason"] == ""
+
+
+def test_state_edits_keep_the_accumulated_keys(make_gui):
+    assert set(ACCUMULATED) == {
+        "content_dropped",
+        "count",
+        "critic_notes",
+        "searches_skipped",
+    }
+    gui = make_gui(stream=False)
+    session = gui.new_session()
+    run(gui, session)
+    before = gui.graph.get_state(session.thread).values
+    # the first research round, copying it rolls the searches back with the content
+    choice = [c for c in gui.history_choices(session) if ":research_plan:" in c][-1]
+    old = gui.graph.get_state(gui.find_config(session, choice.split(":")[-1])).values
+    assert len(old["searched"]) < len(before["searched"])
+    gui.copy_state(session, choice)
+    copied = gui.graph.get_state(session.thread).values
+    assert copied["searched"] == old["searched"]
+    assert copied["content"] == old["content"]
+    for key in ACCUMULATED:
+        assert copied.get(key) == before.get(key), key
+    gui.modify_state(session, "critique", "reflect", "an edited critique")
+    modified = gui.graph.get_state(session.thread).values
+    assert modified["critique"] == "an edited critique"
+    assert modified["searched"] == old["searched"]
+    for key in ACCUMULATED:
+        assert modified.get(key) == before.get(key), key
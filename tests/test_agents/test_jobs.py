@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from essay.batch import initial_state
+from essay.fakes import FakeOpenAI
+from essay.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease=60, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_claim_oldest_job_once(queue):
+    first = queue.submit("1", initial_state("solar power"))
+    second = queue.submit("2", initial_state("wind power"))
+    job = queue.claim("a")
+    assert job["id"] == first
+    assert job["status"] == RUNNING
+    assert job["worker"] == "a"
+    assert job["attempts"] == 1
+    assert job["input"]["task"] == "solar power"
+    assert queue.claim("b")["id"] == second
+    assert queue.claim("c") is None
+    assert queue.counts() == {QUEUED: 0, RUNNING: 2, DONE: 0, FAILED: 0}
+
+
+def test_expired_lease_is_claimed_again(queue):
+    job_id = queue.submit("1")
+    queue.lease = 0
+    assert queue.claim("a")["id"] == job_id
+    queue.lease = 60
+    job = queue.claim("b")
+    assert job["id"] == job_id
+    assert job["worker"] == "b"
+    assert job["attempts"] == 2
+    # the first worker lost it and cannot renew or finish it
+    assert not queue.renew(job_id, "a")
+    queue.finish(job_id, "a")
+    assert queue.get(job_id)["status"] == RUNNING
+    assert queue.renew(job_id, "b")
+    queue.finish(job_id, "b")
+    assert queue.get(job_id)["status"] == DONE
+
+
+def test_job_failed_after_max_attempts(queue):
+    job_id = queue.submit("1")
+    queue.lease = 0
+    queue.claim("a")
+    queue.claim("b")
+    assert queue.claim("c") is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "worker lost"
+
+
+def test_worker_runs_job(make_agent, queue):
+    agent = make_agent()
+    job_id = queue.submit("1", initial_state("solar power", 1), stop_after=["generate"])
+    worker = Worker(agent.graph, queue, name="a")
+    worker.run_job(queue.claim("a"))
+    assert queue.get(job_id)["status"] == DONE
+    steps = [entry for _, step, entry in queue.events(job_id) if step]
+    assert [entry.split(" ")[1] for entry in steps] == [
+        "planner",
+        "research_plan",
+        "generate",
+    ]
+
+
+def test_worker_stops_when_lease_is_lost(make_agent, queue):
+    # each node takes longer than a renewal of the lease
+    agent = make_agent(model_options=FakeOpenAI(latency=0.3, words=60).options())
+    queue.lease = 0.3
+    job_id = queue.submit("1", initial_state("solar power", 1))
+    job = queue.claim("a")
+    # another worker took the job over
+    queue.conn.execute("UPDATE jobs SET worker = 'b' WHERE id = ?", (job_id,))
+    Worker(agent.graph, queue, name="a").run_job(job)
+    job = queue.get(job_id)
+    assert job["status"] == RUNNING
+    assert job["worker"] == "b"
+    assert len(queue.events(job_id)) == 1
+
+
+def test_worker_stop(make_agent, queue):
+    worker = Worker(make_agent().graph, queue, name="a", poll=0.01)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.05)
+    worker.stop()
+    thread.join(1)
+    assert not thread.is_alive()
@@ -0,0 +1,110 @@
+import asyncio
+import urllib.request
+
+from essay.batch import initial_state
+from essay.metrics import Metrics, Step, count, instrument, llm_cost, record_call
+
+
+def step(metrics: Metrics, **counters) -> Step:
+    s = Step(metrics)
+    s.add(**counters)
+    return s
+
+
+def test_record_node_totals():
+    metrics = Metrics()
+    metrics.record_node("1", "generate", 1.0, step(metrics, prompt_tokens=100))
+    metrics.record_node("1", "generate", 3.0, step(metrics, prompt_tokens=50))
+    metrics.record_node("2", "planner", 0.5, step(metrics, searches=2))
+
+    [generate, planner] = metrics.node_rows()
+    assert generate[:2] == ["generate", 2]
+    assert generate[4] == 2.0  # mean seconds
+    assert generate[5] == 150
+    assert planner[7] == 2
+    assert metrics.thread_rows("1") == [["generate", 2, 4.0, 150, 0, 0, 0.0, 0.0]]
+    assert metrics.thread_rows("3") == []
+
+
+def test_threads_are_capped():
+    metrics = Metrics(max_threads=2)
+    for thread_id in ("1", "2", "1", "3"):
+        metrics.record_node(thread_id, "generate", 1.0, step(metrics))
+    assert list(metrics.threads) == ["1", "3"]
+    assert metrics.thread_rows("2") == []
+    assert metrics.node_rows()[0][1] == 4
+
+
+def test_prometheus_histograms_and_counters():
+    metrics = Metrics()
+    metrics.record_node("1", "generate", 0.3, step(metrics, cost=0.5))
+    metrics.record_call("openai", 2.0)
+    text = metrics.prometheus()
+    assert 'essay_node_seconds_bucket{node="generate",le="0.25"} 0' in text
+    assert 'essay_node_seconds_bucket{node="generate",le="0.5"} 1' in text
+    assert 'essay_node_seconds_bucket{node="generate",le="+Inf"} 1' in text
+    assert 'essay_call_seconds_count{api="openai"} 1' in text
+    assert 'essay_cost_usd_total{node="generate"} 0.5' in text
+    assert text.endswith("\n")
+
+
+def test_llm_cost():
+    assert llm_cost("gpt-4o", 1_000_000, 100_000) == 3.5
+    assert llm_cost("unknown", 1000, 1000) == 0
+
+
+def test_instrument_counts_the_calls_of_a_node():
+    metrics = Metrics()
+
+    def func(state):
+        count(prompt_tokens=10, completion_tokens=5)
+        record_call("openai", 0.1)
+        return {"n": state["n"] + 1}
+
+    async def afunc(state):
+        count(searches=1)
+        return {"n": state["n"] + 2}
+
+    node = instrument("draft", func, afunc, metrics)
+    assert node.invoke({"n": 1}) == {"n": 2}
+    assert asyncio.run(node.ainvoke({"n": 1})) == {"n": 3}
+    [row] = metrics.node_rows()
+    assert row[0] == "draft"
+    assert row[1] == 2
+    assert row[5:8] == [10, 5, 1]
+    assert metrics.call_seconds["openai"].count == 1
+    # outside a node run the counts have nowhere to go
+    count(prompt_tokens=10)
+    assert metrics.node_rows()[0][5] == 10
+
+
+def test_agent_run_is_recorded_per_thread(make_agent, run_thread):
+    agent = make_agent()
+    run_thread(agent.graph, "1", initial_state("solar power", 1))
+    rows = {row[0]: row for row in agent.metrics.thread_rows("1")}
+    assert {"planner", "research_plan", "generate"} <= set(rows)
+    assert rows["generate"][1] >= 1
+    assert rows["generate"][3] > 0  # prompt tokens
+    assert agent.metrics.thread_rows("2") == []
+
+
+def test_write_and_serve(tmp_path):
+    metrics = Metrics()
+    metrics.record_call("search", 0.2)
+
+    def extra() -> str:
+        return "essay_extra 1\n"
+
+    path = tmp_path / "essay.prom"
+    metrics.write(str(path), extra)
+    assert path.read_text() == metrics.prometheus() + extra()
+    assert not (tmp_path / "essay.prom.tmp").exists()
+
+    server = metrics.serve(0, extra)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode() == metrics.prometheus() + extra()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,96 @@
+from essay.batch import initial_state
+from essay.notes import (
+    NotesCache,
+    batches,
+    cited_notes,
+    dump_notes,
+    load_notes,
+    missing_notes,
+    number_snippets,
+    snippet_key,
+)
+
+SNIPPETS = ["first snippet", "second snippet", "third snippet"]
+
+
+def test_notes_round_trip():
+    notes = {snippet_key("b"): "note b", snippet_key("a"): None}
+    assert load_notes(dump_notes(notes)) == notes
+    # sorted, the same notes give the same string and share a blob
+    assert dump_notes(notes) == dump_notes(dict(reversed(notes.items())))
+    assert load_notes(None) == load_notes("") == {}
+
+
+def test_batches_and_numbering():
+    assert batches([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert batches([], 2) == []
+    assert number_snippets(["a", "b"]) == "[1]\na\n\n[2]\nb"
+
+
+def test_cited_notes_keep_content_numbers():
+    notes = {
+        snippet_key("first snippet"): " condensed first ",
+        snippet_key("second snippet"): "",
+        snippet_key("third snippet"): None,
+    }
+    # the second snippet held nothing worth keeping, the third was skipped
+    assert cited_notes(SNIPPETS, notes) == [
+        "[1] condensed first",
+        "[3] third snippet",
+    ]
+    assert cited_notes(SNIPPETS, {}) == [
+        f"[{i}] {s}" for i, s in enumerate(SNIPPETS, 1)
+    ]
+
+
+def test_missing_notes_looks_up_the_cache(tmp_path):
+    cache = NotesCache(str(tmp_path / "cache.sqlite"), prompt="condense")
+    cache.set(snippet_key("second snippet"), "cached second")
+    notes = {snippet_key("first snippet"): "kept first"}
+    content = SNIPPETS + ["third snippet"]
+    cached, todo = missing_notes(content, notes, cache)
+    assert cached == {snippet_key("second snippet"): "cached second"}
+    assert todo == ["third snippet"]
+    assert missing_notes(content, notes, None) == (
+        {},
+        ["second snippet", "third snippet"],
+    )
+
+
+def test_notes_cache_is_per_prompt(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    NotesCache(path, prompt="condense").set("key", "note")
+    assert NotesCache(path, prompt="condense").get_many(["key", "other"]) == {
+        "key": "note"
+    }
+    assert NotesCache(path, prompt="summarize").get_many(["key"]) == {}
+
+
+def compress_steps(graph, thread_id: str) -> list:
+    """Values of the compress steps of a thread, oldest first."""
+    history = graph.get_state_history({"configurable": {"thread_id": thread_id}})
+    return [
+        s.values for s in reversed(list(history)) if s.values.get("lnode") == "compress"
+    ]
+
+
+def test_compressed_threads_share_the_notes_cache(make_agent, run_thread, tmp_path):
+    agent = make_agent(
+        compress_research=True, notes_cache=str(tmp_path / "cache.sqlite")
+    )
+    run_thread(agent.graph, "1", initial_state("solar power", 1))
+    [first, *_] = compress_steps(agent.graph, "1")
+    stats = first["notes_stats"]
+    assert stats["condensed"] == stats["snippets"] > 0
+    assert stats["cached"] == 0
+    # snippets the model skipped have no notes to cache
+    written = [n for n in load_notes(first["notes"]).values() if n is not None]
+    assert written
+    # a thread on the same topic finds the same snippets, partly condensed
+    values = run_thread(agent.graph, "2", initial_state("solar power", 1))
+    [second, *_] = compress_steps(agent.graph, "2")
+    assert second["notes_stats"]["cached"] == len(written)
+    assert second["notes_stats"]["condensed"] == stats["snippets"] - len(written)
+    notes = load_notes(values["notes"])
+    assert set(notes) == {snippet_key(s) for s in values["content"]}
+    assert agent.research_content(values) == cited_notes(values["content"], notes)
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from essay.ratelimit import (
+    BATCH,
+    RateLimiter,
+    Scheduler,
+    is_retryable,
+    priority,
+    retry_after,
+)
+
+
+# Error of an HTTP client, with the status and headers of its response
+class HttpError(Exception):
+    def __init__(self, status: int, headers: dict = None) -> None:
+        super().__init__(f"status {status}")
+        self.response = SimpleNamespace(status_code=status, headers=headers or {})
+
+
+# Function failing with the given errors before it returns
+class Flaky:
+    def __init__(self, *errors: Exception) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def empty_limiter(rpm: float = 600) -> RateLimiter:
+    """Limiter letting a call go every 60/rpm seconds, starting empty."""
+    limiter = RateLimiter("test", rpm=rpm)
+    limiter.requests.level = 0
+    return limiter
+
+
+def test_interactive_calls_go_before_queued_batch_calls():
+    limiter = empty_limiter()
+    order = []
+
+    def call(label: str, level: int) -> None:
+        with priority(level):
+            limiter.acquire()
+        order.append(label)
+
+    threads = []
+    for label, level in (("batch 1", BATCH), ("batch 2", BATCH), ("chat", 0)):
+        thread = threading.Thread(target=call, args=(label, level))
+        thread.start()
+        threads.append(thread)
+        while len(limiter.queue) < len(threads):
+            time.sleep(0.001)
+    assert limiter.stats()["queued_batch"] == 2
+    for thread in threads:
+        thread.join()
+
+    assert order == ["chat", "batch 1", "batch 2"]
+    stats = limiter.stats()
+    assert stats["calls"] == 3
+    assert stats["queued"] == 0
+    assert stats["max_queued"] == 3
+
+
+def test_requests_are_spaced_by_the_bucket():
+    limiter = empty_limiter(rpm=600)
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.25
+
+
+def test_cancelled_wait_leaves_the_queue():
+    limiter = empty_limiter(rpm=6)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.aacquire(), 0.05)
+
+    asyncio.run(main())
+    assert limiter.queue == []
+    assert limiter.stats()["calls"] == 0
+
+
+def test_settle_returns_unused_tokens():
+    limiter = RateLimiter("test", tpm=1000)
+    limiter.acquire(tokens=800)
+    limiter.settle(800, 300)
+    assert limiter.tokens.level == pytest.approx(700, abs=1)
+    assert limiter.stats()["tokens"] == 300
+
+
+def test_retryable_errors():
+    assert is_retryable(ConnectionError())
+    assert is_retryable(TimeoutError())
+    assert is_retryable(HttpError(429))
+    assert is_retryable(HttpError(503))
+    assert not is_retryable(HttpError(400))
+    assert not is_retryable(ValueError())
+    assert retry_after(HttpError(429, {"retry-after": "2"})) == 2
+    assert retry_after(HttpError(429, {"retry-after": "soon"})) is None
+
+
+def test_call_retries_retryable_errors():
+    limiter = RateLimiter("test", base_delay=0.01)
+    flaky = Flaky(ConnectionError(), HttpError(502))
+    assert limiter.call(flaky) == "ok"
+    assert flaky.calls == 3
+    assert limiter.stats()["retries"] == 2
+    assert limiter.stats()["calls"] == 3
+
+
+def test_call_raises_other_errors_at_once():
+    limiter = RateLimiter("test", base_delay=0.01)
+    flaky = Flaky(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        limiter.call(flaky)
+    assert flaky.calls == 1
+    assert limiter.stats()["retries"] == 0
+
+
+def test_call_gives_up_after_max_retries():
+    limiter = RateLimiter("test", max_retries=2, base_delay=0.01)
+    flaky = Flaky(*[ConnectionError() for _ in range(5)])
+    with pytest.raises(ConnectionError):
+        limiter.call(flaky)
+    assert flaky.calls == 3
+
+
+def test_rate_limit_pauses_every_call():
+    limiter = RateLimiter("test", base_delay=0.01)
+    delay = limiter.backoff(HttpError(429, {"retry-after": "0.2"}), 0)
+    assert delay == pytest.approx(0.2)
+    assert limiter.stats()["throttled"] == 1
+    # a call that did not fail waits for the pause as well
+    assert limiter.acquire() >= 0.15
+
+
+def test_acall_retries():
+    limiter = RateLimiter("test", base_delay=0.01)
+    flaky = Flaky(TimeoutError())
+
+    async def call():
+        return flaky()
+
+    assert asyncio.run(limiter.acall(call)) == "ok"
+    assert flaky.calls == 2
+    assert limiter.stats()["retries"] == 1
+
+
+def test_scheduler_limiters():
+    scheduler = Scheduler()
+    openai = scheduler.configure("openai", rpm=100)
+    assert scheduler.limiter("openai") is openai
+    assert scheduler.limiter("search").requests is None
+    scheduler.limiter("search").call(Flaky())
+    assert set(scheduler.stats()) == {"openai", "search"}
+    assert 'essay_ratelimit_calls_total{api="search"} 1' in scheduler.prometheus()
@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+import pytest
+
+from essay.retrieval import LocalIndex, chunks, match_query
+
+SOLAR = """Solar panels turn sunlight into electricity.
+
+Photovoltaic cells are made of silicon and lose some efficiency as they heat up."""
+WIND = "Wind turbines turn the energy of the wind into electricity."
+
+
+@pytest.fixture
+def index(tmp_path):
+    local = LocalIndex(str(tmp_path / "index.sqlite"))
+    yield local
+    local.close()
+
+
+@pytest.fixture
+def docs(tmp_path):
+    root = tmp_path / "docs"
+    (root / "energy").mkdir(parents=True)
+    (root / "solar.txt").write_text(SOLAR)
+    (root / "energy" / "wind.md").write_text(WIND)
+    (root / "notes.pdf").write_text("not indexed")
+    return root
+
+
+def test_chunks_follow_paragraphs():
+    assert chunks("one two\n\nthree four\n\nfive", words=4) == [
+        "one two three four",
+        "five",
+    ]
+    assert chunks(" ".join(["word"] * 5), words=2) == ["word word"] * 2 + ["word"]
+    assert chunks("") == []
+
+
+def test_match_query_quotes_words():
+    assert match_query('solar "power" AND -wind?') == (
+        '"solar" OR "power" OR "and" OR "wind"'
+    )
+    assert match_query("?!") == ""
+
+
+def test_index_directory(index, docs):
+    assert index.index_directory(str(docs)) == {
+        "added": 2,
+        "updated": 0,
+        "removed": 0,
+        "unchanged": 0,
+    }
+    assert index.stats() == {"documents": 2, "passages": 2}
+
+
+def test_reindex_reads_only_changed_files(index, docs):
+    index.index_directory(str(docs))
+    (docs / "solar.txt").write_text(SOLAR + "\n\nThey last about thirty years.")
+    os.remove(docs / "energy" / "wind.md")
+    (docs / "hydro.txt").write_text("Dams store water to generate electricity.")
+    assert index.index_directory(str(docs)) == {
+        "added": 1,
+        "updated": 1,
+        "removed": 1,
+        "unchanged": 0,
+    }
+    assert index.index_directory(str(docs))["unchanged"] == 2
+    assert index.stats() == {"documents": 2, "passages": 2}
+    assert not index.search("turbines")["results"]
+    assert index.search("thirty years")["results"]
+
+
+def test_search_results(index, docs):
+    index.index_directory(str(docs))
+    response = index.search("silicon solar cells", max_results=5)
+    assert response["query"] == "silicon solar cells"
+    [best, *_] = response["results"]
+    assert set(best) == {"title", "url", "content", "score"}
+    assert best["title"] == "solar"
+    assert best["url"] == f"file://{docs / 'solar.txt'}#0"
+    assert "silicon" in best["content"]
+    # both documents mention electricity, best matches come first
+    results = index.search("electricity", max_results=1)["results"]
+    assert len(results) == 1
+    scores = [r["score"] for r in index.search("electricity wind")["results"]]
+    assert scores == sorted(scores, reverse=True)
+    assert index.search("?")["results"] == []
+
+
+def test_html_tags_are_not_indexed(index):
+    index.add("/docs/page.html", "<p class='tidal'>Tides move water.</p>")
+    assert index.search("tidal")["results"] == []
+    assert index.search("tides")["results"][0]["content"] == "Tides move water."
+
+
+def test_asearch_matches_search(index, docs):
+    index.index_directory(str(docs))
+    assert asyncio.run(index.asearch("wind", 3)) == index.search("wind", 3)
+
+
+def test_agent_researches_the_local_index(make_agent, index, docs):
+    index.index_directory(str(docs))
+    agent = make_agent(search_backend=index)
+    content, _ = agent.research({}, ["solar panels"])
+    assert any("Solar panels" in c for c in content)
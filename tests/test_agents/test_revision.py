@@ -0,0 +1,46 @@
+from essay.revision import join_sections, number_sections, splice, split_sections
+
+DRAFT = """Intro paragraph before any heading.
+
+# Causes
+
+First cause.
+
+Second cause.
+
+# Effects
+
+Effects paragraph.
+
+**Conclusion**
+
+Closing words."""
+
+
+def test_split_on_headings():
+    sections = split_sections(DRAFT)
+    assert sections == [
+        "Intro paragraph before any heading.",
+        "# Causes\n\nFirst cause.\n\nSecond cause.",
+        "# Effects\n\nEffects paragraph.",
+        "**Conclusion**\n\nClosing words.",
+    ]
+    assert join_sections(sections) == DRAFT
+
+
+def test_split_paragraphs_without_headings():
+    assert split_sections("one\n\ntwo\n   \nthree\n") == ["one", "two", "three"]
+    assert split_sections("") == []
+
+
+def test_splice_replaces_only_revised_sections():
+    sections = split_sections(DRAFT)
+    revised = splice(sections, {1: "# Causes\n\nA better cause."})
+    assert revised[1] == "# Causes\n\nA better cause."
+    assert revised[0] == sections[0]
+    assert revised[2:] == sections[2:]
+    assert splice(sections, {}) == sections
+
+
+def test_number_sections():
+    assert number_sections(["a", "b"]) == "[1]\na\n\n[2]\nb"
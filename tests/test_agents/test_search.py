@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from essay.fakes import FakeSearch
+
+
+# Search taking longer for the queries naming it
+class SlowSearch(FakeSearch):
+    def __init__(self, slow: float) -> None:
+        super().__init__(latency=0.2, words=20)
+        self.slow = slow
+
+    def search(self, query: str, max_results: int = 5, **params) -> dict:
+        time.sleep(self.slow if "slow" in query else self.latency)
+        return self.results(query, max_results)
+
+
+# Async `SlowSearch`
+class AsyncSlowSearch(SlowSearch):
+    async def search(self, query: str, max_results: int = 5, **params) -> dict:
+        await asyncio.sleep(self.slow if "slow" in query else self.latency)
+        return self.results(query, max_results)
+
+
+def slow_agent(make_agent, **options):
+    return make_agent(
+        search_client=SlowSearch(slow=2),
+        asearch_client=AsyncSlowSearch(slow=2),
+        max_search_workers=1,
+        **options,
+    )
+
+
+def test_searches_keep_query_order(make_agent, fake_search):
+    agent = make_agent()
+    queries = ["history of Rome", "economy of Japan", "climate of Chile"]
+    assert [q for q, _ in agent.search(queries)] == queries
+    assert [q for q, _ in asyncio.run(agent.asearch(queries))] == queries
+    assert fake_search.requests == 6
+    assert agent.search([]) == []
+    assert asyncio.run(agent.asearch([])) == []
+
+
+def test_search_timeout_runs_from_the_start_of_each_search(make_agent):
+    agent = slow_agent(make_agent, search_timeout=0.5)
+    # one at a time, the last fast query waits longer than the timeout
+    queries = ["one", "two", "three", "slow four"]
+    started = time.perf_counter()
+    assert [q for q, _ in agent.search(queries)] == ["one", "two", "three"]
+    assert time.perf_counter() - started < 1.5
+    found = asyncio.run(agent.asearch(queries))
+    assert [q for q, _ in found] == ["one", "two", "three"]
+
+
+def test_round_deadline_covers_queued_searches(make_agent):
+    agent = slow_agent(make_agent, search_timeout=5, search_round_timeout=0.5)
+    queries = ["one", "two", "three", "four"]
+    started = time.perf_counter()
+    assert [q for q, _ in agent.search(queries)] == ["one", "two"]
+    assert time.perf_counter() - started < 0.8
+    started = time.perf_counter()
+    assert [q for q, _ in asyncio.run(agent.asearch(queries))] == ["one", "two"]
+    assert time.perf_counter() - started < 0.8
+
+
+def test_failed_search_is_left_out(make_agent):
+    # Search failing for the queries naming it
+    class FailingSearch(FakeSearch):
+        def search(self, query: str, max_results: int = 5, **params) -> dict:
+            if "fail" in query:
+                raise ValueError("bad query")
+            return self.results(query, max_results)
+
+    agent = make_agent(search_client=FailingSearch(latency=0))
+    found = agent.search(["one", "fail two", "three"])
+    assert [q for q, _ in found] == ["one", "three"]
+    assert [q for q, _ in asyncio.run(agent.asearch(["fail", "four"]))] == ["four"]